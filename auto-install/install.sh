@@ -522,7 +522,7 @@ echo "**      Configuring Supervisord...                                     **"
 echo "**                                                                     **" | tee -a ~/logs/pifire_install.log
 echo "*************************************************************************" | tee -a ~/logs/pifire_install.log
 
-# Copy configuration files (control.conf, webapp.conf) to supervisor config directory
+# Copy configuration files (control.conf, webapp.conf, media.conf) to supervisor config directory
 if [ "$OS_BITS" = "64" ] && [ ! "$VENV_TYPE" = "vanilla" ]; then
     cd /usr/local/bin/pifire/auto-install/supervisor
 else
@@ -532,6 +532,7 @@ fi
 # Add the current username to the configuration files 
 echo "user=$USER" | tee -a control.conf > /dev/null
 echo "user=$USER" | tee -a webapp.conf > /dev/null
+echo "user=$USER" | tee -a media.conf > /dev/null
 
 $SUDO cp *.conf /etc/supervisor/conf.d/
 
@@ -10,6 +10,7 @@ from common.common import (
 	read_current, 
 	read_status, 
 	read_probe_status, 
+	read_generic_key, 
 	deep_update
 	)
 from common.app import get_system_command_output, create_ui_hash
@@ -86,6 +87,22 @@ def api_page(action=None, arg0=None, arg1=None, arg2=None, arg3=None):
 			status['probe_status'] = probe_status
 			status['critical_error'] = control.get('critical_error', False)
 			return jsonify({'current':current_temps, 'notify_data':notify_data, 'status':status}), 201
+		elif action == 'eta':
+			''' ETA, rate (degrees / minute) and confidence of every probe, estimated by the control process '''
+			try:
+				probe_eta = read_generic_key('probe_eta')
+			except:
+				probe_eta = {}
+			return jsonify({'probe_eta' : probe_eta})
+		elif action == 'timing':
+			''' Stage timing (milliseconds) and scheduler statistics (seconds) of the control work cycle '''
+			timing = {}
+			for key in ['control_timing', 'control_scheduler']:
+				try:
+					timing[key] = read_generic_key(key)
+				except:
+					timing[key] = {}
+			return jsonify({'timing' : timing['control_timing'], 'scheduler' : timing['control_scheduler']})
 		elif action == 'hopper':
 			pelletdb = read_pellet_db()
 			pelletlevel = pelletdb['current']['hopper_level']
@@ -246,6 +263,7 @@ def api_page(action=None, arg0=None, arg1=None, arg2=None, arg3=None):
 				''' Test a WLED profile '''
 				try:
 					import requests
+					from notify.http_session import get_session
 					
 					device_address = request_json.get('device_address', '').strip()
 					profile_number = request_json.get('profile_number', 1)
@@ -271,7 +289,7 @@ def api_page(action=None, arg0=None, arg1=None, arg2=None, arg3=None):
 						"ps": profile_number
 					}
 					
-					response = requests.post(url, json=payload, timeout=5)
+					response = get_session('wled').post(url, json=payload, timeout=5)
 					response.raise_for_status()
 					
 					return jsonify({
@@ -5,9 +5,9 @@ from flask import render_template, request, current_app, jsonify, redirect, send
 from werkzeug.utils import secure_filename
 from common.common import read_settings, epoch_to_time, generate_uuid
 from common.app import prepare_annotations, prepare_metrics_csv, allowed_file, prepare_csv, prepare_event_totals, paginate_list, create_safe_name
-from file_mgmt.cookfile import read_cookfile, upgrade_cookfile
-from file_mgmt.common import fixup_assets, read_json_file_data, update_json_file_data, remove_assets
-from file_mgmt.media import add_asset, set_thumbnail, unpack_thumb
+from file_mgmt.cookfile import read_cookfile, read_cookfile_member, read_cookfile_index, upgrade_cookfile, downsample_chartdata
+from file_mgmt.common import fixup_assets, update_json_file_data, remove_assets, compact_file, file_lock
+from file_mgmt.media import queue_asset, read_media_job, unpack_thumb
 
 from . import cookfile_bp
 
@@ -27,9 +27,16 @@ def cookfile_page():
             if(status == 'OK'):
                 annotations = prepare_annotations(0, cookfiledata['events'])
 
+                chart_data = cookfiledata['graph_data']['chart_data']
+                time_labels = cookfiledata['graph_data']['time_labels']
+                data_points = int(requestjson.get('data_points', settings['history_page'].get('cookfile_datapoints', 0)))
+                if data_points > 0 and len(time_labels) > data_points:
+                    algorithm = requestjson.get('algorithm', settings['history_page'].get('downsample', 'lttb'))
+                    chart_data, time_labels = downsample_chartdata(chart_data, data_points, algorithm=algorithm)
+
                 json_data = {
-                    'chart_data' : cookfiledata['graph_data']['chart_data'],
-                    'time_labels' : cookfiledata['graph_data']['time_labels'],
+                    'chart_data' : chart_data,
+                    'time_labels' : time_labels,
                     'probe_mapper' : cookfiledata['graph_data']['probe_mapper'],
                     'annotations' : annotations
                 }
@@ -39,7 +46,7 @@ def cookfile_page():
             assetlist = []
             cookfilename = requestjson['cookfilename']
             commentid = requestjson['commentid']
-            comments, status = read_json_file_data(cookfilename, 'comments')
+            comments, status = read_cookfile_member(cookfilename, 'comments')
             for comment in comments:
                 if comment['id'] == commentid:
                     assetlist = comment['assets']
@@ -52,8 +59,8 @@ def cookfile_page():
             cookfilename = requestjson['cookfilename']
             commentid = requestjson['commentid']
             
-            assets, status = read_json_file_data(cookfilename, 'assets')
-            metadata, status = read_json_file_data(cookfilename, 'metadata')
+            assets, status = read_cookfile_member(cookfilename, 'assets')
+            metadata, status = read_cookfile_member(cookfilename, 'metadata')
             for asset in assets:
                 asset_object = {
                     'assetname' : asset['filename'],
@@ -64,7 +71,7 @@ def cookfile_page():
 
             # Grab list of selected assets in comment currently
             selectedassets = []
-            comments, status = read_json_file_data(cookfilename, 'comments')
+            comments, status = read_cookfile_member(cookfilename, 'comments')
             for comment in comments:
                 if comment['id'] == commentid:
                     selectedassets = comment['assets']
@@ -81,7 +88,7 @@ def cookfile_page():
             # Grab list of all assets in file, build assetlist
             assetlist = []
             cookfilename = requestjson['cookfilename']
-            assets, status = read_json_file_data(cookfilename, 'assets')
+            assets, status = read_cookfile_member(cookfilename, 'assets')
 
             for asset in assets:
                 asset_object = {
@@ -98,7 +105,7 @@ def cookfile_page():
             commentid = requestjson['commentid']
             cookfilename = requestjson['cookfilename']
 
-            comments, status = read_json_file_data(cookfilename, 'comments')
+            comments, status = read_cookfile_member(cookfilename, 'comments')
             if status == 'OK':
                 assetlist = []
                 for comment in comments:
@@ -134,11 +141,12 @@ def cookfile_page():
         if('dl_cookfile' in requestform):
             # Download the full JSON Cook File Locally
             filename = requestform['dl_cookfile']
+            compact_file(filename)  # Drop superseded members before the file leaves PiFire
             return send_file(filename, as_attachment=True, max_age=0)
 
         if('dl_eventfile' in requestform):
             filename = requestform['dl_eventfile']
-            cookfiledata, status = read_json_file_data(filename, 'events')
+            cookfiledata, status = read_cookfile_member(filename, 'events')
             if(status == 'OK'):
                 csvfilename = prepare_metrics_csv(cookfiledata, filename)
                 return send_file(csvfilename, as_attachment=True, max_age=0)
@@ -215,6 +223,7 @@ def cookfile_page():
                 uploadedfiles = [uploadedfile]
 
             status = 'ERROR'
+            jobs = []
             for remotefile in uploadedfiles:
                 if (remotefile.filename != ''):
                     # Reload Cook File
@@ -228,14 +237,18 @@ def cookfile_page():
                         filename = secure_filename(remotefile.filename)
                         pathfile = os.path.join(tmp_path, filename)
                         remotefile.save(pathfile)
-                        asset_id, asset_filetype = add_asset(cookfilename, tmp_path, filename)
-                        if 'ulthumbfn' in requestform:
-                            set_thumbnail(cookfilename, f'{asset_id}.{asset_filetype}')
-                        #  Reload all of the data
-                        cookfilestruct, status = read_cookfile(cookfilename)
+                        job_id, asset_id, asset_filetype = queue_asset(cookfilename, tmp_path, filename, thumbnail=('ulthumbfn' in requestform))
+                        jobs.append(job_id)
                     else:
                         errors.append('Disallowed File Upload.')
 
+            media_jobs = []
+            if jobs:
+                # The images are processed by the media worker, the page polls the pending jobs and reloads when done
+                media_jobs = [job_id for job_id in jobs if (read_media_job(job_id) or {}).get('status') in ['queued', 'processing']]
+                #  Reload all of the data
+                cookfilestruct, status = read_cookfile(cookfilename)
+
             if(status == 'OK'):
                 events = cookfilestruct['events']
                 event_totals = prepare_event_totals(events)
@@ -260,6 +273,7 @@ def cookfile_page():
                             labels=labels, 
                             assets=assets, 
                             errors=errors, 
+                            media_jobs=media_jobs, 
                             page_theme=settings['globals'].get('page_theme', 'light'),
                             grill_name=settings['globals'].get('grill_name', '')
                             )
@@ -268,11 +282,17 @@ def cookfile_page():
             page = int(requestform['page'])
             reverse = True if requestform['reverse'] == 'true' else False
             itemsperpage = int(requestform['itemsperpage'])
-            filelist = _get_cookfilelist()
+            # Optional sorting / filtering on the indexed metadata
+            sortkey = requestform.get('sortkey', 'filename')
+            if sortkey not in ['filename', 'title', 'starttime', 'endtime', 'size']:
+                sortkey = 'filename'
+            search = requestform.get('filter', '').lower()
             cookfilelist = []
-            for filename in filelist:
-                cookfilelist.append({'filename' : filename, 'title' : '', 'thumbnail' : ''})
-            paginated_cookfile = paginate_list(cookfilelist, 'filename', reverse, itemsperpage, page)
+            for filename, entry in read_cookfile_index(current_app.config['HISTORY_FOLDER']).items():
+                if search and search not in filename.lower() and search not in entry['title'].lower():
+                    continue
+                cookfilelist.append({'filename' : filename, **entry})
+            paginated_cookfile = paginate_list(cookfilelist, sortkey, reverse, itemsperpage, page)
             paginated_cookfile['displaydata'] = _get_cookfilelist_details(paginated_cookfile['displaydata'])
             return render_template('cookfile/_cookfile_list.html', pgntdcf = paginated_cookfile)
 
@@ -451,6 +471,12 @@ def cookfile_page():
     errors.append('Something unexpected has happened.')
     return jsonify({'result' : 'ERROR', 'errors' : errors})
 
+@cookfile_bp.route('/media/<job_id>', methods=['GET'])
+def cookfile_media_job(job_id):
+    # Status of a queued media upload (queued / processing / done / error)
+    job = read_media_job(job_id)
+    return jsonify(job if job is not None else {'status' : 'unknown'})
+
 @cookfile_bp.route('/update', methods=['POST','GET'])
 def cookfile_update():
     settings = read_settings()
@@ -460,150 +486,139 @@ def cookfile_update():
         requestjson = request.json 
         if('comments' in requestjson):
             filename = requestjson['filename']
-            cookfiledata, status = read_json_file_data(filename, 'comments')
-
-            if('commentnew' in requestjson):
-                now = datetime.datetime.now()
-                comment_struct = {}
-                comment_struct['text'] = requestjson['commentnew']
-                comment_struct['id'] = generate_uuid()
-                comment_struct['edited'] = ''
-                comment_struct['date'] = now.strftime('%Y-%m-%d')
-                comment_struct['time'] = now.strftime('%H:%M')
-                comment_struct['assets'] = []
-                cookfiledata.append(comment_struct)
-                result = update_json_file_data(cookfiledata, filename, 'comments')
-                if(result == 'OK'):
-                    return jsonify({'result' : 'OK', 'newcommentid' : comment_struct['id'], 'newcommentdt': comment_struct['date'] + ' ' + comment_struct['time']})
-            if('delcomment' in requestjson):
-                for item in cookfiledata:
-                    if item['id'] == requestjson['delcomment']:
-                        cookfiledata.remove(item)
-                        result = update_json_file_data(cookfiledata, filename, 'comments')
-                        if(result == 'OK'):
-                            return jsonify({'result' : 'OK'})
-            if('editcomment' in requestjson):
-                for item in cookfiledata:
-                    if item['id'] == requestjson['editcomment']:
-                        return jsonify({'result' : 'OK', 'text' : item['text']})
-            if('savecomment' in requestjson):
-                for item in cookfiledata:
-                    if item['id'] == requestjson['savecomment']:
-                        now = datetime.datetime.now()
-                        item['text'] = requestjson['text']
-                        item['edited'] = now.strftime('%Y-%m-%d %H:%M')
-                        result = update_json_file_data(cookfiledata, filename, 'comments')
-                        if(result == 'OK'):
-                            return jsonify({'result' : 'OK', 'text' : item['text'].replace('\n', '<br>'), 'edited' : item['edited'], 'datetime' : item['date'] + ' ' + item['time']})
+            with file_lock(filename):
+                cookfiledata, status = read_cookfile_member(filename, 'comments')
+
+                if('commentnew' in requestjson):
+                    now = datetime.datetime.now()
+                    comment_struct = {}
+                    comment_struct['text'] = requestjson['commentnew']
+                    comment_struct['id'] = generate_uuid()
+                    comment_struct['edited'] = ''
+                    comment_struct['date'] = now.strftime('%Y-%m-%d')
+                    comment_struct['time'] = now.strftime('%H:%M')
+                    comment_struct['assets'] = []
+                    cookfiledata.append(comment_struct)
+                    result = update_json_file_data(cookfiledata, filename, 'comments')
+                    if(result == 'OK'):
+                        return jsonify({'result' : 'OK', 'newcommentid' : comment_struct['id'], 'newcommentdt': comment_struct['date'] + ' ' + comment_struct['time']})
+                if('delcomment' in requestjson):
+                    for item in cookfiledata:
+                        if item['id'] == requestjson['delcomment']:
+                            cookfiledata.remove(item)
+                            result = update_json_file_data(cookfiledata, filename, 'comments')
+                            if(result == 'OK'):
+                                return jsonify({'result' : 'OK'})
+                if('editcomment' in requestjson):
+                    for item in cookfiledata:
+                        if item['id'] == requestjson['editcomment']:
+                            return jsonify({'result' : 'OK', 'text' : item['text']})
+                if('savecomment' in requestjson):
+                    for item in cookfiledata:
+                        if item['id'] == requestjson['savecomment']:
+                            now = datetime.datetime.now()
+                            item['text'] = requestjson['text']
+                            item['edited'] = now.strftime('%Y-%m-%d %H:%M')
+                            result = update_json_file_data(cookfiledata, filename, 'comments')
+                            if(result == 'OK'):
+                                return jsonify({'result' : 'OK', 'text' : item['text'].replace('\n', '<br>'), 'edited' : item['edited'], 'datetime' : item['date'] + ' ' + item['time']})
         
         if('metadata' in requestjson):
             filename = requestjson['filename']
-            cookfiledata, status = read_json_file_data(filename, 'metadata')
-            if(status == 'OK'):
-                if('editTitle' in requestjson):
-                    cookfiledata['title'] = requestjson['editTitle']
-                    result = update_json_file_data(cookfiledata, filename, 'metadata')
-                    if(result == 'OK'):
-                        return jsonify({'result' : 'OK'})
-                    else: 
-                        return jsonify({'result' : 'ERROR'})
+            with file_lock(filename):
+                cookfiledata, status = read_cookfile_member(filename, 'metadata')
+                if(status == 'OK'):
+                    if('editTitle' in requestjson):
+                        cookfiledata['title'] = requestjson['editTitle']
+                        result = update_json_file_data(cookfiledata, filename, 'metadata')
+                        if(result == 'OK'):
+                            return jsonify({'result' : 'OK'})
+                        else: 
+                            return jsonify({'result' : 'ERROR'})
         
         if('graph_labels' in requestjson):
             filename = requestjson['filename']
             
-            ''' Update graph_labels.json '''
-            cookfiledata, result = read_json_file_data(filename, 'graph_labels')
-            if(result != 'OK'):
-                return jsonify({'result' : 'ERROR'})
-
-            old_label = requestjson['old_label']
-            new_label = requestjson['new_label']
-            new_label_safe = create_safe_name(new_label)
-
-            for category in cookfiledata:
-                if new_label_safe in cookfiledata[category].keys():
-                    result = 'Label already exists!'
-                    break
-                if old_label in cookfiledata[category].keys():
-                    cookfiledata[category].pop(old_label)
-                    cookfiledata[category][new_label_safe] = new_label 
+            with file_lock(filename):
+                ''' Update graph_labels.json '''
+                cookfiledata, result = read_cookfile_member(filename, 'graph_labels')
+                if(result != 'OK'):
+                    return jsonify({'result' : 'ERROR'})
+
+                old_label = requestjson['old_label']
+                new_label = requestjson['new_label']
+                new_label_safe = create_safe_name(new_label)
+
+                for category in cookfiledata:
+                    if new_label_safe in cookfiledata[category].keys():
+                        result = 'Label already exists!'
+                        break
+                    if old_label in cookfiledata[category].keys():
+                        cookfiledata[category].pop(old_label)
+                        cookfiledata[category][new_label_safe] = new_label 
             
-            if(result != 'OK'):
-                return jsonify({'result' : 'ERROR'})
-
-            result = update_json_file_data(cookfiledata, filename, 'graph_labels')
-            if(result != 'OK'):
-                return jsonify({'result' : 'ERROR'})
-
-            ''' Update graph_data.json '''
-            cookfiledata, result = read_json_file_data(filename, 'graph_data')
-            if(result != 'OK'):
-                return jsonify({'result' : 'ERROR'})
-
-            for category in cookfiledata['probe_mapper']:
-                if old_label in cookfiledata['probe_mapper'][category].keys():
-                    cookfiledata['probe_mapper'][category][new_label_safe] = cookfiledata['probe_mapper'][category][old_label]
-                    cookfiledata['probe_mapper'][category].pop(old_label)
-                    list_position = cookfiledata['probe_mapper'][category][new_label_safe]
-                    if category == 'targets': 
-                        addendum = ' Target'
-                    elif category == 'primarysp':
-                        addendum = ' Set Point'
-                    else:
-                        addendum = ''
-                    cookfiledata['chart_data'][list_position]['label'] = new_label + addendum 
-
-            result = update_json_file_data(cookfiledata, filename, 'graph_data')
-            if(result != 'OK'):
-                return jsonify({'result' : 'ERROR'})
-
-            return jsonify({'result' : 'OK', 'new_label_safe' : new_label_safe})
+                if(result != 'OK'):
+                    return jsonify({'result' : 'ERROR'})
+
+                result = update_json_file_data(cookfiledata, filename, 'graph_labels')
+                if(result != 'OK'):
+                    return jsonify({'result' : 'ERROR'})
+
+                ''' Update graph_data.json '''
+                cookfiledata, result = read_cookfile_member(filename, 'graph_data')
+                if(result != 'OK'):
+                    return jsonify({'result' : 'ERROR'})
+
+                for category in cookfiledata['probe_mapper']:
+                    if old_label in cookfiledata['probe_mapper'][category].keys():
+                        cookfiledata['probe_mapper'][category][new_label_safe] = cookfiledata['probe_mapper'][category][old_label]
+                        cookfiledata['probe_mapper'][category].pop(old_label)
+                        list_position = cookfiledata['probe_mapper'][category][new_label_safe]
+                        if category == 'targets': 
+                            addendum = ' Target'
+                        elif category == 'primarysp':
+                            addendum = ' Set Point'
+                        else:
+                            addendum = ''
+                        cookfiledata['chart_data'][list_position]['label'] = new_label + addendum 
+
+                result = update_json_file_data(cookfiledata, filename, 'graph_data')
+                if(result != 'OK'):
+                    return jsonify({'result' : 'ERROR'})
+
+                return jsonify({'result' : 'OK', 'new_label_safe' : new_label_safe})
 
         if('media' in requestjson):
             filename = requestjson['filename']
-            assetfilename = requestjson['assetfilename']
-            commentid = requestjson['commentid']
-            state = requestjson['state']
-            comments, status = read_json_file_data(filename, 'comments')
-            result = 'OK'
-            for index in range(0, len(comments)):
-                if comments[index]['id'] == commentid:
-                    if assetfilename in comments[index]['assets'] and state == 'selected':
-                        comments[index]['assets'].remove(assetfilename)
-                        result = update_json_file_data(comments, filename, 'comments')
-                    elif assetfilename not in comments[index]['assets'] and state == 'unselected':
-                        comments[index]['assets'].append(assetfilename)
-                        result = update_json_file_data(comments, filename, 'comments')
-                    break
-
-            return jsonify({'result' : result})
+            with file_lock(filename):
+                assetfilename = requestjson['assetfilename']
+                commentid = requestjson['commentid']
+                state = requestjson['state']
+                comments, status = read_cookfile_member(filename, 'comments')
+                result = 'OK'
+                for index in range(0, len(comments)):
+                    if comments[index]['id'] == commentid:
+                        if assetfilename in comments[index]['assets'] and state == 'selected':
+                            comments[index]['assets'].remove(assetfilename)
+                            result = update_json_file_data(comments, filename, 'comments')
+                        elif assetfilename not in comments[index]['assets'] and state == 'unselected':
+                            comments[index]['assets'].append(assetfilename)
+                            result = update_json_file_data(comments, filename, 'comments')
+                        break
+
+                return jsonify({'result' : result})
 
     return jsonify({'result' : 'ERROR'})
 
-def _get_cookfilelist(folder=None):
-    if folder is None:
-        folder = current_app.config['HISTORY_FOLDER']
-
-    # Grab list of Historical Cook Files
-    if not os.path.exists(folder):
-        os.mkdir(folder)
-    dirfiles = os.listdir(folder)
-    cookfiles = []
-    for file in dirfiles:
-        if file.endswith('.pifire'):
-            cookfiles.append(file)
-    return(cookfiles)
-
 def _get_cookfilelist_details(cookfilelist):
+    ''' Add the display details to a list of cook file index entries (see read_cookfile_index) '''
     HISTORY_FOLDER = current_app.config['HISTORY_FOLDER']
     cookfiledetails = []
     for item in cookfilelist:
         filename = HISTORY_FOLDER + item['filename']
-        cookfiledata, status = read_json_file_data(filename, 'metadata')
-        if(status == 'OK'):
-            thumbnail = unpack_thumb(cookfiledata['thumbnail'], filename, cookfiledata["id"]) if (
-                    'thumbnail' in cookfiledata) else ''
-            cookfiledetails.append({'filename' : item['filename'], 'title' : cookfiledata['title'], 'thumbnail' : thumbnail})
+        if(item['status'] == 'OK'):
+            thumbnail = unpack_thumb(item['thumbnail'], filename, item['id']) if item['thumbnail'] != '' else ''
+            cookfiledetails.append({'filename' : item['filename'], 'title' : item['title'], 'thumbnail' : thumbnail})
         else:
             cookfiledetails.append({'filename' : item['filename'], 'title' : 'ERROR', 'thumbnail' : ''})
     return(cookfiledetails)
\ No newline at end of file
@@ -570,4 +570,38 @@ function updateCommentThumbs(commentid) {
 		}
 	});
 
-};
\ No newline at end of file
+};
+
+// Poll the status of queued media jobs until they are all finished, then call done()
+function waitMediaJobs(jobs, done) {
+	if(jobs.length == 0) {
+		done();
+		return;
+	};
+	var pending = jobs.slice();
+	var polls = 0;
+	var pollJobs = setInterval(function(){
+		polls += 1;
+		Promise.all(pending.map(function(job_id) {
+			return fetch('/cookfile/media/' + job_id).then((response) => response.json());
+		})).then(function(statuses) {
+			pending = pending.filter(function(job_id, index) {
+				return ['queued', 'processing'].includes(statuses[index].status);
+			});
+			if(pending.length == 0 || polls > 120) {
+				clearInterval(pollJobs);
+				done();
+			};
+		});
+	}, 500);
+};
+
+// Reopen the cook file once the uploaded images have been processed
+if(mediaJobs.length > 0) {
+	waitMediaJobs(mediaJobs, function() {
+		var form = $('<form method="POST" action="/history/cookfile"></form>');
+		form.append($('<input type="hidden" name="opencookfile">').val(filenameonly));
+		$('body').append(form);
+		form.submit();
+	});
+};
@@ -7,7 +7,7 @@ from . import dash_bp
 
 @dash_bp.route('/', methods=['POST','GET'])
 def dash_page():
-    settings = read_settings()
+    settings = read_settings(readonly=True)
     control = read_control()
     errors = read_errors()
     warnings = read_warnings()
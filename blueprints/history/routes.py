@@ -2,9 +2,10 @@
 import os
 import time
 from flask import render_template, request, current_app, jsonify, send_file, redirect
-from common.common import read_settings, read_control, read_current, write_settings, epoch_to_time
+from common.common import read_settings, read_control, read_current, write_settings, epoch_to_time, read_history_range
 from common.app import create_ui_hash, prepare_annotations, prepare_event_totals, prepare_csv
-from file_mgmt.cookfile import read_cookfile, prepare_chartdata
+from file_mgmt.cookfile import read_cookfile, prepare_chartdata, update_cookfile_index
+from file_mgmt.common import compact_file
 
 from . import history_bp
 
@@ -25,9 +26,16 @@ def history_page(action=None):
         else:
             json_response['current'] = read_current() # Probe Temps Zero'd Out
 
-        # Calculate Displayed Start Time
-        displayed_starttime = time.time() - (settings['history_page']['minutes'] * 20)
-        json_response['annotations'] = prepare_annotations(displayed_starttime)
+        # If a cursor is provided (?since=<timestamp>), only send annotations newer than the cursor
+        cursor = int(time.time() * 1000)
+        since = request.args.get('since', None, type=int)
+        if since is not None:
+            json_response['annotations'] = prepare_annotations(since)
+            json_response['cursor'] = cursor
+        else:
+            # Calculate Displayed Start Time
+            displayed_starttime = time.time() - (settings['history_page']['minutes'] * 20)
+            json_response['annotations'] = prepare_annotations(displayed_starttime)
         json_response['mode'] = control['mode']
         json_response['ui_hash'] = create_ui_hash()
         json_response['timestamp'] = int(time.time() * 1000)
@@ -38,7 +46,19 @@ def history_page(action=None):
         # POST - Get number of minutes into the history to refresh the history chart
         control = read_control()
         request_json = request.json
-        if 'num_mins' in request_json:
+        if 'since' in request_json:
+            # Only return the history points (and annotations) newer than the cursor
+            since = int(request_json['since'])
+            history = read_history_range(start=since + 1)
+            if history:
+                json_response = prepare_chartdata(settings['history_page']['probe_config'], num_items=0, reduce=False, history=history)
+                json_response['cursor'] = history['T'][-1]
+            else:
+                json_response = {'time_labels' : [], 'chart_data' : [], 'cursor' : since}
+            json_response['annotations'] = prepare_annotations(since)
+            json_response['ui_hash'] = create_ui_hash()
+            return jsonify(json_response)
+        elif 'num_mins' in request_json:
             num_items = int(request_json['num_mins']) * 20 if int(request_json['num_mins']) > 0 else 20 # Calculate number of items requested
             settings['history_page']['minutes'] = int(request_json['num_mins']) if int(request_json['num_mins']) > 0 else 1
             write_settings(settings)
@@ -48,11 +68,14 @@ def history_page(action=None):
             num_items = int(settings['history_page']['minutes'] * 20)
 
         # Get Chart Data Structures
-        json_response = prepare_chartdata(settings['history_page']['probe_config'], num_items=num_items, reduce=True, data_points=settings['history_page']['datapoints'])
+        data_points = int(request_json.get('data_points', settings['history_page']['datapoints']))
+        algorithm = request_json.get('algorithm', settings['history_page'].get('downsample', 'lttb'))
+        json_response = prepare_chartdata(settings['history_page']['probe_config'], num_items=num_items, reduce=True, data_points=data_points, algorithm=algorithm)
         json_response['ui_hash'] = create_ui_hash()
         # Calculate Displayed Start Time
         displayed_starttime = time.time() - (int(num_items / 20) * 60)
         json_response['annotations'] = prepare_annotations(displayed_starttime)
+        json_response['cursor'] = json_response['time_labels'][-1] if json_response['time_labels'] else 0
         '''
         json_response = {
             'annotations' : [], 
@@ -69,6 +92,7 @@ def history_page(action=None):
             if('delcookfile' in response):
                 filename = './history/' + response["delcookfile"]
                 os.remove(filename)
+                update_cookfile_index(filename, remove=True)
                 return redirect('/history')
             if('opencookfile' in response):
                 cookfilename = HISTORY_FOLDER + response['opencookfile']
@@ -111,6 +135,7 @@ def history_page(action=None):
                     return render_template('cferror.html', settings=settings, cookfilename=cookfilename, errortype=errortype, errors=errors, page_theme=settings['globals']['page_theme'], grill_name=settings['globals']['grill_name'])
             if('dlcookfile' in response):
                 filename = './history/' + response['dlcookfile']
+                compact_file(filename)  # Drop superseded members before the file leaves PiFire
                 return send_file(filename, as_attachment=True, max_age=0)
 
         if(action == 'setmins'):
@@ -7,6 +7,8 @@ var probe_mapper = {};
 var ui_hash;
 var temp_interval = 3000;  // Milliseconds between typical temperature reads (default 3000ms)
 var hiddenData = [];
+var historyCursor = 0;  // Timestamp of the last history point on the chart
+var annotationCursor = 0;  // Server timestamp of the last annotation update (0 = all annotations)
 
 Chart.defaults.font.family = '"Segoe UI", Roboto, "Helvetica Neue", Arial, "Noto Sans", "Liberation Sans"';
 
@@ -117,11 +119,12 @@ var temperatureCharts = new Chart(document.getElementById('HistoryChart'), {
 					ttl: undefined,   // data will be automatically deleted as it disappears off the chart
 					frameRate: 5,    // data points are drawn 5 times every second
 					onRefresh: chart => {
-						$.get("/history/stream", function(data){
+						$.get("/history/stream", { 'since' : annotationCursor }, function(data){
 							checkHashChange(data.ui_hash); 
 							checkModeChange(data.mode);
 							if (chartReady) {
 								var timestamp = data.current.TS;
+								historyCursor = timestamp;
 								
 								for (probe in data.current.P) {
 									chart.data.datasets[probe_mapper['probes'][probe]].data.push({'x':timestamp, 'y':data.current.P[probe]});
@@ -135,7 +138,9 @@ var temperatureCharts = new Chart(document.getElementById('HistoryChart'), {
 								};
 
 								if (annotation_enabled == true) {
-									chart.options.plugins.annotation.annotations = data.annotations;
+									// Only annotations newer than the cursor are sent, merge them in
+									Object.assign(chart.options.plugins.annotation.annotations, data.annotations);
+									annotationCursor = data.cursor;
 								} else {
 									chart.options.plugins.annotation.annotations = {};
 								};
@@ -265,6 +270,29 @@ function refreshChartData(zoom) {
 			probe_mapper = data.probe_mapper;
 			// Set Chart Ready Flag
 			chartReady = true;
+			historyCursor = data.cursor;
+		}
+	});
+};
+
+// Append the history points recorded since the last point on the chart (i.e. after the stream was paused)
+function appendChartData() {
+	req = $.ajax({
+		url : '/history/refresh',
+		type : 'POST',
+		data : JSON.stringify({ 'since' : historyCursor }),
+		contentType: "application/json; charset=utf-8",
+		traditional: true,
+		success: function (data) {
+			data.chart_data.forEach(function (dataset, chartIndex) {
+				temperatureCharts.data.datasets[chartIndex].data.push(...dataset.data);
+			});
+			temperatureCharts.data.labels.push(...data.time_labels);
+			if (annotation_enabled == true) {
+				Object.assign(temperatureCharts.options.plugins.annotation.annotations, data.annotations);
+			};
+			historyCursor = data.cursor;
+			temperatureCharts.update();
 		}
 	});
 };
@@ -276,6 +304,10 @@ function checkAutorefresh() {
 		document.getElementById("autorefresh").innerHTML = "<i class=\"fas fa-sync-alt\"></i>&nbsp;Stream OFF";
 		paused = true;
 	} else {
+		if ((paused == true) && (chartReady == true)) {
+			// Fill in the points missed while the stream was paused
+			appendChartData();
+		};
 		temperatureCharts.options.scales.x.realtime.pause = false;
 		document.getElementById("autorefresh").className = "btn btn-outline-primary";
 		document.getElementById("autorefresh").innerHTML = "<i class=\"fas fa-sync-alt\"></i>&nbsp;Stream ON";
@@ -309,6 +341,7 @@ $("#annotation_enabled").change(function() {
 		
 	if(document.getElementById('annotation_enabled').checked) {
 		annotation_enabled = true;
+		annotationCursor = 0;  // Reload all annotations on the next update
 	} else {
 		annotation_enabled = false;
 	};
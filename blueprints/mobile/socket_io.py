@@ -18,10 +18,12 @@ Description: This library provides socketio functions for app.py
 import threading
 from common import *
 from common.app import get_supported_cmds
+from common.json_delta import DeltaEncoder
 from flask import request
+from flask_socketio import join_room, leave_room
 from app import socketio
 from config import Config
-from file_mgmt.recipes import read_recipefile, get_recipefilelist
+from file_mgmt.recipes import read_recipefile, get_recipefilelist, read_recipe_catalog
 from base64 import b64encode
 from datetime import datetime
 from threading import Event
@@ -30,6 +32,17 @@ thread_lock = threading.Lock()
 thread_event = Event()
 thread = None
 
+# Changes that require the dash data to be rebuilt
+_DASH_TOPICS = frozenset(['control', 'status', 'current', 'errors', 'settings', 'pellets'])
+
+# Minimum seconds between emits, changes notified in between are batched into the next emit
+EMIT_INTERVAL = 1.0
+
+# Clients receive either full payloads (socket_*_data) or delta encoded payloads (socket_*_delta)
+FULL_ROOM = 'app_data_full'
+DELTA_ROOM = 'app_data_delta'
+snapshot_requests = set()  # Delta clients waiting for a full snapshot
+
 '''
 ==============================================================================
  Flush Redis DB's and create Settings / PelletDB / Connected Users / Events
@@ -54,6 +67,7 @@ def handle_connect():
     client_id = request.sid
     write_connected_user(client_id)
     connected_users = read_connected_users()
+    join_room(FULL_ROOM)
     listen_app_data(force=True)
     print(f"User {client_id} connected. Current connected users: {connected_users}")
 
@@ -63,6 +77,7 @@ def handle_disconnect():
     global thread
     client_id = request.sid
     remove_connected_user(client_id)
+    snapshot_requests.discard(client_id)
     connected_users = read_connected_users()
     print(f"User {client_id} disconnected. Current connected users: {connected_users}")
     if len(connected_users) == 0:
@@ -87,6 +102,21 @@ def listen_app_data(force=False):
     return _response(result='OK')
 
 
+@socketio.on('listen_app_delta')
+def listen_app_delta():
+    '''
+    Switch this client to delta encoded payloads (socket_dash_delta, socket_pellet_delta, socket_event_delta).
+    A full snapshot of each is sent first.  Emit again to re-sync after a gap in the sequence numbers.
+    '''
+    client_id = request.sid
+    leave_room(FULL_ROOM)
+    join_room(DELTA_ROOM)
+    snapshot_requests.add(client_id)
+    listen_app_data()
+
+    return _response(result='OK')
+
+
 @socketio.on('get_app_data')
 def get_app_data(action=None, arg01=None, arg02=None):
     return _get_app_data(action, arg01, arg02)
@@ -108,20 +138,50 @@ def _emit_app_data(event, force_refresh):
     global thread
 
     check_control_time = time.time()
+    change_listener = ChangeListener()
+
+    event_delta = DeltaEncoder()
+    pellet_delta = DeltaEncoder()
+    dash_delta = DeltaEncoder()
 
-    previous_dash = ''
-    previous_event = ''
-    previous_pellet = ''
+    settings = None
+    pelletdb = None
+    event_data = None
+    dash_data = None
+
+    pending = set()  # Changes notified since the last emit
+    last_emit = 0
 
     try:
         while event.is_set():
+            # Wait for a change notification (up to 1 second, or until the next emit is due if changes 
+            # are pending), then only re-read what changed
+            if pending:
+                timeout = max(0, EMIT_INTERVAL - (time.time() - last_emit))
+            else:
+                timeout = 1
+            pending |= change_listener.get_changes(timeout=timeout)
+
             now = time.time()
             if (now - check_control_time) > 30:
                 check_control_time = now
                 _check_control_status()
-
-            settings = read_settings_redis()
-            pelletdb = read_pellets_redis()
+                # Periodically refresh everything, in case a writer doesn't publish changes
+                pending |= CHANGE_TOPICS
+
+            # New clients (forced refresh / snapshot requests) are served right away
+            if not force_refresh and not snapshot_requests:
+                if not pending or (now - last_emit) < EMIT_INTERVAL:
+                    continue
+
+            changes = pending
+            pending = set()
+            last_emit = now
+
+            if settings is None or 'settings' in changes:
+                settings = read_settings_redis()
+            if pelletdb is None or 'pellets' in changes:
+                pelletdb = read_pellets_redis()
             uuid = settings['server_info']['uuid']
 
             pellet_data = {
@@ -129,33 +189,31 @@ def _emit_app_data(event, force_refresh):
                 'pellets': pelletdb
             }
 
-            event_data = {
-                'uuid': uuid,
-                'events': read_events_redis()
-            }
-
-            dash_data = _get_dash_data(settings, pelletdb)
-
-            if force_refresh:
-                socketio.emit('socket_event_data', event_data)
-                socketio.emit('socket_pellet_data', pellet_data)
-                socketio.emit('socket_dash_data', dash_data)
-                force_refresh = False
-            else:
-                if previous_event != event_data:
-                    socketio.emit('socket_event_data', event_data)
-                    previous_event = event_data
-
-                if previous_pellet != pellet_data:
-                    socketio.emit('socket_pellet_data', pellet_data)
-                    previous_pellet = pellet_data
-
-                if previous_dash != dash_data:
-                    socketio.emit('socket_dash_data', dash_data)
-                    previous_dash = dash_data
-
-            socketio.sleep(1)
+            if event_data is None or 'events' in changes:
+                event_data = {
+                    'uuid': uuid,
+                    'events': read_events_redis(flush='events' in changes)
+                }
+
+            if dash_data is None or changes & _DASH_TOPICS:
+                dash_data = _get_dash_data(settings, pelletdb)
+
+            # Diff each payload once, the result decides what is sent to full and delta clients
+            for name, encoder, data in [('event', event_delta, event_data), ('pellet', pellet_delta, pellet_data), ('dash', dash_delta, dash_data)]:
+                message, changed = encoder.encode(data)
+                if changed or force_refresh:
+                    socketio.emit(f'socket_{name}_data', data, to=FULL_ROOM)
+                if message is not None:
+                    socketio.emit(f'socket_{name}_delta', message, to=DELTA_ROOM)
+            force_refresh = False
+
+            while snapshot_requests:
+                client_id = snapshot_requests.pop()
+                socketio.emit('socket_event_delta', event_delta.snapshot(), to=client_id)
+                socketio.emit('socket_pellet_delta', pellet_delta.snapshot(), to=client_id)
+                socketio.emit('socket_dash_delta', dash_delta.snapshot(), to=client_id)
     finally:
+        change_listener.close()
         event.clear()
         thread = None
 
@@ -325,14 +383,21 @@ def _get_app_data(action=None, arg01=None, arg02=None):
     elif action == 'recipe_data':
         if arg01 is not None:
             if arg01 == 'details':
-                filelist = get_recipefilelist()
                 recipedetailslist = []
-                for filename in filelist:
-                    filepath = f'{recipe_folder}{filename}'
-                    recipe_data, status = read_recipefile(filepath)
-                    if status == 'OK':
-                        recipe_data = _encode_assets(recipe_data)
-                        recipedetailslist.append({'filename': filename, 'details': recipe_data})
+                if arg02 == 'urls':
+                    # Opt-in: images are referenced by URL (asset 'image_url' / 'thumb_url') from the recipe catalog
+                    for filename, entry in read_recipe_catalog(recipe_folder).items():
+                        if entry['status'] == 'OK':
+                            recipedetailslist.append({'filename': filename, 'details': entry['details']})
+                else:
+                    # Default format with the images inlined as base64 (existing clients)
+                    filelist = get_recipefilelist()
+                    for filename in filelist:
+                        filepath = f'{recipe_folder}{filename}'
+                        recipe_data, status = read_recipefile(filepath)
+                        if status == 'OK':
+                            recipe_data = _encode_assets(recipe_data)
+                            recipedetailslist.append({'filename': filename, 'details': recipe_data})
                 if recipedetailslist:
                     return _response(
                         result='OK',
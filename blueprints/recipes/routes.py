@@ -3,8 +3,8 @@ from werkzeug.utils import secure_filename
 from flask import render_template, request, current_app, send_file, jsonify, render_template_string
 from common.common import read_settings, read_control
 from common.app import paginate_list, allowed_file
-from file_mgmt.common import update_json_file_data, remove_assets
-from file_mgmt.media import add_asset
+from file_mgmt.common import update_json_file_data, remove_assets, compact_file
+from file_mgmt.media import queue_asset, read_media_job
 from file_mgmt.recipes import read_recipefile, create_recipefile, get_recipefilelist, get_recipefilelist_details
 
 from . import recipes_bp
@@ -19,6 +19,12 @@ def recipes_page():
                             page_theme=settings['globals']['page_theme'],
                             grill_name=settings['globals']['grill_name'])
 
+@recipes_bp.route('/data/media/<job_id>', methods=['GET'])
+def recipes_media_job(job_id):
+    # Status of a queued asset upload (queued / processing / done / error)
+    job = read_media_job(job_id)
+    return jsonify(job if job is not None else {'status' : 'unknown'})
+
 @recipes_bp.route('/data', methods=['POST', 'GET'])
 @recipes_bp.route('/data/upload', methods=['POST', 'GET'])
 @recipes_bp.route('/data/download/<filename>', methods=['GET'])
@@ -30,6 +36,7 @@ def recipes_data(filename=None):
     if(request.method == 'GET') and (filename is not None):
         filepath = f'{RECIPE_FOLDER}{filename}'
         #print(f'Sending: {filepath}')
+        compact_file(filepath)  # Drop superseded members before the file leaves PiFire
         return send_file(filepath, as_attachment=True, max_age=0)
 
     if(request.method == 'POST') and ('form' in request.content_type):
@@ -52,6 +59,7 @@ def recipes_data(filename=None):
             filepath = f'{RECIPE_FOLDER}{filename}'
 
             errors = []
+            jobs = []
             for remotefile in uploadedfiles:
                 if (remotefile.filename != ''):
                     # Load the Recipe File 
@@ -65,14 +73,15 @@ def recipes_data(filename=None):
                         asset_filename = secure_filename(remotefile.filename)
                         pathfile = os.path.join(tmp_path, asset_filename)
                         remotefile.save(pathfile)
-                        add_asset(filepath, tmp_path, asset_filename)
+                        job_id, asset_id, filetype = queue_asset(filepath, tmp_path, asset_filename)
+                        jobs.append(job_id)
                     else:
                         errors.append('Disallowed File Upload.')
             if len(errors):
                 status = 'error'
             else:
                 status = 'success'
-            return jsonify({ 'result' : status, 'errors' : errors})
+            return jsonify({ 'result' : status, 'errors' : errors, 'jobs' : jobs})
         if('recipefilelist' in requestform):
             page = int(requestform['page'])
             reverse = True if requestform['reverse'] == 'true' else False
@@ -82,7 +91,7 @@ def recipes_data(filename=None):
             for filename in filelist:
                 recipefilelist.append({'filename' : filename, 'title' : '', 'thumbnail' : ''})
             paginated_recipefile = paginate_list(recipefilelist, 'filename', reverse, itemsperpage, page)
-            paginated_recipefile['displaydata'] = get_recipefilelist_details(paginated_recipefile['displaydata'])
+            paginated_recipefile['displaydata'] = get_recipefilelist_details(paginated_recipefile['displaydata'], RECIPE_FOLDER)
             return render_template('recipes/_recipefile_list.html', pgntdrf = paginated_recipefile)
         if('recipeview' in requestform):
             filename = requestform['filename']
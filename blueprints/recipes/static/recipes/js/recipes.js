@@ -219,9 +219,18 @@ function recipeUploadAssets(filename, section, section_index) {
 		};
 
 		fetch("/recipes/data/upload", requestOptions).then(
-			(response) => {
+			(response) => response.json()
+		).then(
+			(result) => {
+				// Images are processed in the background, wait for the jobs to finish
+				waitMediaJobs(result.jobs || [], function() {
+					fileCounter += 1;
+					//console.log('Uploaded File # ' + fileCounter)
+				});
+			}
+		).catch(
+			(error) => {
 				fileCounter += 1;
-				//console.log('Uploaded File # ' + fileCounter)
 			}
 		);
     });
@@ -234,6 +243,30 @@ function recipeUploadAssets(filename, section, section_index) {
 	}, 100);
 };
 
+// Poll the status of queued media jobs until they are all finished, then call done()
+function waitMediaJobs(jobs, done) {
+	if(jobs.length == 0) {
+		done();
+		return;
+	};
+	var pending = jobs.slice();
+	var polls = 0;
+	var pollJobs = setInterval(function(){
+		polls += 1;
+		Promise.all(pending.map(function(job_id) {
+			return fetch('/recipes/data/media/' + job_id).then((response) => response.json());
+		})).then(function(statuses) {
+			pending = pending.filter(function(job_id, index) {
+				return ['queued', 'processing'].includes(statuses[index].status);
+			});
+			if(pending.length == 0 || polls > 120) {
+				clearInterval(pollJobs);
+				done();
+			};
+		});
+	}, 500);
+};
+
 function recipeDeleteFile(delete_this) {
 	postdata = {
 		'deletefile' : true, 
@@ -2,6 +2,8 @@
 from flask import render_template, request, render_template_string, jsonify
 from common.common import read_settings, read_control, write_settings, write_control, read_generic_json, generate_uuid, convert_settings_units
 from common.app import is_not_blank, is_checked
+from common.downsample import ALGORITHMS
+from probes.temp_queue import FILTERS as TEMP_FILTERS
 
 from . import settings_bp
 
@@ -93,6 +95,21 @@ def settings_page(action=None):
         else:
             return jsonify({'result' : 'label_not_found'})
 
+    if request.method == 'POST' and action == 'probe_options':
+        response = request.form
+
+        if is_checked(response, 'concurrent_reads'):
+            settings['probe_settings']['concurrent_reads'] = True
+        else:
+            settings['probe_settings']['concurrent_reads'] = False
+
+        if is_not_blank(response, 'temp_filter') and response['temp_filter'] in TEMP_FILTERS:
+            settings['probe_settings']['temp_filter'] = response['temp_filter']
+
+        event['type'] = 'updated'
+        event['text'] = 'Successfully updated probe options.  Restart PiFire for the changes to take effect.'
+        write_settings(settings)
+
     if request.method == 'POST' and action == 'notify':
         response = request.form
 
@@ -154,6 +171,10 @@ def settings_page(action=None):
             settings['notify_services']['mqtt']['enabled'] = True
         else:
             settings['notify_services']['mqtt']['enabled'] = False
+        if is_checked(response, 'mqtt_control'):
+            settings['notify_services']['mqtt']['control'] = True
+        else:
+            settings['notify_services']['mqtt']['control'] = False
         if 'mqtt_id' in response:
             settings['notify_services']['mqtt']['id'] = response['mqtt_id']
         if 'mqtt_broker' in response:
@@ -499,6 +520,10 @@ def settings_page(action=None):
             settings['history_page']['autorefresh'] = 'off'
         if is_not_blank(response, 'datapoints'):
             settings['history_page']['datapoints'] = int(response['datapoints'])
+        if is_not_blank(response, 'downsample') and response['downsample'] in ALGORITHMS:
+            settings['history_page']['downsample'] = response['downsample']
+        if is_not_blank(response, 'cookfile_datapoints'):
+            settings['history_page']['cookfile_datapoints'] = int(response['cookfile_datapoints'])
 
         # This check should be the last in this group
         if control['mode'] != 'Stop' and is_checked(response, 'ext_data') != settings['globals']['ext_data']:
@@ -42,7 +42,7 @@ def get_system_command_output(requested='supported_commands', timeout=1):
 	}
 
 def create_ui_hash():
-	settings = read_settings()
+	settings = read_settings(readonly=True)
 	return hash(json.dumps(settings['probe_settings']['probe_map']['probe_info']))
 
 def paginate_list(datalist, sortkey='', reversesortorder=False, itemsperpage=10, page=1):
@@ -140,7 +140,7 @@ def prepare_annotations(displayed_starttime, metrics_data=[]):
 	return(annotation_json)
 
 def prepare_event_totals(events):
-	settings = read_settings()
+	settings = read_settings(readonly=True)
 	auger_time = 0
 	for index in range(0, len(events)):
 		auger_time += events[index]['augerontime']
@@ -0,0 +1,65 @@
+"""
+Class to listen for change notifications published by other processes (Redis pub/sub)
+
+Writers (i.e. write_current(), write_control() in common.py) publish the name of what changed
+on a single channel.  Consumers (the socket.io emitter, the display) create a ChangeListener and
+wait for changes, then only re-read what changed instead of polling everything.
+"""
+import time
+import redis
+
+CHANGES_CHANNEL = 'changes:general'
+
+# Topics published on the channel
+CHANGE_TOPICS = frozenset(['current', 'status', 'control', 'pellets', 'events', 'settings', 'errors'])
+
+
+class ChangeListener():
+    def __init__(self, topics=None, channel=CHANGES_CHANNEL):
+        self.channel = channel
+        self.topics = frozenset(topics) if topics else CHANGE_TOPICS
+        self.redis_db = redis.StrictRedis('localhost', 6379, charset="utf-8", decode_responses=True)
+        self.pubsub = None
+
+    def _subscribe(self):
+        self.pubsub = self.redis_db.pubsub()
+        self.pubsub.subscribe(self.channel)
+
+    def get_changes(self, timeout=0):
+        """
+        Wait up to timeout seconds for a change notification, then drain any other pending notifications.
+
+        The first call (and the first call after the connection to Redis was lost) returns all topics,
+        since changes may have been missed while not subscribed.
+
+        :param timeout: Seconds to wait for the first notification (0 = don't wait)
+        :return: Set of topics that changed
+        """
+        if self.pubsub is None:
+            try:
+                self._subscribe()
+            except:
+                self.close()
+                time.sleep(timeout)
+            return set(self.topics)
+
+        changes = set()
+        try:
+            message = self.pubsub.get_message(timeout=timeout)
+            while message is not None:
+                if message['type'] == 'message' and message['data'] in self.topics:
+                    changes.add(message['data'])
+                message = self.pubsub.get_message()
+        except:
+            self.close()
+            return set(self.topics)
+
+        return changes
+
+    def close(self):
+        if self.pubsub is not None:
+            try:
+                self.pubsub.close()
+            except:
+                pass
+        self.pubsub = None
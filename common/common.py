@@ -31,6 +31,9 @@ from collections.abc import Mapping
 from ratelimitingfilter import RateLimitingFilter
 from common.redis_queue import RedisQueue
 from common.redis_handler import RedisHandler
+from common.settings_cache import SettingsCache, freeze
+from common.history_store import HistoryStore
+from common.change_notify import ChangeListener, CHANGES_CHANNEL, CHANGE_TOPICS
 
 # *****************************************
 # Constants and Globals 
@@ -55,6 +58,33 @@ COLOR_LIST = [
 # Setup Command / Status database connection Global 
 cmdsts = redis.StrictRedis('localhost', 6379, charset="utf-8", decode_responses=True)
 
+# In-process cache of the parsed settings.json (validated against 'settings:version' in Redis)
+settings_cache = SettingsCache(cmdsts)
+
+# Columnar store for the cook history (see common/history_store.py)
+history_store = HistoryStore('control:history')
+
+# Sets the given fields of a hash that differ from the current values (compared in Redis, so a change made 
+# by another process since this process last read the control data is never mistaken for no change)
+# KEYS[1] = hash, ARGV = field, value, field, value, ... 
+# Returns the number of fields changed
+CONTROL_WRITE_SCRIPT = """
+local changed = 0
+for i = 1, #ARGV, 2 do
+	if redis.call('HGET', KEYS[1], ARGV[i]) ~= ARGV[i + 1] then
+		redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+		changed = changed + 1
+	end
+end
+return changed
+"""
+control_write_script = cmdsts.register_script(CONTROL_WRITE_SCRIPT)
+
+# Change notifications for the current temperatures are only sent when they differ from the last ones 
+# published, and at most once per interval (in seconds), instead of on every write (~20 Hz)
+CURRENT_PUBLISH_INTERVAL = 1.0
+current_published = {'data' : None, 'time' : 0}
+
 
 '''
 ==============================================================================
@@ -110,6 +140,8 @@ def default_settings():
 	settings['probe_settings'] = {}
 	settings['probe_settings']['probe_profiles'] = _default_probe_profiles()
 	settings['probe_settings']['probe_map'] = default_probe_map(settings['probe_settings']['probe_profiles'])
+	settings['probe_settings']['concurrent_reads'] = False  # Read the probe devices in worker threads (one per bus), so the control loop doesn't wait on them
+	settings['probe_settings']['temp_filter'] = 'mean'  # Filter of the probe temperatures: 'mean', 'median' or 'ema' (see probes/temp_queue.py)
 
 	settings['globals'] = {
 		'grill_name' : '',
@@ -324,6 +356,8 @@ def default_settings():
 		'clearhistoryonstart' : True, 	# Clear history when StartUp Mode selected
 		'autorefresh' : 'on', 			# Sets history graph to auto refresh ('live' graph)
 		'datapoints' : 60, 				# Number of data points to show on the history chart
+		'downsample' : 'lttb',			# Downsampling algorithm for charts ('lttb', 'minmax' or 'nth')
+		'cookfile_datapoints' : 1000,	# Number of data points to show on cookfile charts (0 = all)
 		'probe_config' : {}				# Empty probe config
 	}
 	settings['history_page']['probe_config'] = default_probe_config(settings)
@@ -473,6 +507,7 @@ def default_notify_services():
 	
 	services['mqtt'] = {
       "broker": "homeassistant.local",
+      "control": False,
       "enabled": False,
       "homeassistant_autodiscovery_topic": "homeassistant",
       "id": "PiFire",
@@ -875,11 +910,30 @@ def generate_uuid():
 
 	return str(generated_uuid)
 
-def read_control(flush=False):
+def publish_change(topic):
+	"""
+	Notify listening processes (see common/change_notify.py) that data has changed
+
+	:param topic: What changed ('current', 'status', 'control', 'pellets', 'events', 'settings', 'errors')
+	"""
+	global cmdsts
+
+	try:
+		cmdsts.publish(CHANGES_CHANNEL, topic)
+	except:
+		pass
+
+def read_control(flush=False, fields=None):
 	"""
 	Read Control from Redis DB
 
+	Control is stored as a Redis hash ('control:general') with one JSON encoded field per 
+	top-level control key, so that individual fields can be read and written without 
+	encoding / decoding the entire control structure.  
+
 	:param flush: True to clean control. False otherwise
+	:param fields: Optional list of top-level control keys.  If provided, only those fields are fetched 
+		and a partial control dictionary is returned.  
 	:return: control
 	"""
 	global cmdsts
@@ -898,29 +952,109 @@ def read_control(flush=False):
 
 			control = default_control()
 			write_control(control, direct_write=True, origin='common')
+		elif fields is not None: 
+			values = cmdsts.hmget('control:general', fields)
+			control = {}
+			for field, value in zip(fields, values):
+				if value is None:
+					raise KeyError(field)
+				control[field] = json.loads(value)
 		else: 
-			control = json.loads(cmdsts.get('control:general'))
+			data = cmdsts.hgetall('control:general')
+			if not data:
+				raise KeyError('control:general')
+			control = {}
+			for field, value in data.items():
+				control[field] = json.loads(value)
 	except:
 		control = default_control()
+		if fields is not None:
+			control = {field : control.get(field) for field in fields}
 
 	return(control)
 
 def write_control(control, direct_write=False, origin='unknown'):
 	"""
-	Read Control from Redis DB
+	Write Control to Redis DB
+
+	When writing directly, the top-level fields are compared with the current values in Redis (in a 
+	single script call) and only the fields that differ are set.  A partial control dictionary 
+	(i.e. {'hopper_check' : False}) can be passed to update only those fields.  
 
-	:param control: Control Dictionary
+	:param control: Control Dictionary (full or partial)
 	:param direct_write:  If set to true, write directly to the control data.  Else, write the control data to a command queue.  Defaults to false.  
 	"""
 	global cmdsts
 
 	if direct_write: 
-		cmdsts.set('control:general', json.dumps(control))
+		args = []
+		for field, value in control.items():
+			args += [field, json.dumps(value)]
+		if args and control_write_script(keys=['control:general'], args=args):
+			publish_change('control')
 	else: 
 		# Add changes to control write queue 
 		control['origin'] = origin 
 		cmdsts.rpush('control:write', json.dumps(control))
 
+def merge_control_writes():
+	"""
+	Drain the control write queue, apply all queued (deep) updates to the control data and 
+	return the merged control.  
+
+	The control hash is WATCHed while the queue and the control data are read, and the drained 
+	writes are removed from the queue and the touched fields are written back in a single MULTI/EXEC 
+	transaction.  If another process writes the control data in between (i.e. a direct write), the 
+	transaction is aborted and the merge is retried on the new data, so that write is never lost.  
+	Other processes only append to the queue, so trimming the drained writes off the head of the 
+	queue leaves any write queued in between for the next call.  
+
+	:return: control
+	"""
+	global cmdsts
+
+	while True:
+		try:
+			with cmdsts.pipeline() as pipe:
+				pipe.watch('control:general')
+				queued = pipe.lrange('control:write', 0, -1)
+				data = pipe.hgetall('control:general')
+
+				if data:
+					control = {}
+					for field, value in data.items():
+						control[field] = json.loads(value)
+				else:
+					control = default_control()
+
+				if not queued:
+					pipe.unwatch()
+					return control
+
+				touched = set() if data else set(control.keys())
+				for item in queued:
+					command = json.loads(item)
+					command.pop('origin', None)
+					control = deep_update(control, command)
+					touched.update(command.keys())
+
+				args = []
+				for field in touched:
+					args += [field, json.dumps(control[field])]
+
+				pipe.multi()
+				pipe.ltrim('control:write', len(queued), -1)
+				control_write_script(keys=['control:general'], args=args, client=pipe)
+				_, changed = pipe.execute()
+		except redis.WatchError:
+			continue
+		except:
+			return read_control()
+
+		if changed:
+			publish_change('control')
+		return control
+
 def execute_control_writes():
 	"""
 	Execute Control Writes in Queue from Redis DB
@@ -929,16 +1063,8 @@ def execute_control_writes():
 
 	:return status : 'OK', 'ERROR' 
 	"""
-	global cmdsts 
-
-	status = 'OK'
-	while cmdsts.llen('control:write') > 0:
-		control = read_control()
-		command = json.loads(cmdsts.lpop('control:write'))
-		command.pop('origin')
-		control = deep_update(control, command)
-		write_control(control, direct_write=True, origin='writer')
-	return status
+	merge_control_writes()
+	return 'OK'
 
 def read_errors(flush=False):
 	"""
@@ -972,6 +1098,7 @@ def write_errors(errors):
 	global cmdsts
 
 	cmdsts.set('errors', json.dumps(errors))
+	publish_change('errors')
 
 def read_warnings():
 	"""
@@ -1005,6 +1132,7 @@ def write_warning(warning):
 
 	try:
 		cmdsts.rpush('warnings', warning)
+		publish_change('errors')
 	except:
 		event = 'Unable to reach Redis database.  You may need to reinstall PiFire or enable redis-server.'
 		write_log(event)
@@ -1063,24 +1191,40 @@ def write_metrics(metrics=default_metrics(), flush=False, new_metric=False):
 		cmdsts.rpop('metrics:general')
 		cmdsts.rpush('metrics:general', json.dumps(metrics))
 
-def read_settings(filename='settings.json', init=False, retry_count=0):
+def read_settings(filename='settings.json', init=False, retry_count=0, readonly=False):
 	"""
 	Read Settings from file
 
+	Settings are served from an in-process cache when the file has not changed since it was last 
+	read (or written) by this process.  Changes made by other processes are detected through the 
+	version counter in Redis, which is incremented by write_settings().
+
 	:param filename: Filename to use (default settings.json)
+	:param init: True to upgrade / overlay defaults and write back the settings (always reads the file)
+	:param readonly: True to return a shared read-only view of the cached settings (faster, but any 
+		attempt to modify it raises a TypeError).  False to return a private, writable copy.
 	"""
+	if not init:
+		settings = settings_cache.get(filename, readonly=readonly)
+		if settings is not None:
+			return(settings)
+
+	# Get the signature before reading, so that a write during the read will invalidate the cache 
+	signature = settings_cache.signature(filename)
 
 	try:
 		json_data_file = os.fdopen(os.open(filename, os.O_RDONLY))
 		json_data_string = json_data_file.read()
 		settings = json.loads(json_data_string)
 		json_data_file.close()
+		if not init:
+			settings_cache.store(filename, json_data_string, signature)
 
 	except(IOError, OSError):
 		""" Settings file not found, create a new default settings file """
 		settings = default_settings()
 		write_settings(settings)
-		return(settings)
+		return(freeze(settings) if readonly else settings)
 	except(ValueError):
 		# A ValueError Exception occurs when multiple accesses collide, this code attempts a retry.
 		event = 'ERROR: Value Error Exception - JSONDecodeError reading settings.json'
@@ -1148,6 +1292,9 @@ def read_settings(filename='settings.json', init=False, retry_count=0):
 		if update_settings or filename != 'settings.json': # If any of the keys were added, then write back the changes
 			write_settings(settings)
 
+	if readonly:
+		settings = freeze(settings)
+
 	return(settings)
 
 def write_settings(settings):
@@ -1165,6 +1312,14 @@ def write_settings(settings):
 	with open("settings.json", 'w') as settings_file:
 		settings_file.write(json_data_string)
 
+	# Notify other processes of the change and update the local cache with the written data
+	version = settings_cache.bump()
+	try:
+		signature = (version, os.stat("settings.json").st_mtime_ns) if version is not None else None
+	except OSError:
+		signature = None
+	settings_cache.store("settings.json", json_data_string, signature)
+
 def read_settings_redis(init=False):
 	global cmdsts
 
@@ -1186,6 +1341,7 @@ def write_settings_redis(settings):
 	:param settings: Settings
 	"""
 	cmdsts.set('settings:general', json.dumps(settings))
+	publish_change('settings')
 
 def backup_settings():
 	# Copy current settings file to a backup copy in /[BACKUP_PATH]/PiFire_[DATE]_[TIME].json 
@@ -1486,6 +1642,7 @@ def write_pellet_db(pelletdb):
 	json_data_string = json.dumps(pelletdb, indent=2, sort_keys=True)
 	with open("pelletdb.json", 'w') as json_file:
 		json_file.write(json_data_string)
+	publish_change('pellets')
 
 def read_pellets_redis(init=False):
 	global cmdsts
@@ -1640,6 +1797,9 @@ def write_event(settings, event):
 		write_log(event)
 	elif not event.startswith('*'):
 		write_log(event)
+	else:
+		return
+	publish_change('events')
 
 def read_events_redis(flush=False):
 	"""
@@ -1691,33 +1851,75 @@ def read_history(num_items=0, flushhistory=False):
 	:param flushhistory: True=flush history & current, False=normal history read
 	:return: List of history dictionaries (each list item is timestamped 'T')
 	"""
-	global cmdsts
+	global history_store
 	
 	datalist = []  # Initialize data list
 
-	# If a flushhistory is requested, then flush the control:history key (and data)
+	# If a flushhistory is requested, then flush the history (and data)
 	if flushhistory:
-		if cmdsts.exists('control:history'):
-			cmdsts.delete('control:history')  # deletes the history
+		if history_store.length() > 0 or cmdsts.exists('control:history'):
+			history_store.flush()  # deletes the history
+			cmdsts.delete('control:history')  # deletes the legacy (JSON list) history
 			read_current(zero_out=True)  # zero-out current data
 			write_metrics(flush=True)
 	else:
-		if cmdsts.exists('control:history'):
-			list_length = cmdsts.llen('control:history') 
-
-			if((num_items > 0) and (list_length < num_items)) or (num_items == 0):
-				list_start = 0
-			else: 
-				list_start = list_length - num_items
-
-			data = cmdsts.lrange('control:history', list_start, -1)
-			
-			''' Unpack data to list of dictionaries '''
-			for index in range(len(data)):
-				datalist.append(json.loads(data[index]))
+		datalist = history_store.read(num_items)
 			
 	return(datalist)
 
+def read_history_columns(num_items=0):
+	"""
+	Read history from Redis DB in columnar format (same format as unpack_history())
+
+	:param num_items: Items from end of the history (set to 0 for all items)
+	:return: Dictionary of lists (i.e. {'T' : [...], 'P' : {'Grill' : [...]}, ...}) or {} if there is no history
+	"""
+	global history_store
+
+	return history_store.read_columns(num_items)
+
+def read_history_range(start=None, end=None, columnar=True):
+	"""
+	Read history from Redis DB between two timestamps 
+
+	:param start: Start time in milliseconds (None for the start of the history)
+	:param end: End time in milliseconds (None for the end of the history)
+	:param columnar: True to return the columnar format, False for a list of history dictionaries
+	"""
+	global history_store
+
+	return history_store.read_range(start=start, end=end, columnar=columnar)
+
+def iter_history(chunk_size=1000):
+	"""
+	Iterate over the history in Redis DB (oldest first) without reading it all into memory
+
+	:param chunk_size: Number of history items read at a time
+	"""
+	global history_store
+
+	return history_store.iter_rows(chunk_size=chunk_size)
+
+def read_history_column(group, label=None):
+	"""
+	Read a single history column (i.e. 'T', or 'F' / 'Probe1') from Redis DB
+
+	:param group: History group ('T', 'P', 'F', 'NT', 'PSP', 'AUX', 'EXD')
+	:param label: Probe label within the group (None for 'T' and 'PSP')
+	:return: List of values (oldest first)
+	"""
+	global history_store
+
+	return history_store.read_column(group, label)
+
+def read_history_labels():
+	"""
+	Get the groups and probe labels stored in the history, i.e. {'T' : None, 'P' : ['Grill'], 'F' : ['Probe1'], ...}
+	"""
+	global history_store
+
+	return history_store.labels()
+
 def unpack_history(datalist):
 	temp_dict = {}  # Create temporary dictionary to store all of the history data lists
 	temp_struct = datalist[0]  # Load the initial history data into a temporary dictionary  
@@ -1748,7 +1950,7 @@ def write_history(in_data, maxsizelines=28800, ext_data=False):
 	:param ext_data: Extended data to be written to the databse 
 	"""
 	
-	global cmdsts
+	global history_store
 
 	# Create data structure for current temperature data and timestamp
 	datastruct = {}
@@ -1762,17 +1964,15 @@ def write_history(in_data, maxsizelines=28800, ext_data=False):
 	if ext_data:
 		datastruct['EXD'] = in_data['ext_data']
 
-	# Push data string to the list in the last position
-	cmdsts.rpush('control:history', json.dumps(datastruct))
-
-	# Check if the list has exceeded maxsizelines, and pop the first item from the list if it has
-	if cmdsts.llen('control:history') > maxsizelines:
-		cmdsts.lpop('control:history')
+	# Append to the history store (oldest entries are overwritten after maxsizelines)
+	history_store.append(datastruct, capacity=maxsizelines)
 
 
 def write_current(in_data):
 	"""
-	Write current and populate a dictionary of data
+	Write current and populate a dictionary of data.  Listeners are notified of the change when the 
+	data (other than the timestamp) differs from the last data published, at most once per 
+	CURRENT_PUBLISH_INTERVAL.  
 
 	:param in_data: dictionary containing current temperatures
 	"""
@@ -1784,9 +1984,16 @@ def write_current(in_data):
 	current['AUX'] = in_data['probe_history']['aux']
 	current['PSP'] = in_data['primary_setpoint']
 	current['NT'] = in_data['notify_targets']
-	current['TS'] = int(time.time() * 1000)  # Timestamp
+	now = time.time()
+	data = json.dumps(current, sort_keys=True)
+	current['TS'] = int(now * 1000)  # Timestamp
 	cmdsts.set('control:current', json.dumps(current))
 
+	if data != current_published['data'] and now - current_published['time'] >= CURRENT_PUBLISH_INTERVAL:
+		current_published['data'] = data
+		current_published['time'] = now
+		publish_change('current')
+
 def read_current(zero_out=False):
 	"""
 	Read current.log and populate a list of data
@@ -2268,6 +2475,7 @@ def write_status(status):
 	global cmdsts
 
 	cmdsts.set('control:status', json.dumps(status))
+	publish_change('status')
 
 def read_status(init=False):
 	"""
@@ -2440,17 +2648,28 @@ def is_float(string):
 			return True
 	return False
 
-def process_command(action=None, arglist=[], origin='unknown', direct_write=False):
+def process_command(action=None, arglist=[], origin='unknown', direct_write=False, control=None, settings=None, deferred=None):
 	'''
 	Process incoming command from API or elsewhere
+
+	:param control: Control data to use (and update) instead of reading it, i.e. for a batch of commands
+	:param settings: Settings to use instead of reading them
+	:param deferred: List to record the direct_write flag of each control write in instead of writing 
+		(the caller writes the control once, see process_commands)
 	'''
 	data = {} 
 	data['result'] = 'OK'
 	data['message'] = 'Command was accepted successfully.'
 	data['data'] = {}
 
-	control = read_control()
-	settings = read_settings() 
+	control = read_control() if control is None else control
+	settings = read_settings() if settings is None else settings
+
+	def _write_control(control, direct_write=False, origin='unknown'):
+		if deferred is None:
+			write_control(control, direct_write=direct_write, origin=origin)
+		else:
+			deferred.append(direct_write)
 	
 	''' Populate any empty args with None just in case '''
 	num_args = len(arglist)
@@ -2563,7 +2782,7 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 			}
 			'''
 			control['hopper_check'] = True 
-			write_control(control, direct_write=direct_write, origin=origin)
+			_write_control(control, direct_write=direct_write, origin=origin)
 			time.sleep(3)
 			pelletdb = read_pellet_db()
 			data['data']['hopper'] = pelletdb['current']['hopper_level']
@@ -2692,7 +2911,7 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 				else:
 					control['primary_setpoint'] = float(arglist[1])
 				control['updated'] = True
-				write_control(control, direct_write=direct_write, origin=origin)
+				_write_control(control, direct_write=direct_write, origin=origin)
 			else:
 				data['result'] = 'ERROR'
 				data['message'] = f'Primary set point should be an integer or float in degrees {settings["globals"]["units"]}'
@@ -2705,10 +2924,10 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 				settings = convert_settings_units(arglist[1], settings)
 				write_settings(settings)
 				control['settings_update'] = True
-				write_control(control, direct_write=direct_write, origin=origin)
+				_write_control(control, direct_write=direct_write, origin=origin)
 				control['updated'] = True
 				control['units_change'] = True
-				write_control(control, direct_write=direct_write, origin=origin)
+				_write_control(control, direct_write=direct_write, origin=origin)
 				#print(f'Settings Units Changed to {arglist[1]}')
 			else:
 				data['result'] = 'ERROR'
@@ -2724,7 +2943,7 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 			if arglist[1] in ['startup', 'smoke', 'shutdown', 'stop', 'reignite', 'monitor', 'error', 'manual']:
 				control['mode'] = MODE_MAP[arglist[1]]
 				control['updated'] = True
-				write_control(control, direct_write=direct_write, origin=origin)
+				_write_control(control, direct_write=direct_write, origin=origin)
 			elif arglist[1] == 'prime':
 				try:
 					if arglist[2] is not None: 
@@ -2736,7 +2955,7 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 								control['next_mode'] = MODE_MAP[arglist[3]]
 							else:
 								control['next_mode'] = 'Stop'
-							write_control(control, direct_write=direct_write, origin=origin)
+							_write_control(control, direct_write=direct_write, origin=origin)
 						else:
 							data['result'] = 'ERROR'
 							data['message'] = f'Prime amount should be an integer in grams.'
@@ -2755,7 +2974,7 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 						else:
 							control['primary_setpoint'] = float(arglist[2])
 						control['updated'] = True
-						write_control(control, direct_write=direct_write, origin=origin)
+						_write_control(control, direct_write=direct_write, origin=origin)
 					else:
 						data['result'] = 'ERROR'
 						data['message'] = f'Set Mode {arglist[1]} with {arglist[2]} failed [not a number].'
@@ -2777,7 +2996,7 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 						settings['cycle_data']['PMode'] = int(arglist[1])
 						write_settings(settings)
 						control['settings_update'] = True 
-						write_control(control, direct_write=False, origin=origin)
+						_write_control(control, direct_write=False, origin=origin)
 					else:
 						data['result'] = 'ERROR'
 						data['message'] = f'Set PMode out of range(0-9): {arglist[1]}'
@@ -2797,7 +3016,7 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 				control['s_plus'] = True
 			else:
 				control['s_plus'] = False 
-			write_control(control, direct_write=direct_write, origin=origin)
+			_write_control(control, direct_write=direct_write, origin=origin)
 		
 		elif arglist[0] == 'lid_open':
 			'''
@@ -2809,7 +3028,7 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 			else:
 				control['lid_open_toggle'] = True 
 
-			write_control(control, direct_write=direct_write, origin=origin)
+			_write_control(control, direct_write=direct_write, origin=origin)
 
 		elif arglist[0] in ['notify', 'limit_high', 'limit_low']:
 			'''
@@ -2862,7 +3081,7 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 					else:
 						data['result'] = 'ERROR'
 						data['message'] = f'Notify object update failed.'
-					write_control(control, direct_write=False, origin=origin)
+					_write_control(control, direct_write=False, origin=origin)
 			else:
 				data['result'] = 'ERROR'
 				data['message'] = f'Notify object label was not specified.'
@@ -2877,7 +3096,7 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 				control['pwm_control'] = True
 			else:
 				control['pwm_control'] = False 
-			write_control(control, direct_write=direct_write, origin=origin) 
+			_write_control(control, direct_write=direct_write, origin=origin) 
 
 		elif arglist[0] == 'duty_cycle':
 			'''
@@ -2889,7 +3108,7 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 				duty_cycle = int(arglist[1])
 				if duty_cycle >= 0 and duty_cycle <= 100:
 					control['duty_cycle'] = duty_cycle
-					write_control(control, direct_write=False, origin=origin)
+					_write_control(control, direct_write=False, origin=origin)
 				else:
 					data['result'] = 'ERROR'
 					data['message'] = f'Duty cycle must be an integer between 0-100.'
@@ -2907,7 +3126,7 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 				control['tuning_mode'] = True
 			else:
 				control['tuning_mode'] = False 
-			write_control(control, direct_write=direct_write, origin=origin)
+			_write_control(control, direct_write=direct_write, origin=origin)
 
 		elif arglist[0] == 'timer':
 			'''
@@ -2938,18 +3157,18 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 					else:
 						control['timer']['end'] = now + 60
 					write_log('Timer started.  Ends at: ' + epoch_to_time(control['timer']['end']))
-					write_control(control, direct_write=direct_write, origin='app')
+					_write_control(control, direct_write=direct_write, origin='app')
 				else:	# If Timer was paused, restart with new end time.
 					control['timer']['end'] = (control['timer']['end'] - control['timer']['paused']) + now
 					control['timer']['paused'] = 0
 					write_log('Timer unpaused.  Ends at: ' + epoch_to_time(control['timer']['end']))
-					write_control(control, direct_write=direct_write, origin='app')
+					_write_control(control, direct_write=direct_write, origin='app')
 			elif arglist[1] == 'pause':
 				if control['timer']['start'] != 0:
 					control['notify_data'][index]['req'] = False
 					control['timer']['paused'] = now
 					write_log('Timer paused.')
-					write_control(control, direct_write=direct_write, origin='app')
+					_write_control(control, direct_write=direct_write, origin='app')
 				else:
 					control['notify_data'][index]['req'] = False
 					control['timer']['start'] = 0
@@ -2958,7 +3177,7 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 					control['notify_data'][index]['shutdown'] = False
 					control['notify_data'][index]['keep_warm'] = False
 					write_log('Timer cleared.')
-					write_control(control, direct_write=direct_write, origin='app')
+					_write_control(control, direct_write=direct_write, origin='app')
 			elif arglist[1] == 'stop':
 				control['notify_data'][index]['req'] = False
 				control['timer']['start'] = 0
@@ -2967,19 +3186,19 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 				control['notify_data'][index]['shutdown'] = False
 				control['notify_data'][index]['keep_warm'] = False
 				write_log('Timer stopped.')
-				write_control(control, direct_write=direct_write, origin='app')
+				_write_control(control, direct_write=direct_write, origin='app')
 			elif arglist[1] == 'shutdown':
 				if arglist[2] == 'true':
 					control['notify_data'][index]['shutdown'] = True
 				else:
 					control['notify_data'][index]['shutdown'] = False 
-				write_control(control, direct_write=direct_write, origin=origin)
+				_write_control(control, direct_write=direct_write, origin=origin)
 			elif arglist[1] == 'keep_warm':
 				if arglist[2] == 'true':
 					control['notify_data'][index]['keep_warm'] = True
 				else:
 					control['notify_data'][index]['keep_warm'] = False 
-				write_control(control, direct_write=direct_write, origin=origin)
+				_write_control(control, direct_write=direct_write, origin=origin)
 			else:
 				data['result'] = 'ERROR'
 				data['message'] = f'Timer command not recognized.'
@@ -3053,7 +3272,7 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 					data['result'] = 'ERROR'
 					data['message'] = f'Manual command not recognized or contained an error.'
 				if control['manual']['change'] in ['power', 'igniter', 'fan', 'auger', 'pwm']:
-					write_control(control, direct_write=direct_write, origin=origin)
+					_write_control(control, direct_write=direct_write, origin=origin)
 
 			else:
 				data['result'] = 'ERROR'
@@ -3103,6 +3322,25 @@ def process_command(action=None, arglist=[], origin='unknown', direct_write=Fals
 
 	return data
 
+def process_commands(commands, origin='unknown'):
+	'''
+	Process a batch of commands (i.e. a burst of MQTT commands) with a single read of the control data 
+	and settings, and a single control write for the whole batch.  The write is direct if any of the 
+	commands asked for a direct write, else it goes through the control write queue.  
+
+	:param commands: List of (action, arglist)
+	:return: List of the result of each command (see process_command)
+	'''
+	control = read_control()
+	settings = read_settings()
+	deferred = []
+	results = []
+	for action, arglist in commands:
+		results.append(process_command(action=action, arglist=arglist, origin=origin, control=control, settings=settings, deferred=deferred))
+	if deferred:
+		write_control(control, direct_write=any(deferred), origin=origin)
+	return results
+
 def set_nested_key_value(data, key_list, value):
 	"""
 	Sets the value of a key in a nested dictionary and returns the modified dictionary.
@@ -0,0 +1,157 @@
+'''
+==============================================================================
+ PiFire Downsampling Module
+==============================================================================
+
+Description: Reduces time-series data (i.e. history and cookfile charts) to a
+  target number of points, while keeping the shape of the data (including
+  temperature spikes) intact.
+
+  Algorithms:
+	'lttb'   - Largest-Triangle-Three-Buckets (best visual fidelity)
+	'minmax' - Keeps the minimum and maximum of each bucket (preserves every peak)
+	'nth'    - Every Nth point (legacy behavior)
+
+==============================================================================
+'''
+
+'''
+==============================================================================
+ Imported Modules
+==============================================================================
+'''
+import numpy as np
+
+'''
+==============================================================================
+ Constants and Globals
+==============================================================================
+'''
+ALGORITHMS = {
+	'lttb' : 'Largest-Triangle-Three-Buckets',
+	'minmax' : 'Min / Max per Bucket',
+	'nth' : 'Every Nth Point'
+}
+
+'''
+==============================================================================
+ Functions
+==============================================================================
+'''
+def _as_float_array(values):
+	''' Convert a list (which may contain None) to a float array with NaN for missing values '''
+	return np.array([np.nan if value is None else value for value in values], dtype=float)
+
+def nth_indices(num_items, threshold):
+	"""
+	Select every Nth index
+
+	:param num_items: Length of the data
+	:param threshold: Target number of points
+	:return: numpy array of indices
+	"""
+	if threshold <= 0 or num_items <= threshold:
+		return np.arange(num_items)
+	step = int(num_items / threshold)
+	return np.arange(0, num_items, step)
+
+def minmax_indices(y, threshold):
+	"""
+	Select the minimum and maximum of each bucket (threshold / 2 buckets), plus the first and last points
+
+	:param y: Values (numpy float array, NaN for missing values)
+	:param threshold: Target number of points
+	:return: numpy array of sorted indices
+	"""
+	num_items = len(y)
+	if threshold <= 0 or num_items <= threshold or threshold < 4:
+		return np.arange(num_items)
+
+	num_buckets = threshold // 2
+	edges = np.linspace(0, num_items, num_buckets + 1).astype(int)
+	bucket_ids = np.repeat(np.arange(num_buckets), np.diff(edges))
+	missing = np.isnan(y)
+
+	# Sort by bucket, then by value.  The first item of each bucket is then the minimum and the last the maximum.
+	order_min = np.lexsort((np.where(missing, np.inf, y), bucket_ids))
+	order_max = np.lexsort((np.where(missing, -np.inf, y), bucket_ids))
+	min_indices = order_min[edges[:-1]]
+	max_indices = order_max[edges[1:] - 1]
+
+	return np.unique(np.concatenate(([0, num_items - 1], min_indices, max_indices)))
+
+def lttb_indices(x, y, threshold):
+	"""
+	Select points with the Largest-Triangle-Three-Buckets algorithm
+
+	:param x: Timestamps (numpy float array)
+	:param y: Values (numpy float array, NaN for missing values)
+	:param threshold: Target number of points
+	:return: numpy array of sorted indices
+	"""
+	num_items = len(y)
+	if threshold <= 0 or num_items <= threshold or threshold < 3:
+		return np.arange(num_items)
+
+	# First and last points are always kept, the rest is split into (threshold - 2) buckets
+	edges = np.linspace(1, num_items - 1, threshold - 1).astype(int)
+	indices = np.empty(threshold, dtype=np.int64)
+	indices[0] = 0
+	indices[-1] = num_items - 1
+
+	selected = 0
+	for bucket in range(threshold - 2):
+		start, end = edges[bucket], edges[bucket + 1]
+		next_start = end
+		next_end = edges[bucket + 2] if bucket + 2 < len(edges) else num_items
+
+		# Average point of the next bucket
+		next_y = y[next_start:next_end]
+		next_y = next_y[~np.isnan(next_y)]
+		avg_x = x[next_start:next_end].mean()
+		avg_y = next_y.mean() if next_y.size else y[selected]
+
+		# Area of the triangle formed by the selected point, each candidate and the next bucket average
+		areas = np.abs((x[selected] - avg_x) * (y[start:end] - y[selected]) - (x[selected] - x[start:end]) * (avg_y - y[selected]))
+		areas[np.isnan(areas)] = -1
+
+		selected = start + int(np.argmax(areas))
+		indices[bucket + 1] = selected
+
+	return indices
+
+def downsample_indices(x, y, threshold, algorithm='lttb'):
+	"""
+	Get the indices of the points to keep for a single series
+
+	:param x: List of timestamps
+	:param y: List of values (None for missing values)
+	:param threshold: Target number of points (0 or less for all points)
+	:param algorithm: 'lttb', 'minmax' or 'nth'
+	:return: List of indices
+	"""
+	num_items = len(y)
+	if threshold <= 0 or num_items <= threshold:
+		return list(range(num_items))
+
+	if algorithm == 'lttb':
+		indices = lttb_indices(np.asarray(x, dtype=float), _as_float_array(y), threshold)
+	elif algorithm == 'minmax':
+		indices = minmax_indices(_as_float_array(y), threshold)
+	else:
+		indices = nth_indices(num_items, threshold)
+
+	return indices.tolist()
+
+def downsample(x, y, threshold, algorithm='lttb'):
+	"""
+	Downsample a single series
+
+	:param x: List of timestamps
+	:param y: List of values (None for missing values)
+	:param threshold: Target number of points (0 or less for all points)
+	:param algorithm: 'lttb', 'minmax' or 'nth'
+	:return: Tuple of lists (x, y)
+	"""
+	indices = downsample_indices(x, y, threshold, algorithm=algorithm)
+	return [x[index] for index in indices], [y[index] for index in indices]
@@ -0,0 +1,163 @@
+"""
+Class to estimate the time for each probe to reach a target temperature, updated online from the
+probe readings of the control loop (no history scans).
+
+For every probe the temperature is modelled as temp(t) = temp_now + rate * (t - t_now) and fit with
+exponentially-weighted recursive least squares (older readings are forgotten with a time constant of
+tau seconds).  The model is kept relative to the latest reading, so the update is a few multiplications
+per probe and reading, regardless of how much history it covers.  Readings closer together than interval
+seconds are skipped, so the estimate doesn't depend on the rate of the control loop.
+
+    estimator = ETAEstimator()
+    estimator.update(time.time(), {'Grill' : 225.0, 'Probe1' : 120.5})
+    estimator.eta('Probe1', 203)  # Seconds until Probe1 reaches 203 (or None)
+    estimator.estimates({'Probe1' : 203})  # ETA, rate and confidence of every probe
+"""
+import math
+from collections import deque
+
+
+class ProbeEstimator():
+    def __init__(self, tau=300, min_history=60, history_size=200, outlier_sigma=6.0, interval=1.0, max_outliers=5):
+        """
+        :param tau: Time constant (seconds) of the exponential forgetting
+        :param min_history: Seconds of readings needed before an ETA is given
+        :param history_size: Size of the ring buffer of recent readings (covers history_size * interval seconds)
+        :param outlier_sigma: Readings further than this many standard deviations from the model are ignored
+        :param interval: Minimum seconds between the readings used (readings in between are skipped)
+        :param max_outliers: Consecutive ignored readings after which the estimate restarts from the latest
+            reading (i.e. the probe was moved or the lid was opened)
+        """
+        self.tau = tau
+        self.min_history = min_history
+        self.outlier_sigma = outlier_sigma
+        self.interval = interval
+        self.max_outliers = max_outliers
+        self.history = deque(maxlen=history_size)  # Ring buffer of (time, temperature)
+        self.reset()
+
+    def reset(self):
+        self.history.clear()
+        self.time = None
+        self.temp = 0.0  # Model temperature at self.time
+        self.rate = 0.0  # Model rate (degrees per second)
+        self.p00, self.p01, self.p11 = 100.0, 0.0, 1.0  # Covariance (scaled) of temp / rate
+        self.noise = 1.0  # Exponentially weighted variance of the residuals
+        self.samples = 0
+        self.outliers = 0  # Consecutive ignored readings
+
+    def update(self, now, temp):
+        """
+        Add a reading
+
+        :param now: Time of the reading (seconds)
+        :param temp: Temperature (None or a non-number resets the estimate, i.e. probe disconnected)
+        """
+        if not isinstance(temp, (int, float)) or math.isnan(temp):
+            self.reset()
+            return
+        if self.time is None:
+            self.time, self.temp = now, float(temp)
+            self.history.append((now, temp))
+            self.samples = 1
+            return
+        dt = now - self.time
+        if dt < self.interval or dt <= 0:
+            return
+
+        # Move the model to the time of the reading
+        forget = math.exp(-dt / self.tau)
+        temp_prior = self.temp + self.rate * dt
+        p00 = self.p00 + 2 * dt * self.p01 + dt * dt * self.p11
+        p01 = self.p01 + dt * self.p11
+        p11 = self.p11
+
+        residual = temp - temp_prior
+        if self.samples > 10 and residual * residual > (self.outlier_sigma ** 2) * (self.noise + 0.01):
+            # Ignore glitches, but widen the gate so a lasting change is accepted (or restart after a step)
+            self.outliers += 1
+            if self.outliers >= self.max_outliers:
+                self.reset()
+                self.update(now, temp)
+            else:
+                self.noise *= 2
+            return
+        self.outliers = 0
+
+        # Recursive least squares update with the regressor [1, 0] (the reading is at the model time)
+        denominator = forget + p00
+        gain0, gain1 = p00 / denominator, p01 / denominator
+        self.temp = temp_prior + gain0 * residual
+        self.rate = self.rate + gain1 * residual
+        self.p00 = (p00 - gain0 * p00) / forget
+        self.p01 = (p01 - gain0 * p01) / forget
+        self.p11 = (p11 - gain1 * p01) / forget
+        self.noise = forget * self.noise + (1 - forget) * residual * residual
+        self.time = now
+        self.samples += 1
+        self.history.append((now, temp))
+
+    def ready(self):
+        return len(self.history) > 1 and (self.history[-1][0] - self.history[0][0]) >= self.min_history
+
+    def confidence(self):
+        """
+        :return: Confidence in the rate between 0 and 1 (0.5 when the standard error of the rate equals the rate)
+        """
+        if not self.ready():
+            return 0.0
+        rate_variance = self.noise * self.p11
+        return round(self.rate * self.rate / (self.rate * self.rate + rate_variance), 3) if self.rate != 0 else 0.0
+
+    def eta(self, target):
+        """
+        :param target: Target temperature
+        :return: Estimated seconds to reach the target or None (target reached, not rising or not enough readings)
+        """
+        if not self.ready() or target is None or target <= self.temp or self.rate <= 0:
+            return None
+        if target <= max(temp for _, temp in self.history):
+            return None
+        seconds = (target - self.temp) / self.rate
+        if math.isinf(seconds) or math.isnan(seconds):
+            return None
+        return int(seconds)
+
+
+class ETAEstimator():
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: Parameters for the estimator of each probe (see ProbeEstimator)
+        """
+        self.kwargs = kwargs
+        self.probes = {}
+
+    def update(self, now, temps):
+        """
+        :param now: Time of the readings (seconds)
+        :param temps: Dictionary of {label : temperature}
+        """
+        for label, temp in temps.items():
+            if label not in self.probes:
+                self.probes[label] = ProbeEstimator(**self.kwargs)
+            self.probes[label].update(now, temp)
+
+    def eta(self, label, target):
+        probe = self.probes.get(label)
+        return probe.eta(target) if probe is not None else None
+
+    def estimates(self, targets={}):
+        """
+        :param targets: Dictionary of {label : target temperature} (probes without a target get no ETA)
+        :return: Dictionary of {label : {'eta', 'target', 'rate' (degrees per minute), 'confidence'}}
+        """
+        estimates = {}
+        for label, probe in self.probes.items():
+            target = targets.get(label) or None
+            estimates[label] = {
+                'eta' : probe.eta(target),
+                'target' : target,
+                'rate' : round(probe.rate * 60, 2) if probe.ready() else None,
+                'confidence' : probe.confidence()
+            }
+        return estimates
@@ -0,0 +1,412 @@
+"""
+Class to create a compact, columnar time-series store for the cook history in redis
+
+Each history sample is the dictionary written by write_history(), i.e.:
+    {'T' : 1700000000000, 'P' : {'Grill' : 225.0}, 'F' : {'Probe1' : 140.0}, 'PSP' : 225, 'NT' : {...}, 'AUX' : {...}}
+
+The first sample after a flush sets the schema (the groups and probe labels), which is stored as a
+JSON header.  Every column ('T', 'P:Grill', 'F:Probe1', ...) is then stored as its own redis string
+of packed 8-byte values (int64 for 'T', float64 otherwise) used as a ring buffer of fixed capacity.
+A sample with new groups or labels (i.e. a probe was added or renamed) extends the schema with new
+columns, which are backfilled with None for the earlier samples.
+Appending a sample writes one value per column in place, and reading a range of samples is a
+GETRANGE per column, so no JSON is encoded or decoded for the data itself.
+"""
+import json
+import bisect
+from array import array
+import redis
+
+ITEM_SIZE = 8  # Bytes per value (int64 / float64)
+NAN = float('nan')
+NAN_BYTES = array('d', [NAN]).tobytes()
+
+# KEYS[1] = meta hash, KEYS[2..n] = column keys
+# ARGV[1] = schema (JSON), ARGV[2] = capacity, ARGV[3..n+1] = packed value for each column
+APPEND_SCRIPT = """
+local schema = redis.call('HGET', KEYS[1], 'schema')
+if not schema then
+    redis.call('HSET', KEYS[1], 'schema', ARGV[1], 'capacity', ARGV[2], 'count', 0)
+elseif schema ~= ARGV[1] then
+    return -1
+end
+local capacity = tonumber(redis.call('HGET', KEYS[1], 'capacity'))
+local seq = redis.call('HINCRBY', KEYS[1], 'count', 1) - 1
+local offset = (seq % capacity) * string.len(ARGV[3])
+for index = 2, #KEYS do
+    redis.call('SETRANGE', KEYS[index], offset, ARGV[index + 1])
+end
+return seq
+"""
+
+# KEYS[1] = meta hash, KEYS[2..n] = keys of the new columns
+# ARGV[1] = current schema (JSON), ARGV[2] = extended schema (JSON), ARGV[3] = packed missing value (NaN)
+# Returns 1 if the schema was extended, 0 if the current schema doesn't match (changed by another process)
+EXTEND_SCRIPT = """
+local meta = redis.call('HMGET', KEYS[1], 'schema', 'capacity')
+if meta[1] ~= ARGV[1] then
+    return 0
+end
+local fill = string.rep(ARGV[3], tonumber(meta[2]))
+for index = 2, #KEYS do
+    redis.call('SET', KEYS[index], fill)
+end
+redis.call('HSET', KEYS[1], 'schema', ARGV[2])
+return 1
+"""
+
+# KEYS[1] = meta hash, KEYS[2..n] = column keys
+# ARGV[1] = schema (JSON), ARGV[2] = first sequence number (negative for the most recent items), ARGV[3] = max items (0 = all),
+# ARGV[4] = item size in bytes
+# Returns {schema, first, last, column data...} where [first, last) is the range of sequence numbers read
+READ_SCRIPT = """
+local meta = redis.call('HMGET', KEYS[1], 'schema', 'capacity', 'count')
+if not meta[1] then
+    return {'', 0, 0}
+end
+if meta[1] ~= ARGV[1] then
+    return {meta[1], 0, 0}
+end
+local capacity = tonumber(meta[2])
+local count = tonumber(meta[3])
+local oldest = math.max(0, count - capacity)
+local first = tonumber(ARGV[2])
+local num = tonumber(ARGV[3])
+if first < 0 then
+    if num > 0 then
+        first = math.max(oldest, count - num)
+    else
+        first = oldest
+    end
+else
+    first = math.max(first, oldest)
+end
+local last = count
+if num > 0 then
+    last = math.min(count, first + num)
+end
+local result = {meta[1], first, last}
+if last <= first then
+    return result
+end
+local size = tonumber(ARGV[4])
+local start_slot = first % capacity
+local end_slot = (last - 1) % capacity
+for index = 2, #KEYS do
+    if start_slot <= end_slot then
+        result[index + 2] = redis.call('GETRANGE', KEYS[index], start_slot * size, (end_slot + 1) * size - 1)
+    else
+        result[index + 2] = redis.call('GETRANGE', KEYS[index], start_slot * size, capacity * size - 1) ..
+            redis.call('GETRANGE', KEYS[index], 0, (end_slot + 1) * size - 1)
+    end
+end
+return result
+"""
+
+
+class HistoryStore():
+    def __init__(self, prefix='control:history', capacity=28800):
+        self.prefix = prefix
+        self.meta_key = f'{prefix}:meta'
+        self.capacity = capacity
+        # Binary safe connection (packed values can't be decoded as utf-8)
+        self.redis_db = redis.StrictRedis('localhost', 6379)
+        self.append_script = self.redis_db.register_script(APPEND_SCRIPT)
+        self.read_script = self.redis_db.register_script(READ_SCRIPT)
+        self.extend_script = self.redis_db.register_script(EXTEND_SCRIPT)
+        self._set_schema(None)
+
+    def _column_key(self, column):
+        # Keyed by name (not position), so extending the schema doesn't move the existing columns
+        group, label = column
+        return f'{self.prefix}:{group}' if label is None else f'{self.prefix}:{group}:{label}'
+
+    def _set_schema(self, schema_json):
+        self.schema_json = schema_json
+        self.schema = json.loads(schema_json) if schema_json else None
+        self.columns = []
+        if self.schema:
+            for group, labels in self.schema:
+                if labels is None:
+                    self.columns.append((group, None))
+                else:
+                    for label in labels:
+                        self.columns.append((group, label))
+        self.column_keys = [self._column_key(column) for column in self.columns]
+
+    def _load_schema(self):
+        schema_json = self.redis_db.hget(self.meta_key, 'schema')
+        self._set_schema(schema_json.decode('utf-8') if schema_json else None)
+
+    @staticmethod
+    def schema_from_sample(sample):
+        """
+        Build the schema for a history sample.  Dictionary groups (P, F, NT, AUX, EXD) store their
+        labels, scalar groups (T, PSP) store None.
+        """
+        return [[group, list(value.keys()) if isinstance(value, dict) else None] for group, value in sample.items()]
+
+    @staticmethod
+    def merge_schema(schema, sample_schema):
+        """
+        Extend a schema with the groups and labels of a sample schema that it doesn't have (added at the end)
+        """
+        merged = [[group, list(labels) if labels is not None else None] for group, labels in schema]
+        groups = {group : labels for group, labels in merged}
+        for group, labels in sample_schema:
+            if group not in groups:
+                merged.append([group, list(labels) if labels is not None else None])
+                groups[group] = merged[-1][1]
+            elif labels is not None and groups[group] is not None:
+                groups[group].extend(label for label in labels if label not in groups[group])
+        return merged
+
+    def _extend_schema(self, schema):
+        """
+        Store an extended schema, creating its new columns filled with None
+
+        :return: True if extended, False if the stored schema was changed by another process
+        """
+        schema_json = json.dumps(schema)
+        new_keys = [key for key in self._keys_for(schema) if key not in self.column_keys]
+        if not self.extend_script(keys=[self.meta_key] + new_keys, args=[self.schema_json, schema_json, NAN_BYTES]):
+            return False
+        self._set_schema(schema_json)
+        return True
+
+    def _keys_for(self, schema):
+        return [self._column_key((group, label)) for group, labels in schema for label in ([None] if labels is None else labels)]
+
+    def _pack(self, sample):
+        packed = []
+        for group, label in self.columns:
+            if label is None:
+                value = sample.get(group)
+            else:
+                value = sample.get(group, {}).get(label)
+            if group == 'T':
+                packed.append(array('q', [int(value)]).tobytes())
+                continue
+            try:
+                value = NAN if value is None else float(value)
+            except (TypeError, ValueError):
+                value = NAN
+            packed.append(array('d', [value]).tobytes())
+        return packed
+
+    def append(self, sample, capacity=None):
+        """
+        Append a history sample.  If the sample has groups or labels that aren't in the stored schema
+        (i.e. a probe was added or renamed), the schema is extended with new columns (None for the earlier
+        samples).  Values missing from the sample are stored as None.
+
+        :param sample: History sample dictionary
+        :param capacity: Maximum number of samples to keep (only applied when the store is empty)
+        """
+        capacity = capacity if capacity is not None else self.capacity
+        sample_schema = self.schema_from_sample(sample)
+        for _ in range(3):
+            if self.schema is None:
+                self._load_schema()
+            if self.schema is None:
+                self._set_schema(json.dumps(sample_schema))
+            else:
+                schema = self.merge_schema(self.schema, sample_schema)
+                if schema != self.schema and not self._extend_schema(schema):
+                    # Schema was changed (or flushed) by another process; reload and retry
+                    self._set_schema(None)
+                    continue
+            seq = self.append_script(keys=[self.meta_key] + self.column_keys, args=[self.schema_json, capacity] + self._pack(sample))
+            if seq >= 0:
+                return seq
+            # Schema was changed (or flushed and re-created) by another process; reload and retry
+            self._set_schema(None)
+        return None
+
+    def length(self):
+        meta = self.redis_db.hmget(self.meta_key, 'capacity', 'count')
+        if meta[1] is None:
+            return 0
+        return min(int(meta[0]), int(meta[1]))
+
+    def flush(self):
+        self._load_schema()
+        keys = [self.meta_key] + self.column_keys
+        self.redis_db.delete(*keys)
+        self._set_schema(None)
+
+    def _fetch(self, first=-1, num_items=0, columns=None):
+        """
+        Fetch raw column data
+
+        :param first: First sequence number to read (negative to read the most recent num_items)
+        :param num_items: Maximum number of items (0 for all)
+        :param columns: List of (group, label) columns to read (None for all)
+        :return: (first sequence number, list of arrays in column order), arrays are None for columns not read
+        """
+        for _ in range(2):
+            if self.schema is None:
+                self._load_schema()
+                if self.schema is None:
+                    return 0, []
+            if columns is None:
+                indexes = range(len(self.columns))
+            else:
+                indexes = [self.columns.index(column) for column in columns if column in self.columns]
+            keys = [self.meta_key] + [self.column_keys[index] for index in indexes]
+            result = self.read_script(keys=keys, args=[self.schema_json, first, num_items, ITEM_SIZE])
+            schema_json = result[0].decode('utf-8')
+            if schema_json == self.schema_json:
+                break
+            self._set_schema(schema_json or None)
+        else:
+            return 0, []
+
+        first_seq = result[1]
+        arrays = [None] * len(self.columns)
+        for index, data in zip(indexes, result[3:]):
+            values = array('q' if self.columns[index][0] == 'T' else 'd')
+            values.frombytes(data)
+            values = values.tolist()
+            # NaN values are stored for missing data (None)
+            if values and self.columns[index][0] != 'T' and NAN_BYTES in data:
+                values = [None if value != value else value for value in values]
+            arrays[index] = values
+        return first_seq, arrays
+
+    def _to_columns(self, arrays):
+        data = {}
+        index = 0
+        for group, labels in self.schema:
+            if labels is None:
+                data[group] = arrays[index]
+                index += 1
+            else:
+                data[group] = {}
+                for label in labels:
+                    data[group][label] = arrays[index]
+                    index += 1
+        return data
+
+    def _to_rows(self, arrays):
+        if not arrays or arrays[0] is None:
+            return []
+        rows = []
+        for row in zip(*arrays):
+            sample = {}
+            index = 0
+            for group, labels in self.schema:
+                if labels is None:
+                    sample[group] = row[index]
+                    index += 1
+                else:
+                    sample[group] = {}
+                    for label in labels:
+                        sample[group][label] = row[index]
+                        index += 1
+            rows.append(sample)
+        return rows
+
+    def read(self, num_items=0):
+        """
+        Read the most recent history samples
+
+        :param num_items: Number of items from the end of the history (0 for all)
+        :return: List of history sample dictionaries (oldest first)
+        """
+        _, arrays = self._fetch(-1, num_items)
+        return self._to_rows(arrays)
+
+    def read_columns(self, num_items=0):
+        """
+        Read the most recent history samples in columnar format
+
+        :param num_items: Number of items from the end of the history (0 for all)
+        :return: Dictionary of lists, i.e. {'T' : [...], 'P' : {'Grill' : [...]}, 'PSP' : [...], ...} or {} if empty
+        """
+        _, arrays = self._fetch(-1, num_items)
+        if not arrays or not arrays[0]:
+            return {}
+        return self._to_columns(arrays)
+
+    def _seek(self, start=None):
+        """
+        Find the timestamps from the first sample at or after start.  The 'T' column is sorted, so it is
+        used as the index: the search gallops back from the newest sample (reading 64, 512, 4096, ...
+        timestamps) until it passes start, so a cursor near the end of the history costs a single small read.
+
+        :param start: Start time in milliseconds (None to read all timestamps)
+        :return: (sequence number of timestamps[0], list of timestamps) or (0, None) if the history is empty
+        """
+        num_items = 0 if start is None else 64
+        while True:
+            first_seq, arrays = self._fetch(-1, num_items, columns=[('T', None)])
+            timestamps = arrays[self.columns.index(('T', None))] if arrays else None
+            if not timestamps:
+                return 0, None
+            if num_items == 0 or len(timestamps) < num_items or timestamps[0] < start:
+                return first_seq, timestamps
+            num_items *= 8
+
+    def labels(self):
+        """
+        Get the groups and labels of the stored history
+
+        :return: Dictionary of {group : list of labels (None for scalar groups)}, i.e. {'T' : None, 'P' : ['Grill'], ...}
+        """
+        if self.schema is None:
+            self._load_schema()
+        return {group : labels for group, labels in self.schema} if self.schema else {}
+
+    def read_column(self, group, label=None):
+        """
+        Read a single column for the whole history
+
+        :param group: Group (i.e. 'T', 'PSP', 'F')
+        :param label: Probe label for dictionary groups (i.e. 'Probe1'), None for scalar groups
+        :return: List of values (oldest first), empty if the column doesn't exist
+        """
+        _, arrays = self._fetch(-1, 0, columns=[(group, label)])
+        if not arrays or (group, label) not in self.columns:
+            return []
+        return arrays[self.columns.index((group, label))] or []
+
+    def iter_rows(self, chunk_size=1000):
+        """
+        Iterate over all history samples (oldest first), reading chunk_size samples at a time so that the
+        whole history is never held in memory
+
+        :param chunk_size: Number of samples read per request
+        """
+        meta = self.redis_db.hmget(self.meta_key, 'capacity', 'count')
+        if meta[1] is None:
+            return
+        seq = max(0, int(meta[1]) - int(meta[0]))
+        while True:
+            first_seq, arrays = self._fetch(seq, chunk_size)
+            rows = self._to_rows(arrays)
+            if not rows:
+                return
+            yield from rows
+            seq = first_seq + len(rows)
+
+    def read_range(self, start=None, end=None, columnar=True):
+        """
+        Read the history samples with a timestamp ('T') within [start, end]
+
+        :param start: Start time in milliseconds (None for the oldest sample)
+        :param end: End time in milliseconds (None for the newest sample)
+        :param columnar: True to return columnar format, False to return a list of samples
+        """
+        empty = {} if columnar else []
+        first_seq, timestamps = self._seek(start)
+        if not timestamps:
+            return empty
+        low = 0 if start is None else bisect.bisect_left(timestamps, start)
+        high = len(timestamps) if end is None else bisect.bisect_right(timestamps, end)
+        if high <= low:
+            return empty
+        _, arrays = self._fetch(first_seq + low, high - low)
+        if not arrays or not arrays[0]:
+            return empty
+        return self._to_columns(arrays) if columnar else self._to_rows(arrays)
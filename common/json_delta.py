@@ -0,0 +1,100 @@
+"""
+Class to delta encode a stream of JSON payloads (i.e. the socket.io dash / pellet / event data)
+
+Each message is either a full snapshot or a JSON Patch (RFC 6902, 'add' / 'replace' / 'remove'
+operations only) against the previous payload:
+
+    {'seq' : 12, 'type' : 'snapshot', 'data' : {...}}
+    {'seq' : 13, 'type' : 'delta', 'patch' : [{'op' : 'replace', 'path' : '/primaryProbe/temp', 'value' : 225}]}
+
+The sequence number increments with every message.  A client that sees a gap in the sequence
+(or hasn't received a snapshot yet) should request a new snapshot.  Snapshots are also sent
+periodically so that clients recover even without asking.
+"""
+import copy
+import time
+
+
+def _escape(key):
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def make_patch(old, new, path=''):
+    """
+    Build a list of JSON Patch operations that transform old into new.  Dictionaries are diffed
+    by key and lists of the same length by index, anything else is replaced as a whole.
+
+    :param old: Previous value
+    :param new: New value
+    :param path: JSON Pointer of the values (used for recursion)
+    :return: List of patch operations (empty if old == new)
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        patch = []
+        for key, value in new.items():
+            child_path = f'{path}/{_escape(key)}'
+            if key not in old:
+                patch.append({'op' : 'add', 'path' : child_path, 'value' : value})
+            else:
+                patch.extend(make_patch(old[key], value, child_path))
+        for key in old:
+            if key not in new:
+                patch.append({'op' : 'remove', 'path' : f'{path}/{_escape(key)}'})
+        return patch
+
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        patch = []
+        for index, (old_value, new_value) in enumerate(zip(old, new)):
+            patch.extend(make_patch(old_value, new_value, f'{path}/{index}'))
+        return patch
+
+    if type(old) is not type(new) or old != new:
+        return [{'op' : 'replace', 'path' : path, 'value' : new}]
+    return []
+
+
+class DeltaEncoder():
+    def __init__(self, snapshot_interval=60):
+        """
+        :param snapshot_interval: Seconds between full snapshots (0 = only on request)
+        """
+        self.snapshot_interval = snapshot_interval
+        self.seq = 0
+        self.last = None
+        self.last_snapshot_time = 0
+
+    def encode(self, data):
+        """
+        Encode the next payload
+
+        :param data: Payload (JSON serializable)
+        :return: Tuple of (message or None if nothing changed, True if the payload changed)
+        """
+        if self.last is None:
+            return self._snapshot(data), True
+
+        patch = make_patch(self.last, data)
+        if self.snapshot_interval and (time.time() - self.last_snapshot_time) > self.snapshot_interval:
+            return self._snapshot(data), bool(patch)
+        if not patch:
+            return None, False
+
+        self.seq += 1
+        self.last = copy.deepcopy(data)
+        return {'seq' : self.seq, 'type' : 'delta', 'patch' : patch}, True
+
+    def snapshot(self):
+        """
+        Full snapshot of the last payload (i.e. for a client that just joined or lost sync)
+
+        :return: Snapshot message (at the current sequence number) or None if nothing was encoded yet
+        """
+        if self.last is None:
+            return None
+        return {'seq' : self.seq, 'type' : 'snapshot', 'data' : self.last}
+
+    def _snapshot(self, data):
+        self.seq += 1
+        self.last = copy.deepcopy(data)
+        self.last_snapshot_time = time.time()
+        return {'seq' : self.seq, 'type' : 'snapshot', 'data' : data}
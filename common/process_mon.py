@@ -26,7 +26,7 @@ import time
 import threading 
 import subprocess 
 import logging 
-from common import create_logger, is_real_hardware, write_control, read_control
+from common import create_logger, is_real_hardware, write_control
 from notify.notifications import *
 
 '''
@@ -83,13 +83,15 @@ class Process_Monitor:
                 now = time.time()
                 if now - self.last_heartbeat > self.timeout:
                     # Set control process critical error flag 
-                    control = read_control()
-                    control['updated'] = True 
-                    control['mode'] = 'Error'
-                    control['critical_error'] = True
+                    control = {
+                        'updated' : True,
+                        'mode' : 'Error',
+                        'critical_error' : True
+                    }
                     write_control(control, direct_write=True, origin='process_monitor')
                     # Send notification
                     send_notifications("Control_Process_Stopped") 
+                    flush_notifications(timeout=20)  # Deliver before the process is restarted
                     # Log error
                     message = f'The {self.process} process experienced a timeout event (no heartbeat detected in {self.timeout} seconds) and is being reset.'
                     self.event_logger.error(message)
@@ -18,6 +18,13 @@ class RedisQueue():
         if self.length() > 0:
             popped = json.loads(self.redis_db.lpop(self.hashname))
         return popped 
+
+    def pop_wait(self, timeout=0):
+        """
+        Pop the next item, waiting up to timeout seconds for one to be pushed (0 = wait forever)
+        """
+        popped = self.redis_db.blpop(self.hashname, timeout=timeout)
+        return json.loads(popped[1]) if popped is not None else None
         
     def length(self):
         return self.redis_db.llen(self.hashname)
@@ -0,0 +1,146 @@
+"""
+Class to create an in-process cache of the parsed settings, validated against a version counter in Redis
+"""
+import os
+import json
+import threading
+
+
+class ReadOnlyDict(dict):
+    """
+    Dictionary that refuses modification.  Subclasses dict so that it can be passed
+    directly to json.dumps(), Jinja templates, etc.
+    """
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('Settings returned with readonly=True cannot be modified.  Use read_settings() for a writable copy.')
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+    __ior__ = _readonly
+
+    def copy(self):
+        return thaw(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return (dict, (thaw(self),))
+
+
+class ReadOnlyList(list):
+    """
+    List that refuses modification.
+    """
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('Settings returned with readonly=True cannot be modified.  Use read_settings() for a writable copy.')
+
+    __setitem__ = __delitem__ = _readonly
+    append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+    __iadd__ = __imul__ = _readonly
+
+    def copy(self):
+        return thaw(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return (list, (thaw(self),))
+
+
+def freeze(data):
+    """
+    Recursively convert dicts / lists to their read-only equivalents
+    """
+    if isinstance(data, dict):
+        return ReadOnlyDict((key, freeze(value)) for key, value in data.items())
+    if isinstance(data, list):
+        return ReadOnlyList(freeze(value) for value in data)
+    return data
+
+
+def thaw(data):
+    """
+    Recursively convert read-only dicts / lists back into plain (writable) copies
+    """
+    if isinstance(data, dict):
+        return {key: thaw(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [thaw(value) for value in data]
+    return data
+
+
+class SettingsCache():
+    """
+    Holds the last parsed copy of a settings file along with the signature it was read at.
+    The signature is the version counter in Redis (bumped on every write_settings) combined with
+    the file modification time, so that changes from another process or a hand edit of the file
+    are both detected without re-reading the file.
+
+    Writable copies are produced by re-parsing the cached JSON string (fast, done in C) so that
+    callers can never modify the cached data.  Read-only views are shared and built once per version.
+    """
+    def __init__(self, redis_db, version_key='settings:version'):
+        self.redis_db = redis_db
+        self.version_key = version_key
+        self.lock = threading.Lock()
+        self.entries = {}  # filename : {'signature' : (version, mtime), 'json' : str, 'frozen' : ReadOnlyDict}
+
+    def signature(self, filename):
+        """
+        Get the current signature for filename.  Returns None if it cannot be determined.
+        """
+        try:
+            return (self.redis_db.get(self.version_key), os.stat(filename).st_mtime_ns)
+        except:
+            return None
+
+    def get(self, filename, readonly=False):
+        """
+        Get cached settings if the cache is current, otherwise return None
+        """
+        signature = self.signature(filename)
+        if signature is None:
+            return None
+
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is None or entry['signature'] != signature:
+                return None
+            if not readonly:
+                return json.loads(entry['json'])
+            if entry['frozen'] is None:
+                entry['frozen'] = freeze(json.loads(entry['json']))
+            return entry['frozen']
+
+    def store(self, filename, json_string, signature):
+        """
+        Store the JSON string of the settings read (or written) at the given signature
+        """
+        if signature is None:
+            return
+        with self.lock:
+            self.entries[filename] = {
+                'signature' : signature,
+                'json' : json_string,
+                'frozen' : None
+            }
+
+    def bump(self):
+        """
+        Increment the version counter so all processes re-validate their cache
+
+        :return: New version (as stored in Redis) or None if Redis could not be reached
+        """
+        try:
+            return str(self.redis_db.incr(self.version_key))
+        except:
+            return None
+
+    def invalidate(self, filename=None):
+        with self.lock:
+            if filename is None:
+                self.entries = {}
+            else:
+                self.entries.pop(filename, None)
@@ -0,0 +1,146 @@
+"""
+Class to measure where the time of the control work cycle goes.
+
+Each stage of a cycle is timed with a monotonic clock (one clock read per stage) and added to a histogram
+of the stage with logarithmic buckets (50 us to ~30 s, 25% apart), so recording is O(1) and the memory used
+is fixed.  The histograms cover a rolling window of the last window to 2 * window cycles, from which the
+p50 / p95 / p99 of every stage are estimated.  Cycles longer than the budget are counted as overruns, along
+with the stage that took the longest in them.
+
+    timer = StageTimer(budget=0.05)
+    while True:
+        timer.start()
+        read_probes()
+        timer.mark('read_probes')  # Time since the last mark (or start) is added to 'read_probes'
+        ...
+        timer.end()
+    timer.get_stats()
+"""
+import math
+import time
+
+BUCKET_MIN = 0.00005  # Upper bound of the first bucket (seconds)
+BUCKET_GROWTH = 1.25  # Ratio between the bounds of adjacent buckets
+BUCKET_COUNT = 60
+
+
+class StageTimer():
+    def __init__(self, budget=0.05, window=1200, clock=time.monotonic):
+        """
+        :param budget: Target duration (seconds) of a cycle, longer cycles are counted as overruns
+        :param window: Number of cycles in each of the two rolling windows of the histograms
+        :param clock: Monotonic clock (seconds)
+        """
+        self.budget = budget
+        self.window = window
+        self.clock = clock
+        self.stages = {}
+        self.cycle = {}  # Time of each stage in the current cycle
+        self.cycles = 0
+        self.overruns = 0
+        self.overrun_stages = {}
+        self.window_cycles = 0
+        self.cycle_start = self.lap = self.clock()
+
+    def start(self):
+        """
+        Start a cycle
+        """
+        self.cycle = {}
+        self.cycle_start = self.lap = self.clock()
+
+    def mark(self, stage):
+        """
+        Add the time since the last mark (or the start of the cycle) to a stage.  A stage can be marked
+        more than once per cycle (the times are added).
+        """
+        now = self.clock()
+        self.cycle[stage] = self.cycle.get(stage, 0.0) + now - self.lap
+        self.lap = now
+
+    def end(self):
+        """
+        End the cycle and add the time of each stage (and the total time as 'cycle') to the histograms
+        """
+        total = self.clock() - self.cycle_start
+        for stage, duration in self.cycle.items():
+            self._record(stage, duration)
+        self._record('cycle', total)
+        self.cycles += 1
+        if total > self.budget:
+            self.overruns += 1
+            if self.cycle:
+                slowest = max(self.cycle, key=self.cycle.get)
+                self.overrun_stages[slowest] = self.overrun_stages.get(slowest, 0) + 1
+
+        self.window_cycles += 1
+        if self.window_cycles >= self.window:
+            self.window_cycles = 0
+            for stats in self.stages.values():
+                stats['previous'] = stats['current']
+                stats['current'] = self._new_window()
+
+    def _new_window(self):
+        return {'buckets' : [0] * BUCKET_COUNT, 'count' : 0, 'total' : 0.0, 'max' : 0.0}
+
+    def _record(self, stage, duration):
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = self.stages[stage] = {'current' : self._new_window(), 'previous' : self._new_window(), 'last' : 0.0}
+        window = stats['current']
+        if duration <= BUCKET_MIN:
+            index = 0
+        else:
+            index = min(BUCKET_COUNT - 1, math.ceil(math.log(duration / BUCKET_MIN, BUCKET_GROWTH)))
+        window['buckets'][index] += 1
+        window['count'] += 1
+        window['total'] += duration
+        window['max'] = max(window['max'], duration)
+        stats['last'] = duration
+
+    def _percentiles(self, buckets, count, percentiles):
+        """
+        :return: The upper bound of the bucket containing each percentile (seconds)
+        """
+        results = []
+        cumulative = 0
+        index = 0
+        for percentile in percentiles:
+            target = math.ceil(count * percentile / 100)
+            while index < BUCKET_COUNT - 1 and cumulative + buckets[index] < target:
+                cumulative += buckets[index]
+                index += 1
+            results.append(BUCKET_MIN * (BUCKET_GROWTH ** index))
+        return results
+
+    def get_stats(self):
+        """
+        :return: Dictionary with the number of cycles, the overruns (and the slowest stage of the overrun
+            cycles) and for each stage the count, mean, max, last, p50, p95 and p99 in milliseconds
+        """
+        stages = {}
+        for stage, stats in self.stages.items():
+            current, previous = stats['current'], stats['previous']
+            count = current['count'] + previous['count']
+            if count == 0:
+                continue
+            buckets = [a + b for a, b in zip(current['buckets'], previous['buckets'])]
+            p50, p95, p99 = self._percentiles(buckets, count, [50, 95, 99])
+            maximum = max(current['max'], previous['max'])
+            stages[stage] = {
+                'count' : count,
+                'mean' : round((current['total'] + previous['total']) / count * 1000, 3),
+                'max' : round(maximum * 1000, 3),
+                'last' : round(stats['last'] * 1000, 3),
+                # The bucket bound can exceed the largest time recorded
+                'p50' : round(min(p50, maximum) * 1000, 3),
+                'p95' : round(min(p95, maximum) * 1000, 3),
+                'p99' : round(min(p99, maximum) * 1000, 3)
+            }
+        return {
+            'budget' : round(self.budget * 1000, 3),
+            'cycles' : self.cycles,
+            'overruns' : self.overruns,
+            'overrun_stages' : dict(self.overrun_stages),
+            'stages' : stages
+        }
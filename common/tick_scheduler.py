@@ -0,0 +1,156 @@
+"""
+Class to run the control work cycle at a fixed rate and to schedule the periodic tasks within it.
+
+The work cycle runs on a fixed grid of ticks (start + n * tick), so the time spent on the work of a cycle
+doesn't shift the following ticks.  Periodic tasks (i.e. display refresh, history write, hopper check) are
+registered with a period and are due at start + n * period (drift compensated, so a late run doesn't delay
+the next one).  The lateness of each run (jitter), its run time and overruns (run time longer than the
+period or ticks / runs that were missed) are kept for every task.
+
+    scheduler = TickScheduler(tick=0.05)
+    scheduler.register('display', 0.5)
+    while True:
+        if scheduler.due('display'):
+            ...
+            scheduler.done('display')
+        scheduler.sleep(next_auger_toggle)  # Sleep until the next tick (or until the auger toggle, if earlier)
+"""
+import math
+import time
+
+
+class TickScheduler():
+    def __init__(self, tick=0.05, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param tick: Period (seconds) of the work cycle
+        :param clock: Monotonic clock (seconds)
+        :param sleep: Sleep function (seconds)
+        """
+        self.tick = tick
+        self.clock = clock
+        self._sleep = sleep
+        self.start = self.clock()
+        self.next_tick = self.start + tick
+        self.tasks = {}
+        self.cycle = self._new_stats(tick)
+        self.cycle_start = self.start
+
+    def _new_stats(self, period):
+        return {
+            'period' : period, 'runs' : 0, 'overruns' : 0, 'skipped' : 0,
+            'jitter_last' : 0.0, 'jitter_max' : 0.0, 'jitter_mean' : 0.0,
+            'runtime_last' : 0.0, 'runtime_max' : 0.0
+        }
+
+    def _record_jitter(self, stats, lateness):
+        stats['runs'] += 1
+        stats['jitter_last'] = lateness
+        stats['jitter_max'] = max(stats['jitter_max'], lateness)
+        # Exponentially weighted mean over the last ~100 runs
+        weight = max(0.01, 1 / stats['runs'])
+        stats['jitter_mean'] += weight * (lateness - stats['jitter_mean'])
+
+    def _record_runtime(self, stats, runtime):
+        stats['runtime_last'] = runtime
+        stats['runtime_max'] = max(stats['runtime_max'], runtime)
+        if runtime > stats['period']:
+            stats['overruns'] += 1
+
+    def register(self, name, period, run_first=False):
+        """
+        Register a periodic task.  Registering a task again restarts its period and keeps its stats.
+
+        :param name: Name of the task
+        :param period: Period (seconds)
+        :param run_first: True for the task to be due on the first check, else it is due after one period
+        """
+        stats = self.tasks.get(name)
+        if stats is None:
+            stats = self.tasks[name] = self._new_stats(period)
+        stats['period'] = period
+        stats.pop('started', None)
+        stats['next'] = self.clock() if run_first else self.clock() + period
+
+    def due(self, name):
+        """
+        Check if a task is due.  If it is, the next run is scheduled (missed runs are skipped, not caught up).
+
+        :param name: Name of the task
+        :return: True if the task is due (call done() after running it to record its run time)
+        """
+        task = self.tasks[name]
+        now = self.clock()
+        if now < task['next']:
+            return False
+        lateness = now - task['next']
+        self._record_jitter(task, lateness)
+        missed = math.floor(lateness / task['period'])
+        if missed > 0:
+            task['skipped'] += missed
+        task['next'] += (missed + 1) * task['period']
+        task['started'] = now
+        return True
+
+    def done(self, name):
+        """
+        Record the run time of a task (since it was due)
+        """
+        task = self.tasks[name]
+        if 'started' in task:
+            self._record_runtime(task, self.clock() - task.pop('started'))
+
+    def reset(self, name, run_now=False):
+        """
+        Restart the period of a task from now, i.e. after it was run on request
+
+        :param run_now: True for the task to be due on the next check
+        """
+        task = self.tasks[name]
+        task['next'] = self.clock() if run_now else self.clock() + task['period']
+
+    def restart(self):
+        """
+        Restart the tick grid from now (i.e. when the work cycle is entered again after a pause), so the time
+        the cycle wasn't running isn't counted as missed ticks.  The stats are kept.
+        """
+        self.cycle_start = self.clock()
+        self.next_tick = self.cycle_start + self.tick
+
+    def sleep(self, *wake_at):
+        """
+        Sleep until the next tick of the work cycle.  If the cycle overran the tick, the missed ticks are
+        skipped (counted as overruns) and the cycle continues on the grid.
+
+        :param wake_at: Optional times (time.time() based) to wake up earlier than the next tick, i.e. an auger
+            toggle.  Times that already passed are ignored and the next tick stays on the grid.
+        """
+        now = self.clock()
+        self._record_runtime(self.cycle, now - self.cycle_start)
+        if now >= self.next_tick:
+            missed = math.floor((now - self.next_tick) / self.tick) + 1
+            self.cycle['skipped'] += missed
+            self.next_tick += missed * self.tick
+        target = self.next_tick
+        wall_time = time.time()
+        for wake_time in wake_at:
+            if wake_time > wall_time:
+                target = min(target, now + wake_time - wall_time)
+        if target > now:
+            self._sleep(target - now)
+        self.cycle_start = self.clock()
+        self._record_jitter(self.cycle, max(0.0, self.cycle_start - target))
+        if target == self.next_tick:
+            self.next_tick += self.tick
+
+    def get_stats(self):
+        """
+        :return: Dictionary of {'cycle' : stats, 'tasks' : {name : stats}} with runs, overruns, skipped runs,
+            jitter (last / max / mean) and run time (last / max) in seconds
+        """
+        def rounded(stats):
+            return {key : round(value, 4) if isinstance(value, float) else value for key, value in stats.items() if key not in ('next', 'started')}
+        return {
+            'uptime' : round(self.clock() - self.start, 1),
+            'cycle' : rounded(self.cycle),
+            'tasks' : {name : rounded(task) for name, task in self.tasks.items()}
+        }
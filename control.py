@@ -25,6 +25,9 @@ import atexit
 from common import *  # Common Module for WebUI and Control Program
 from common.process_mon import Process_Monitor
 from common.redis_queue import RedisQueue
+from common.eta_estimator import ETAEstimator
+from common.tick_scheduler import TickScheduler
+from common.stage_timer import StageTimer
 from notify.notifications import *
 from file_mgmt.recipes import convert_recipe_units
 from file_mgmt.cookfile import create_cookfile
@@ -113,7 +116,7 @@ Set up Probes Input Module
 '''
 try: 
 	from probes.main import ProbesMain  # Probe device library: loads probe devices and maps them to ports
-	probe_complex = ProbesMain(settings["probe_settings"]["probe_map"], settings['globals']['units'])
+	probe_complex = ProbesMain(settings["probe_settings"]["probe_map"], settings['globals']['units'], concurrent=settings['probe_settings'].get('concurrent_reads', False), temp_filter=settings['probe_settings'].get('temp_filter', 'mean'))
 
 except:
 	controlLogger.exception(f'Error occurred loading probes modules. Trace dump: ')
@@ -232,6 +235,14 @@ pelletdb['current']['hopper_level'] = dist_device.get_level(override=True)
 write_pellet_db(pelletdb)
 eventLogger.info(f'Hopper Level Checked @ {pelletdb["current"]["hopper_level"]}%')
 
+# Online ETA estimate for each probe (fed with the probe readings of every work cycle, kept across modes)
+eta_estimator = ETAEstimator()
+
+# Fixed rate scheduler of the work cycle and the timing of its stages (published with the history write), 
+# kept across modes so the stats cover the whole run
+scheduler = TickScheduler(tick=0.05)
+timer = StageTimer(budget=scheduler.tick)
+
 '''
 *****************************************
  	Function Definitions
@@ -302,7 +313,7 @@ def _process_system_commands(grill_platform):
 			}
 		system_output.push(result)
 
-def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device):
+def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device, eta_estimator, scheduler, timer):
 	"""
 	Work Cycle Function
 
@@ -311,6 +322,9 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 	:param probe_complex: ADC Device
 	:param display_device: Display Device
 	:param dist_device: Distance Device
+	:param eta_estimator: ETA Estimator (kept across modes)
+	:param scheduler: Tick Scheduler of the work cycle (kept across modes)
+	:param timer: Stage Timer of the work cycle (kept across modes)
 	"""
 
 	# Setup Process Monitor and Start 
@@ -527,24 +541,19 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 		control['startup_timestamp'] = start_time 
 		write_control(control, direct_write=True, origin='control')
 
-	# Set time since toggle for temperature
-	temp_toggle_time = start_time
-
-	# Set time since toggle for checking ETA
-	eta_toggle_time = start_time
+	# Run the work cycle at a fixed rate, with the periodic tasks scheduled on the same clock
+	scheduler.restart()
+	scheduler.register('hopper', 60)  # Hopper level check
+	scheduler.register('eta', 20)  # ETA update of pending notifications
+	scheduler.register('display', 0.5)  # Display refresh
+	scheduler.register('history', 3)  # History write & heartbeat
 
 	# Set time since toggle for auger
 	auger_toggle_time = start_time
 
-	# Set time since toggle for display
-	display_toggle_time = start_time
-
 	# Initializing Start Time for Fan
 	fan_cycle_toggle_time = start_time
 
-	# Set time since toggle for hopper check
-	hopper_toggle_time = start_time
-
 	# Set time since fan speed update
 	fan_update_time = start_time
 
@@ -573,11 +582,13 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 	# ============ Main Work Cycle ============
 	while status == 'Active':
 		now = time.time()
+		timer.start()
 
-		execute_control_writes()
-		control = read_control()
+		control = merge_control_writes()
+		timer.mark('control_writes')
 
 		_process_system_commands(grill_platform)
+		timer.mark('system_commands')
 
 		# Check if new mode has been requested
 		if control['updated']:
@@ -586,7 +597,7 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 		# Check if user changed settings and reload
 		if control['settings_update']:
 			control['settings_update'] = False
-			write_control(control, direct_write=True, origin='control')
+			write_control({'settings_update' : False}, direct_write=True, origin='control')
 			settings = read_settings()
 			# Change the log level if settings were updated
 			if settings['globals']['debug_mode']:
@@ -605,7 +616,7 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 
 		if control['controller_update'] and mode == 'Hold':
 			control['controller_update'] = False
-			write_control(control, direct_write=True, origin='control')
+			write_control({'controller_update' : False}, direct_write=True, origin='control')
 			# Reinitialize the controller with the updated settings
 			settings = read_settings()
 			controllerCore, controller_status = _init_controller(settings, control)
@@ -618,21 +629,25 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 			full = settings['pelletlevel']['full']
 			dist_device.update_distances(empty, full)
 			control['distance_update'] = False
-			write_control(control, direct_write=True, origin='control')
+			write_control({'distance_update' : False}, direct_write=True, origin='control')
 
-		# Check hopper level when requested or every 300 seconds
-		if control['hopper_check'] or (now - hopper_toggle_time) > 60:
+		timer.mark('control')
+		# Check hopper level when requested or every 60 seconds
+		if control['hopper_check'] or scheduler.due('hopper'):
 			pelletdb = read_pellet_db()
 			override = False 
 			if control['hopper_check']:
 				control['hopper_check'] = False
-				write_control(control, direct_write=True, origin='control')
+				write_control({'hopper_check' : False}, direct_write=True, origin='control')
 				override = True
 			# Get current hopper level and save it to the current pellet information
 			pelletdb['current']['hopper_level'] = dist_device.get_level(override=override)			
 			write_pellet_db(pelletdb)
-			hopper_toggle_time = now
+			if override:
+				scheduler.reset('hopper')
+			scheduler.done('hopper')
 			eventLogger.info("Hopper Level Checked @ " + str(pelletdb['current']['hopper_level']) + "%")
+			timer.mark('hopper')
 
 		# Check for update in ON/OFF Switch
 		if not settings['platform']['standalone'] and last != grill_platform.get_input_status():
@@ -700,8 +715,9 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 
 				control['manual']['change'] = None
 				control['manual']['output'] = None
-				write_control(control, direct_write=True, origin='control')
+				write_control({'manual' : control['manual']}, direct_write=True, origin='control')
 
+		timer.mark('control')
 		# Change Auger State based on Cycle Time
 		if mode in ('Startup', 'Reignite', 'Smoke', 'Hold', 'Prime'):
 			if mode == 'Hold':
@@ -754,26 +770,37 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 					# Set current last toggle time to now
 					auger_toggle_time = now
 					eventLogger.debug('Cycle Event: Auger Off')
+		timer.mark('auger')
 
 		# Grab current probe profiles if they have changed since the last loop.
 		if control['probe_profile_update']:
 			settings = read_settings()
 			control['probe_profile_update'] = False
-			write_control(control, direct_write=True, origin='control')
+			write_control({'probe_profile_update' : False}, direct_write=True, origin='control')
 			# Add new probe profiles to probe complex object
 			probe_complex.update_probe_profiles(settings['probe_settings']['probe_map']['probe_info'])
 
 		# Get probe device info for frontend
 		write_generic_key('probe_device_info', probe_complex.get_device_info())
+		timer.mark('probe_device_info')
 
 		# Get temperatures from all probes
 		sensor_data = probe_complex.read_probes()
+		timer.mark('read_probes')
 		ptemp = list(sensor_data['primary'].values())[0]  # Primary Temperature or the Pit Temperature
 
 		in_data['probe_history'] = sensor_data 
 		in_data['primary_setpoint'] = control['primary_setpoint'] if mode == 'Hold' else 0
 		in_data['notify_targets'] = get_notify_targets(control['notify_data'])
 
+		# Update the ETA estimate of every probe
+		probe_temps = {}
+		for group in sensor_data:
+			if group != 'tr':
+				probe_temps.update(sensor_data[group])
+		eta_estimator.update(now, probe_temps)
+		timer.mark('eta')
+
 		# If Extended Data Mode is Enabled, Populate Extra Data Here
 		if settings['globals']['ext_data']:
 			in_data['ext_data'] = {}
@@ -786,24 +813,24 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 		# Write Tr data to the database if in tuning mode 
 		if control['tuning_mode']:
 			write_tr(in_data['probe_history']['tr'])
+		timer.mark('write_current')
 
 		# Every 20 seconds, update ETA for any pending notifications
-		if (now - eta_toggle_time) > 20:
-			eta_toggle_time = time.time()
-			update_eta = True
-		else:
-			update_eta = False
+		update_eta = scheduler.due('eta')
 		# Check to see if there are any pending notifications (i.e. Timer / Temperature Settings)
-		control = check_notify(settings, control, in_data=in_data, pelletdb=pelletdb, grill_platform=grill_platform, update_eta=update_eta)
+		control = check_notify(settings, control, in_data=in_data, pelletdb=pelletdb, grill_platform=grill_platform, update_eta=update_eta, eta_estimator=eta_estimator)
+		if update_eta:
+			scheduler.done('eta')
 
 		# Publish the cycle ratio to mqtt.  Note if in HOLD mode it was already published.
 		if mode in ('Startup', 'Smoke') and 'CycleRatio' in locals():
 			pid_data = {}
 			pid_data['cycle_ratio'] = round(CycleRatio, 2)
 			check_notify(settings, control, pid_data=pid_data)
+		timer.mark('check_notify')
 
 		# Send Current Status / Temperature Data to Display Device every 0.5 second (Display Refresh)
-		if (now - display_toggle_time) > 0.5:
+		if scheduler.due('display'):
 			status_data['notify_data'] = control['notify_data']  # Get any flagged notifications
 			status_data['timer'] = control['timer']  # Get the timer information
 			status_data['s_plus'] = control['s_plus']
@@ -836,7 +863,8 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 			display_device.display_status(in_data, status_data)
 			# Save Status Data to Redis 
 			write_status(status_data)
-			display_toggle_time = time.time()  # Reset the display_toggle_time to current time
+			scheduler.done('display')
+			timer.mark('display')
 
 		# Safety Controls
 		if mode in ('Startup', 'Reignite'):
@@ -885,7 +913,7 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 					_start_fan(settings, control['duty_cycle'])
 				if control['lid_open_toggle']:
 					control['lid_open_toggle'] = False
-					write_control(control, direct_write=True, origin='control')
+					write_control({'lid_open_toggle' : False}, direct_write=True, origin='control')
 					if LidOpenDetect:
 						LidOpenDetect = False
 					else:
@@ -901,7 +929,7 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 				fan_update_time = now
 				if ptemp > control['primary_setpoint']:
 					control['duty_cycle'] = settings['pwm']['min_duty_cycle']
-					write_control(control, direct_write=True, origin='control')
+					write_control({'duty_cycle' : control['duty_cycle']}, direct_write=True, origin='control')
 				else:
 					# Cycle through profiles, and set duty cycle if setpoint temp is within range
 					for temp_profile in range(0, len(settings['pwm']['temp_range_list'])):
@@ -911,11 +939,11 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 							duty_cycle = max(duty_cycle, settings['pwm']['min_duty_cycle'])
 							duty_cycle = min(duty_cycle, settings['pwm']['max_duty_cycle'])
 							control['duty_cycle'] = duty_cycle
-							write_control(control, direct_write=True, origin='control')
+							write_control({'duty_cycle' : control['duty_cycle']}, direct_write=True, origin='control')
 							break # Break out of the loop
 						if temp_profile == len(settings['pwm']['temp_range_list']) - 1:
 							control['duty_cycle'] = settings['pwm']['max_duty_cycle']
-							write_control(control, direct_write=True, origin='control')
+							write_control({'duty_cycle' : control['duty_cycle']}, direct_write=True, origin='control')
 
 			# This added section allows for additional pid control by controlling the fan.  
 			# Implemented for AC fans and DC fans not using PWM Control.
@@ -1000,16 +1028,25 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 			elif (settings['platform']['dc_fan'] and not control['pwm_control'] and current_output_status['pwm'] !=
 				  	settings['pwm']['max_duty_cycle'] and manual_override['fan'] < now):
 				control['duty_cycle'] = settings['pwm']['max_duty_cycle']
-				write_control(control, direct_write=True, origin='control')
+				write_control({'duty_cycle' : control['duty_cycle']}, direct_write=True, origin='control')
 				grill_platform.set_duty_cycle(control['duty_cycle'])
 				eventLogger.debug('Temp Fan Control: Set to OFF, Fan Returned to Max Duty Cycle')
 
-		# Write History & Issue Heartbeat after 3 seconds has passed
-		if (now - temp_toggle_time) > 3:
-			temp_toggle_time = time.time()
+		# Write History & Issue Heartbeat every 3 seconds
+		timer.mark('control')
+		if scheduler.due('history'):
 			ext_data = True if settings['globals']['ext_data'] else False  # If passing in extended data, set to True
 			write_history(in_data, ext_data=ext_data)
 			monitor.heartbeat()  # Issue a heartbeat for the process monitor
+			write_generic_key('control_scheduler', scheduler.get_stats())
+			write_generic_key('control_timing', timer.get_stats())
+			# Publish the ETA estimate of every probe (the primary probe uses the set point as target)
+			eta_targets = dict(in_data['notify_targets'])
+			if in_data['primary_setpoint']:
+				eta_targets.setdefault(list(sensor_data['primary'].keys())[0], in_data['primary_setpoint'])
+			write_generic_key('probe_eta', eta_estimator.estimates(eta_targets))
+			scheduler.done('history')
+			timer.mark('history')
 
 		# Check if startup time has elapsed since startup/reignite mode started or if exit temperature has been achieved 
 		if mode in ('Startup', 'Reignite'):
@@ -1071,7 +1108,14 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 					write_control(control, direct_write=True, origin='control')
 				# Continue until 'pause' variable is cleared 
 
-		time.sleep(0.05)
+		timer.mark('control')
+		timer.end()
+
+		# Sleep until the next tick, waking up early for a pending auger toggle
+		if mode in ('Startup', 'Reignite', 'Smoke', 'Hold', 'Prime') and manual_override['auger'] == 0:
+			scheduler.sleep(auger_toggle_time + CycleTime * CycleRatio, auger_toggle_time + CycleTime * (1 - CycleRatio))
+		else:
+			scheduler.sleep()
 
 	# *********
 	# END Mode Loop
@@ -1113,8 +1157,7 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 	return ()
 
 def _next_mode(next_mode, setpoint=0):			
-	execute_control_writes()
-	control = read_control()
+	control = merge_control_writes()
 	# If no other request, then transition to next mode, otherwise exit
 	if not control['updated']:
 		control['mode'] = next_mode
@@ -1123,7 +1166,7 @@ def _next_mode(next_mode, setpoint=0):
 		write_control(control, direct_write=True, origin='control')
 	return control 
 
-def _recipe_mode(grill_platform, probe_complex, display_device, dist_device, start_step=0):
+def _recipe_mode(grill_platform, probe_complex, display_device, dist_device, eta_estimator, scheduler, timer, start_step=0):
 	"""
 	Recipe Mode Control
 
@@ -1131,6 +1174,9 @@ def _recipe_mode(grill_platform, probe_complex, display_device, dist_device, sta
 	:param probe_complex: ADC Device
 	:param display_device: Display Device
 	:param dist_device: Distance Device
+	:param eta_estimator: ETA Estimator
+	:param scheduler: Tick Scheduler
+	:param timer: Stage Timer
 	"""
 	settings = read_settings()
 	eventLogger.info('Recipe Mode started.')
@@ -1179,16 +1225,15 @@ def _recipe_mode(grill_platform, probe_complex, display_device, dist_device, sta
 		control['updated'] = False  # Clear Updated Flag if Set
 		write_control(control, direct_write=True, origin='control')
 		# 4b. Start the recipe step work cycle
-		_work_cycle(recipe['steps'][step_num]['mode'], grill_platform, probe_complex, display_device, dist_device)
+		_work_cycle(recipe['steps'][step_num]['mode'], grill_platform, probe_complex, display_device, dist_device, eta_estimator, scheduler, timer)
 		
 		# 4c. If reignite is required, run a reignite cycle and retry current step
-		execute_control_writes()
-		control = read_control()
+		control = merge_control_writes()
 		if control['mode'] == 'Reignite' and control['updated']:
 			control['updated'] = False
 			control['mode'] = 'Recipe'
 			write_control(control, direct_write=True, origin='control')
-			_work_cycle('Reignite', grill_platform, probe_complex, display_device, dist_device)
+			_work_cycle('Reignite', grill_platform, probe_complex, display_device, dist_device, eta_estimator, scheduler, timer)
 			control = read_control()
 			if control['updated'] and control['mode'] != 'Recipe':
 				# If another mode was requested (or an error occurred) then exit recipe mode
@@ -1280,8 +1325,7 @@ while True:
 	write_status(status)
 
 	# Check control for changes 
-	execute_control_writes()
-	control = read_control()
+	control = merge_control_writes()
 
 	# Check for system commands
 	_process_system_commands(grill_platform)
@@ -1418,7 +1462,7 @@ while True:
 			if not settings['platform']['standalone'] and not grill_platform.get_input_status():
 				eventLogger.warning('PiFire is set to OFF. This doesn\'t prevent startup, but this means the switch won\'t behave as normal.')
 			# Call Work Cycle for Startup Mode
-			_work_cycle('Prime', grill_platform, probe_complex, display_device, dist_device)
+			_work_cycle('Prime', grill_platform, probe_complex, display_device, dist_device, eta_estimator, scheduler, timer)
 			# Select Next Mode
 			settings = read_settings()
 			_next_mode(control['next_mode'], setpoint=settings['startup']['start_to_mode']['primary_setpoint'])			
@@ -1437,7 +1481,7 @@ while True:
 				control['mode'] = 'Prime'
 				write_control(control, direct_write=True, origin='control')
 				# Call Work Cycle for Prime Mode
-				_work_cycle('Prime', grill_platform, probe_complex, display_device, dist_device)
+				_work_cycle('Prime', grill_platform, probe_complex, display_device, dist_device, eta_estimator, scheduler, timer)
 				control = read_control()  # Refresh control in case any changes were made during the cycle
 				if control['mode'] in ['Prime', 'Startup']:
 					control['updated'] = False 
@@ -1448,26 +1492,26 @@ while True:
 				control['next_mode'] = settings['startup']['start_to_mode']['after_startup_mode']
 				write_control(control, direct_write=True, origin='control')
 				# Call Work Cycle for Startup Mode
-				_work_cycle('Startup', grill_platform, probe_complex, display_device, dist_device)
+				_work_cycle('Startup', grill_platform, probe_complex, display_device, dist_device, eta_estimator, scheduler, timer)
 				# Select Next Mode
 				settings = read_settings()
 				_next_mode(control['next_mode'], setpoint=settings['startup']['start_to_mode']['primary_setpoint'])
 
 		# Smoke (smoke cycle)
 		elif control['mode'] == 'Smoke':
-			_work_cycle('Smoke', grill_platform, probe_complex, display_device, dist_device)
+			_work_cycle('Smoke', grill_platform, probe_complex, display_device, dist_device, eta_estimator, scheduler, timer)
 			_next_mode(control['next_mode'])			
 
 		# Hold (hold at setpoint)
 		elif control['mode'] == 'Hold':
-			_work_cycle('Hold', grill_platform, probe_complex, display_device, dist_device)
+			_work_cycle('Hold', grill_platform, probe_complex, display_device, dist_device, eta_estimator, scheduler, timer)
 			_next_mode(control['next_mode'])			
 
 		# Shutdown (shutdown sequence)
 		elif control['mode'] == 'Shutdown':
 			control['next_mode'] = 'Stop'
 			write_control(control, direct_write=True, origin='control')
-			_work_cycle('Shutdown', grill_platform, probe_complex, display_device, dist_device)
+			_work_cycle('Shutdown', grill_platform, probe_complex, display_device, dist_device, eta_estimator, scheduler, timer)
 			_next_mode(control['next_mode'])			
 			if settings['shutdown']['auto_power_off']:
 				eventLogger.info('Shutdown mode ended powering off grill')
@@ -1477,15 +1521,15 @@ while True:
 		elif control['mode'] == 'Monitor':
 			control['status'] = 'monitor'  # Set status to monitor
 			write_control(control, direct_write=True, origin='control')
-			_work_cycle('Monitor', grill_platform, probe_complex, display_device, dist_device)
+			_work_cycle('Monitor', grill_platform, probe_complex, display_device, dist_device, eta_estimator, scheduler, timer)
 
 		# Manual Mode
 		elif control['mode'] == 'Manual':
-			_work_cycle('Manual', grill_platform, probe_complex, display_device, dist_device)
+			_work_cycle('Manual', grill_platform, probe_complex, display_device, dist_device, eta_estimator, scheduler, timer)
 		
 		# Recipe Mode
 		elif control['mode'] == 'Recipe':
-			_recipe_mode(grill_platform, probe_complex, display_device, dist_device, start_step=control['recipe']['start_step'])
+			_recipe_mode(grill_platform, probe_complex, display_device, dist_device, eta_estimator, scheduler, timer, start_step=control['recipe']['start_step'])
 		
 		# Reignite (reignite sequence)
 		elif control['mode'] == 'Reignite':
@@ -1495,7 +1539,7 @@ while True:
 			control['next_mode'] = control['safety']['reignitelaststate']
 			setpoint = control['primary_setpoint']
 			write_control(control, direct_write=True, origin='control')
-			_work_cycle('Reignite', grill_platform, probe_complex, display_device, dist_device)
+			_work_cycle('Reignite', grill_platform, probe_complex, display_device, dist_device, eta_estimator, scheduler, timer)
 			_next_mode(control['next_mode'], setpoint=setpoint)
 	
 	if settings['notify_services'].get('mqtt') != None and settings['notify_services']['mqtt']['enabled']:
@@ -16,13 +16,14 @@ PiFire Flexible Display Interface Library
  Imported Libraries
 '''
 import time
+import copy
 import logging
 import socket
 import os
 import requests
 from display.flexobject import *
 from PIL import Image
-from common import read_control, write_control, is_real_hardware, read_generic_json, read_settings, write_settings, read_status, read_current
+from common import read_control, write_control, is_real_hardware, read_generic_json, read_settings, write_settings, read_status, read_current, ChangeListener
 
 '''
 ==================================================================================
@@ -42,6 +43,8 @@ class DisplayBase:
         self.last_in_data = {}
         self.status_data = None
         self.last_status_data = {}
+        # Notifies when current / status are written, so they are only re-read when they change
+        self.change_listener = ChangeListener(topics=['current', 'status'])
 
         self.input_enabled = False
         self.input_origin = None
@@ -561,9 +564,9 @@ class DisplayBase:
 
                 self.display_object_list[self.dash_map['hopper']].update_object_data(object_data)
 
-            ''' After all the updates, update the last states/data '''
-            self.last_in_data = self.in_data.copy() 
-            self.last_status_data = self.status_data.copy()
+            ''' After all the updates, update the last states/data (deep copies, since in_data / status_data are only re-read when they change) '''
+            self.last_in_data = copy.deepcopy(self.in_data)
+            self.last_status_data = copy.deepcopy(self.status_data)
 
     def _draw_objects(self):
         for object in self.display_object_list: 
@@ -589,13 +592,19 @@ class DisplayBase:
         """
         - Updates the current data for the display loop, if in a work mode
         """
+        changes = self.change_listener.get_changes()
+
         if self.in_data is None:
             self.last_in_data = {}
-        self.in_data = read_current()
+            changes.add('current')
+        if 'current' in changes:
+            self.in_data = read_current()
 
         if self.status_data is None:
             self.last_status_data = {}
-        self.status_data = read_status()
+            changes.add('status')
+        if 'status' in changes:
+            self.status_data = read_status()
 
         self.units = self.status_data['units']
 
@@ -16,9 +16,18 @@ import os
 import json
 import tempfile
 import shutil
+import warnings
+import fcntl
+import threading
+from contextlib import contextmanager
 
 HISTORY_FOLDER = './history/'  # Path to historical cook files
 RECIPE_FOLDER = './recipes/'  # Path to recipe files
+COMPACT_WASTE_RATIO = 0.25  # Compact a file when superseded members take up more than this fraction of it
+COMPACT_MAX_SUPERSEDED = 50  # ... or when there are more than this many superseded members
+LOCK_FOLDER = '/tmp/pifire/locks'  # Lock files for archives written by more than one process
+
+_held_locks = threading.local()  # Lock files held by the current thread (count per file)
 
 '''
 Functions
@@ -39,35 +48,7 @@ def read_json_file_data(filename, jsonfile, unpackassets=True):
 			if jsonfile == 'assets' and unpackassets:
 				json_string = archive.read('metadata.json')
 				metadata = json.loads(json_string)
-				parent_id = metadata['id']  # Get parent id for this file and store all images in parent_id folder
-
-				for asset in range(0, len(dictionary)):
-					#  Get asset file information
-					mediafile = dictionary[asset]['filename']
-					id = dictionary[asset]['id']
-					filetype = dictionary[asset]['type']
-					#  Read the file(s) into memory
-					data = archive.read(f'assets/{mediafile}')  # Read bytes into variable
-					thumb = archive.read(f'assets/thumbs/{mediafile}')  # Read bytes into variable
-					if not os.path.exists(f'/tmp/pifire'):
-						os.mkdir(f'/tmp/pifire')
-					if not os.path.exists(f'/tmp/pifire/{parent_id}'):
-						os.mkdir(f'/tmp/pifire/{parent_id}')
-					if not os.path.exists(f'/tmp/pifire/{parent_id}/thumbs'):
-						os.mkdir(f'/tmp/pifire/{parent_id}/thumbs')
-					#  Write fullsize image to disk
-					destination = open(f'/tmp/pifire/{parent_id}/{id}.{filetype}', "wb")  # Write bytes to proper destination
-					destination.write(data)
-					destination.close()
-					#  Write thumbnail image to disk
-					destination = open(f'/tmp/pifire/{parent_id}/thumbs/{id}.{filetype}', "wb")  # Write bytes to proper destination
-					destination.write(thumb)
-					destination.close()
-
-					if not os.path.exists('./static/img/tmp'):
-						os.mkdir(f'./static/img/tmp')
-					if not os.path.exists(f'./static/img/tmp/{parent_id}'):
-						os.symlink(f'/tmp/pifire/{parent_id}', f'./static/img/tmp/{parent_id}')
+				unpack_assets(archive, dictionary, metadata['id'])
 
 	except zipfile.BadZipFile as error:
 		status = f'Error: {error}'
@@ -84,33 +65,88 @@ def read_json_file_data(filename, jsonfile, unpackassets=True):
 
 	return(dictionary, status)
 
+def unpack_assets(archive, assets, parent_id):
+	'''
+	Unpack the assets (and their thumbnails) from an open archive into the temporary folder 
+	for parent_id (the id from the file metadata), and link it into ./static/img/tmp/
+	'''
+	for asset in range(0, len(assets)):
+		#  Get asset file information
+		mediafile = assets[asset]['filename']
+		id = assets[asset]['id']
+		filetype = assets[asset]['type']
+		#  Read the file(s) into memory
+		data = archive.read(f'assets/{mediafile}')  # Read bytes into variable
+		thumb = archive.read(f'assets/thumbs/{mediafile}')  # Read bytes into variable
+		if not os.path.exists(f'/tmp/pifire'):
+			os.mkdir(f'/tmp/pifire')
+		if not os.path.exists(f'/tmp/pifire/{parent_id}'):
+			os.mkdir(f'/tmp/pifire/{parent_id}')
+		if not os.path.exists(f'/tmp/pifire/{parent_id}/thumbs'):
+			os.mkdir(f'/tmp/pifire/{parent_id}/thumbs')
+		#  Write fullsize image to disk
+		destination = open(f'/tmp/pifire/{parent_id}/{id}.{filetype}', "wb")  # Write bytes to proper destination
+		destination.write(data)
+		destination.close()
+		#  Write thumbnail image to disk
+		destination = open(f'/tmp/pifire/{parent_id}/thumbs/{id}.{filetype}', "wb")  # Write bytes to proper destination
+		destination.write(thumb)
+		destination.close()
+
+		if not os.path.exists('./static/img/tmp'):
+			os.mkdir(f'./static/img/tmp')
+		if not os.path.exists(f'./static/img/tmp/{parent_id}'):
+			os.symlink(f'/tmp/pifire/{parent_id}', f'./static/img/tmp/{parent_id}')
+
+@contextmanager
+def file_lock(filename):
+	'''
+	Hold an exclusive lock on the cook / recipe file while appending to or rewriting it, so that the 
+	webapp and the media worker never write the same archive at the same time.  The lock is re-entrant 
+	within a thread, so a read-modify-write can hold it around update_json_file_data().  
+	'''
+	lockpath = os.path.join(LOCK_FOLDER, os.path.basename(filename) + '.lock')
+	held = _held_locks.__dict__.setdefault('files', {})
+	if held.get(lockpath):
+		held[lockpath] += 1
+		try:
+			yield
+		finally:
+			held[lockpath] -= 1
+		return
+
+	os.makedirs(LOCK_FOLDER, exist_ok=True)
+	with open(lockpath, 'w') as lockfile:
+		fcntl.flock(lockfile, fcntl.LOCK_EX)
+		held[lockpath] = 1
+		try:
+			yield
+		finally:
+			held[lockpath] = 0
+			fcntl.flock(lockfile, fcntl.LOCK_UN)
+
 def update_json_file_data(filedata, filename, jsonfile):
 	'''
-	Write an update to the recipe file
+	Write an update to a JSON member of the cook / recipe file
+
+	The new version of the member is appended to the end of the archive.  The zip central directory 
+	(which is rewritten after the appended member) acts as the manifest, and its last entry for a name 
+	is the one that is read, so the other members (i.e. large image assets) are never copied.  The 
+	superseded versions are removed by compact_file() once they take up enough of the archive.  
 	'''
 	status = 'OK'
 	jsonfilename = jsonfile + '.json'
 
-	# Borrowed from StackOverflow https://stackoverflow.com/questions/25738523/how-to-update-one-file-inside-zip-file
-	# Submitted by StackOverflow user Sebdelsol
-
-	# Start by creating a temporary file without the jsonfile that is being edited
-	tmpfd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename))
-	os.close(tmpfd)
 	try:
-		# Create a temp copy of the archive without filename            
-		with zipfile.ZipFile(filename, 'r') as zin:
-			with zipfile.ZipFile(tmpname, 'w') as zout:
-				zout.comment = zin.comment # Preserve the zip metadata comment
-				for item in zin.infolist():
-					if item.filename != jsonfilename:
-						zout.writestr(item, zin.read(item.filename))
-		# Replace original with the temp archive
-		os.remove(filename)
-		os.rename(tmpname, filename)
-		# Now add updated JSON file with its new data
-		with zipfile.ZipFile(filename, mode='a', compression=zipfile.ZIP_DEFLATED) as zf:
-			zf.writestr(jsonfilename, json.dumps(filedata, indent=2, sort_keys=True))
+		with file_lock(filename), warnings.catch_warnings():
+			warnings.simplefilter('ignore', UserWarning)  # Duplicate name warning for the new version of the member
+			with zipfile.ZipFile(filename, mode='a', compression=zipfile.ZIP_DEFLATED) as zf:
+				zf.writestr(jsonfilename, json.dumps(filedata, indent=2, sort_keys=True))
+				superseded = _superseded_members(zf)
+
+		superseded_size = sum(item.compress_size for item in superseded)
+		if len(superseded) > COMPACT_MAX_SUPERSEDED or superseded_size > os.path.getsize(filename) * COMPACT_WASTE_RATIO:
+			status = compact_file(filename)
 
 	except zipfile.BadZipFile as error:
 		status = f'Error: {error}'
@@ -119,6 +155,68 @@ def update_json_file_data(filedata, filename, jsonfile):
 	
 	return(status)
 
+def _superseded_members(archive):
+	'''
+	List the members of an open archive that have been replaced by a newer version with the same name
+	'''
+	return [item for item in archive.infolist() if archive.NameToInfo.get(item.filename) is not item]
+
+def compact_file(filename):
+	'''
+	Rewrite the archive without the superseded versions of its members (see update_json_file_data)
+	'''
+	status = 'OK'
+
+	try:
+		with file_lock(filename):
+			with zipfile.ZipFile(filename, 'r') as zin:
+				if not _superseded_members(zin):
+					return(status)
+				# Start by creating a temporary file in the same folder, so it can be renamed over the original
+				tmpfd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename))
+				os.close(tmpfd)
+				with zipfile.ZipFile(tmpname, 'w') as zout:
+					zout.comment = zin.comment # Preserve the zip metadata comment
+					for item in zin.infolist():
+						if zin.NameToInfo[item.filename] is item:
+							zout.writestr(item, zin.read(item))
+			os.replace(tmpname, filename)
+
+	except zipfile.BadZipFile as error:
+		status = f'Error: {error}'
+	except:
+		status = 'Error: Unspecified'
+
+	return(status)
+
+def read_index_file(index_path):
+	'''
+	Read a JSON index file (i.e. the cook file index or the recipe catalog), returns an empty index if missing or invalid
+	'''
+	try:
+		with open(index_path, 'r') as index_file:
+			return json.load(index_file)
+	except:
+		return {}
+
+def write_index_file(index, index_path):
+	'''
+	Write the index to a temporary file and rename it over the index, so readers never see a partial index.  
+	The temporary file has a unique name, so concurrent writers (i.e. control and the webapp) don't clobber 
+	each other's file.  Hold file_lock(index_path) around a read-modify-write of the index.  
+	'''
+	try:
+		tmpfd, temp_path = tempfile.mkstemp(dir=os.path.dirname(index_path) or '.', suffix='.tmp')
+		try:
+			with os.fdopen(tmpfd, 'w') as index_file:
+				json.dump(index, index_file, sort_keys=True)
+			os.replace(temp_path, index_path)
+		except:
+			os.remove(temp_path)
+			raise
+	except:
+		pass
+
 def fixup_assets(filename, jsondata):
 	jsondata['assets'], status = read_json_file_data(filename, 'assets', unpackassets=False)
 
@@ -180,79 +278,84 @@ def fixup_assets(filename, jsondata):
 	return(jsondata, status)
 
 def remove_assets(filename, assetlist, filetype='cookfile'):
-	status = 'OK'
+	# Hold the lock for the whole read-modify-write, so concurrent edits (i.e. a media worker adding an
+	# asset) are not lost
+	with file_lock(filename):
+		status = 'OK'
 
-	if filetype == 'recipefile':
-		recipe, status = read_json_file_data(filename, 'recipe')
+		if filetype == 'recipefile':
+			recipe, status = read_json_file_data(filename, 'recipe')
 
-	metadata, status = read_json_file_data(filename, 'metadata')
-	comments, status = read_json_file_data(filename, 'comments')
-	assets, status = read_json_file_data(filename, 'assets', unpackassets=False)
+		metadata, status = read_json_file_data(filename, 'metadata')
+		comments, status = read_json_file_data(filename, 'comments')
+		assets, status = read_json_file_data(filename, 'assets', unpackassets=False)
 
-	# Check Thumbnail against assetlist
-	if metadata['thumbnail'] in assetlist:
-		metadata['thumbnail'] = ''
-		if filetype == 'recipefile':
-			metadata['image'] = ''
-		update_json_file_data(metadata, filename, 'metadata')
+		# Check Thumbnail against assetlist
+		if metadata['thumbnail'] in assetlist:
+			metadata['thumbnail'] = ''
+			if filetype == 'recipefile':
+				metadata['image'] = ''
+			update_json_file_data(metadata, filename, 'metadata')
 
-	# Check comment.json assets against assetlist
-	modified = False
-	for index, comment in enumerate(comments):
-		for asset in comment['assets']:
-			if asset in assetlist:
-				comments[index]['assets'].remove(asset)
-				modified = True 
-	if modified:
-		update_json_file_data(comments, filename, 'comments')
-
-	# Check recipe.json assets against assetlist
-	if filetype == 'recipefile':
+		# Check comment.json assets against assetlist
 		modified = False
-		for index, ingredient in enumerate(recipe['ingredients']):
-			for asset in ingredient['assets']:
+		for index, comment in enumerate(comments):
+			for asset in comment['assets']:
 				if asset in assetlist:
-					recipe['ingredients'][index]['assets'].remove(asset)
-					modified = True 
-		for index, instruction in enumerate(recipe['instructions']):
-			for asset in instruction['assets']:
-				if asset in assetlist:
-					recipe['instructions'][index]['assets'].remove(asset)
+					comments[index]['assets'].remove(asset)
 					modified = True 
 		if modified:
-			update_json_file_data(recipe, filename, 'recipe')
-
-	# Check asset.json against assetlist 
-	modified = False 
-	tempassets = assets.copy()
-	for asset in tempassets:
-		if asset['filename'] in assetlist:
-			assets.remove(asset)
-			modified = True
-	if modified:
-		update_json_file_data(assets, filename, 'assets')
-
-	# Traverse list of asset files from the compressed file, remove asset and thumb
-	try: 
-		tmpdir = f'/tmp/pifire/{metadata["id"]}'
-		if not os.path.exists(tmpdir):
-			os.mkdir(tmpdir)
-		with zipfile.ZipFile(filename, mode="r") as archive:
-			new_archive = zipfile.ZipFile (f'{tmpdir}/new.pifire', 'w', zipfile.ZIP_DEFLATED)
-			for item in archive.infolist():
-				remove = False 
-				for asset in assetlist:
-					if asset in item.filename: 
-						remove = True
-						break 
-				if not remove:
-					buffer = archive.read(item.filename)
-					new_archive.writestr(item, buffer)
-			new_archive.close()
-
-		os.remove(filename)
-		shutil.move(f'{tmpdir}/new.pifire', filename)
-	except:
-		status = "Error:  Error removing assets from file."
+			update_json_file_data(comments, filename, 'comments')
+
+		# Check recipe.json assets against assetlist
+		if filetype == 'recipefile':
+			modified = False
+			for index, ingredient in enumerate(recipe['ingredients']):
+				for asset in ingredient['assets']:
+					if asset in assetlist:
+						recipe['ingredients'][index]['assets'].remove(asset)
+						modified = True 
+			for index, instruction in enumerate(recipe['instructions']):
+				for asset in instruction['assets']:
+					if asset in assetlist:
+						recipe['instructions'][index]['assets'].remove(asset)
+						modified = True 
+			if modified:
+				update_json_file_data(recipe, filename, 'recipe')
+
+		# Check asset.json against assetlist 
+		modified = False 
+		tempassets = assets.copy()
+		for asset in tempassets:
+			if asset['filename'] in assetlist:
+				assets.remove(asset)
+				modified = True
+		if modified:
+			update_json_file_data(assets, filename, 'assets')
+
+		# Traverse list of asset files from the compressed file, remove asset and thumb
+		try: 
+			tmpdir = f'/tmp/pifire/{metadata["id"]}'
+			if not os.path.exists(tmpdir):
+				os.mkdir(tmpdir)
+			with zipfile.ZipFile(filename, mode="r") as archive:
+				new_archive = zipfile.ZipFile (f'{tmpdir}/new.pifire', 'w', zipfile.ZIP_DEFLATED)
+				for item in archive.infolist():
+					if archive.NameToInfo[item.filename] is not item:
+						continue  # Skip superseded versions of updated members
+					remove = False 
+					for asset in assetlist:
+						if asset in item.filename: 
+							remove = True
+							break 
+					if not remove:
+						buffer = archive.read(item)
+						new_archive.writestr(item, buffer)
+				new_archive.close()
+
+			os.remove(filename)
+			shutil.move(f'{tmpdir}/new.pifire', filename)
+		except:
+			status = "Error:  Error removing assets from file."
 
 	return status
@@ -15,17 +15,209 @@ import datetime
 import os
 import json
 import zipfile 
-import pathlib
+import threading
+from collections import OrderedDict
 
-from common import read_settings, read_history, generate_uuid, read_metrics, write_metrics, process_metrics, semantic_ver_to_list, epoch_to_time, unpack_history, default_probe_config, create_logger
-from file_mgmt.common import read_json_file_data, update_json_file_data
+from common import read_settings, read_history, read_history_columns, read_history_column, read_history_labels, iter_history, generate_uuid, read_metrics, write_metrics, process_metrics, semantic_ver_to_list, epoch_to_time, default_probe_config, create_logger
+from file_mgmt.common import read_json_file_data, update_json_file_data, unpack_assets, read_index_file, write_index_file, file_lock
+from common.downsample import downsample_indices
 
 HISTORY_FOLDER = './history/'  # Path to historical cook files
+COOKFILE_MEMBERS = ['metadata', 'graph_data', 'raw_data', 'graph_labels', 'events', 'comments', 'assets']
+COOKFILE_LAZY_MEMBERS = ['raw_data']  # Members read_cookfile() doesn't read until they are accessed
+COOKFILE_CACHE_SIZE = 8  # Number of open cook files kept in the LRU cache
+COOKFILE_INDEX = 'cookfile_index.json'  # Metadata index of the cook files (stored in the history folder)
+
+_cookfile_cache = OrderedDict()  # (path, mtime, size) : CookFile
+_cookfile_cache_lock = threading.Lock()
+_cookfile_index_lock = threading.Lock()
+
+'''
+Classes
+=======
+'''
+class CookFile():
+	'''
+	A cook file archive that is opened once (parsing the zip central directory a single time).  
+	Each JSON member is only inflated the first time it is read, and the inflated JSON is kept 
+	so later reads only need to decode it.  Every read returns a new copy, so callers can 
+	modify the data freely.  
+
+	Use open_cookfile() to get a (cached) instance.  
+	'''
+	def __init__(self, filename):
+		self.filename = filename
+		self.archive = zipfile.ZipFile(filename, mode='r')
+		self.members = {}  # member : inflated JSON bytes
+		self.assets_unpacked = False
+		self.lock = threading.Lock()
+
+	def _open(self):
+		# Re-open the archive if it was closed (evicted from the cache while still in use)
+		if self.archive is None:
+			self.archive = zipfile.ZipFile(self.filename, mode='r')
+		return self.archive
+
+	def close(self):
+		'''
+		Close the archive and drop the inflated members (called when evicted from the cache)
+		'''
+		with self.lock:
+			if self.archive is not None:
+				self.archive.close()
+				self.archive = None
+			self.members = {}
+
+	def has_member(self, member):
+		with self.lock:
+			return f'{member}.json' in self._open().NameToInfo
+
+	def _read_member(self, member):
+		with self.lock:
+			if member not in self.members:
+				self.members[member] = self._open().read(f'{member}.json')
+			return self.members[member]
+
+	def read(self, member, unpackassets=True):
+		'''
+		Read a JSON member (without the .json extension).  Returns (data, status) like read_json_file_data().
+		'''
+		status = 'OK'
+		try:
+			data = json.loads(self._read_member(member))
+			# If this is the assets file, load the assets into the temporary folder (once)
+			if member == 'assets' and unpackassets and not self.assets_unpacked:
+				metadata = json.loads(self._read_member('metadata'))
+				with self.lock:
+					unpack_assets(self._open(), data, metadata['id'])
+				self.assets_unpacked = True
+		except zipfile.BadZipFile as error:
+			status = f'Error: {error}'
+			data = {}
+		except json.decoder.JSONDecodeError:
+			status = 'Error: JSON Decoding Error.'
+			data = {}
+		except:
+			if member == 'assets':
+				status = 'Error: Error opening assets.'
+			else:
+				status = 'Error: Unspecified'
+			data = {}
+
+		return(data, status)
+
+class CookFileData(dict):
+	'''
+	Cook file structure returned by read_cookfile().  The lazy members (raw_data) are only read from 
+	the CookFile when they are first accessed (i.e. viewing a cook file never inflates raw_data).  
+	Iterating, len(), 'in', items() / values() and json.dumps() see all of the members (the lazy 
+	members are read first).  
+	'''
+	def __init__(self, cookfile):
+		super().__init__()
+		self.cookfile = cookfile
+
+	def __missing__(self, member):
+		if member not in COOKFILE_MEMBERS:
+			raise KeyError(member)
+		data, status = self.cookfile.read(member)
+		if status != 'OK':
+			eventLogger = create_logger('events', filename='./logs/events.log', messageformat='%(asctime)s [%(levelname)s] %(message)s')
+			eventLogger.error(f'Failed to read {member} from {self.cookfile.filename}: {status}')
+		self[member] = data
+		return data
+
+	def _load_all(self):
+		for member in COOKFILE_MEMBERS:
+			if not super().__contains__(member):
+				self[member]
+
+	def get(self, member, default=None):
+		try:
+			return self[member]
+		except KeyError:
+			return default
+
+	def __contains__(self, member):
+		return super().__contains__(member) or member in COOKFILE_MEMBERS
+
+	def __iter__(self):
+		self._load_all()
+		return super().__iter__()
+
+	def __len__(self):
+		self._load_all()
+		return super().__len__()
+
+	def keys(self):
+		self._load_all()
+		return super().keys()
+
+	def values(self):
+		self._load_all()
+		return super().values()
+
+	def items(self):
+		self._load_all()
+		return super().items()
+
+	def copy(self):
+		self._load_all()
+		return dict(super().items())
 
 '''
 Functions
 =========
 '''
+def open_cookfile(filename):
+	'''
+	Get a CookFile for filename.  Open cook files are kept in a small LRU cache keyed by the 
+	path and modification time, so a file that was changed (i.e. by update_json_file_data) is re-opened.  
+	'''
+	stat = os.stat(filename)
+	path = os.path.abspath(filename)
+	key = (path, stat.st_mtime_ns, stat.st_size)
+
+	with _cookfile_cache_lock:
+		cookfile = _cookfile_cache.get(key)
+		if cookfile is not None:
+			_cookfile_cache.move_to_end(key)
+			return cookfile
+
+	cookfile = CookFile(filename)
+
+	with _cookfile_cache_lock:
+		evicted = []
+		if key in _cookfile_cache:
+			# Opened by another thread in the meantime
+			evicted.append(cookfile)
+			cookfile = _cookfile_cache[key]
+			_cookfile_cache.move_to_end(key)
+		else:
+			# Drop older versions of this file
+			evicted += [_cookfile_cache.pop(cached_key) for cached_key in [cached_key for cached_key in _cookfile_cache if cached_key[0] == path]]
+			_cookfile_cache[key] = cookfile
+			while len(_cookfile_cache) > COOKFILE_CACHE_SIZE:
+				evicted.append(_cookfile_cache.popitem(last=False)[1])
+
+	# Close the evicted archives (outside the cache lock, an instance still in use re-opens on its next read)
+	for evicted_cookfile in evicted:
+		evicted_cookfile.close()
+
+	return cookfile
+
+def read_cookfile_member(filename, member, unpackassets=True):
+	'''
+	Read a single JSON member of a cook file through the cook file cache.  Returns (data, status).
+	'''
+	try:
+		cookfile = open_cookfile(filename)
+	except zipfile.BadZipFile as error:
+		return({}, f'Error: {error}')
+	except:
+		return({}, 'Error: Unspecified')
+	return cookfile.read(member, unpackassets=unpackassets)
+
 def _default_cookfilestruct():
 	settings = read_settings()
 
@@ -61,6 +253,10 @@ def create_cookfile():
 	from startup to stop mode, and saves this to a Cook File stored
 	at ./history/
 
+	The graph and raw data are streamed from the history straight into the 
+	zip archive (one column / chunk at a time), so the whole history is never 
+	held in memory and no temporary folder is needed.  
+
 	The metrics and cook data are purged from memory, after stop mode is initiated.  
 	'''
 	#global cmdsts
@@ -70,40 +266,25 @@ def create_cookfile():
 
 	settings = read_settings()
 
-	cook_file_struct = {}
-
 	now = datetime.datetime.now()
 	nowstring = now.strftime('%Y-%m-%d--%H%M')
 	title = nowstring + '-CookFile'
 
-	chart_data = prepare_chartdata(settings['history_page']['probe_config'], num_items=0, reduce=False, data_points=0)
-	raw_data = read_history()
-
-	if len(chart_data['time_labels']):
-		starttime = chart_data['time_labels'][0]
+	time_labels = read_history_column('T')
 
-		endtime = chart_data['time_labels'][-1]
+	if len(time_labels):
+		chart_data, probe_mapper, graph_labels = _prepare_chart_objects(settings['history_page']['probe_config'])
 
 		cook_file_struct = _default_cookfilestruct()
 
 		cook_file_struct['metadata']['title'] = title
-		cook_file_struct['metadata']['starttime'] = starttime
-		cook_file_struct['metadata']['endtime'] = endtime
+		cook_file_struct['metadata']['starttime'] = time_labels[0]
+		cook_file_struct['metadata']['endtime'] = time_labels[-1]
 
-		cook_file_struct['graph_data'] = {
-			'time_labels' : chart_data['time_labels'], 
-			'chart_data' : chart_data['chart_data'], 
-			'probe_mapper' : chart_data['probe_mapper']
-		} 
-
-		cook_file_struct['graph_labels'] = chart_data['graph_labels']
-
-		cook_file_struct['raw_data'] = raw_data 
+		cook_file_struct['graph_labels'] = graph_labels
 
 		cook_file_struct['events'] = process_metrics(read_metrics(all=True), augerrate=settings['globals']['augerrate'])
 
-		# 1. Create all JSON data files
-		files_list = ['metadata', 'graph_data', 'raw_data', 'graph_labels', 'events', 'comments', 'assets']
 		if not os.path.exists(HISTORY_FOLDER):
 			os.mkdir(HISTORY_FOLDER)
 		cook_file_path = f'{HISTORY_FOLDER}{title}'
@@ -114,57 +295,204 @@ def create_cookfile():
 			cook_file_duplicate += 1
 			eventLogger.debug(f'{cook_file_name} exists, attempting to use {cook_file_path}-{cook_file_duplicate}.pifire')
 			cook_file_name = f'{cook_file_path}-{cook_file_duplicate}.pifire'
-			
-		os.mkdir(cook_file_path)  # Make temporary folder for all files
-		for item in files_list:
-			json_data_string = json.dumps(cook_file_struct[item], indent=2, sort_keys=True)
-			filename = f'{cook_file_path}/{item}.json'
-			with open(filename, 'w+') as cook_file:
-				cook_file.write(json_data_string)
-		
-		# 2. Create empty data folder(s) & add default data 
-		os.mkdir(f'{cook_file_path}/assets')
-		os.mkdir(f'{cook_file_path}/assets/thumbs')
-		#shutil.copy2('./static/img/pifire-cf-thumb.png', f'{HISTORY_FOLDER}{title}/assets/{thumbnail_UUID}.png')
-		#shutil.copy2('./static/img/pifire-cf-thumb.png', f'{HISTORY_FOLDER}{title}/assets/thumbs/{thumbnail_UUID}.png')
-
-		# 3. Create ZIP file of the folder 
-		directory = pathlib.Path(f'{cook_file_path}/')
-		filename = cook_file_name
-
-		with zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED) as archive:
-			for file_path in directory.rglob("*"):
-				archive.write(file_path, arcname=file_path.relative_to(directory))
 
-		eventLogger.debug(f'Wrote {cook_file_name} to {HISTORY_FOLDER}.')
+		# Write to a temporary name first, so that an interrupted save doesn't leave a partial cook file
+		temp_file_name = f'{cook_file_name}.tmp'
+		with zipfile.ZipFile(temp_file_name, "w", zipfile.ZIP_DEFLATED) as archive:
+			# 1. Write the small JSON data files
+			for item in ['metadata', 'graph_labels', 'events', 'comments', 'assets']:
+				archive.writestr(f'{item}.json', json.dumps(cook_file_struct[item], indent=2, sort_keys=True))
+
+			# 2. Stream the graph and raw data from the history
+			_write_json_chunks(archive, 'graph_data.json', _graph_data_chunks(chart_data, probe_mapper, time_labels))
+			_write_json_chunks(archive, 'raw_data.json', _raw_data_chunks())
 
-		# 4. Cleanup temporary files
-		command = f'rm -rf {cook_file_path}'
-		os.system(command)
+			# 3. Create empty asset folders
+			archive.writestr('assets/', '')
+			archive.writestr('assets/thumbs/', '')
+
+		os.replace(temp_file_name, cook_file_name)
+		update_cookfile_index(cook_file_name)
+
+		eventLogger.debug(f'Wrote {cook_file_name} to {HISTORY_FOLDER}.')
 
 	# Delete Redis DB for history / current
 	read_history(0, flushhistory=True)
 	# Flush metrics DB for tracking certain metrics
 	write_metrics(flush=True)
 
+def _write_json_chunks(archive, member, chunks):
+	'''
+	Write a JSON member to the archive from an iterator of JSON text chunks
+	'''
+	with archive.open(member, 'w') as member_file:
+		for chunk in chunks:
+			member_file.write(chunk.encode('utf-8'))
+
+def _json_list_chunks(items, chunk_size=1000):
+	'''
+	Encode an iterable as a JSON list, chunk_size items at a time
+	'''
+	yield '['
+	separator = ''
+	batch = []
+	for item in items:
+		batch.append(item)
+		if len(batch) >= chunk_size:
+			yield separator + json.dumps(batch, sort_keys=True)[1:-1]
+			separator = ', '
+			batch = []
+	if batch:
+		yield separator + json.dumps(batch, sort_keys=True)[1:-1]
+	yield ']'
+
+def _raw_data_chunks(chunk_size=1000):
+	'''
+	Encode the raw history data (list of history items) for the cook file
+	'''
+	return _json_list_chunks(iter_history(chunk_size=chunk_size), chunk_size=chunk_size)
+
+def _graph_data_chunks(chart_data, probe_mapper, time_labels):
+	'''
+	Encode the graph data for the cook file, reading one history column at a time for each chart dataset
+	'''
+	history_labels = read_history_labels()
+	series = {}  # chart_data index : (history group, label)
+	for key in history_labels.get('P') or []:
+		if key in probe_mapper['probes']:
+			series[probe_mapper['probes'][key]] = ('P', key)
+	for key in history_labels.get('F') or []:
+		if key in probe_mapper['probes']:
+			series[probe_mapper['probes'][key]] = ('F', key)
+	for key in history_labels.get('NT') or []:
+		if key in probe_mapper['targets']:
+			series[probe_mapper['targets'][key]] = ('NT', key)
+	for key in probe_mapper['primarysp']:
+		series[probe_mapper['primarysp'][key]] = ('PSP', None)
+		break
+
+	yield '{"probe_mapper": ' + json.dumps(probe_mapper, sort_keys=True) + ', "time_labels": '
+	yield from _json_list_chunks(time_labels)
+	yield ', "chart_data": ['
+	for index, chart_obj in enumerate(chart_data):
+		if index > 0:
+			yield ', '
+		if index not in series:
+			yield json.dumps(chart_obj, sort_keys=True)
+			continue
+		values = read_history_column(*series[index])
+		chart_info = json.dumps({key : value for key, value in chart_obj.items() if key != 'data'}, sort_keys=True)
+		yield chart_info[:-1] + (', ' if len(chart_info) > 2 else '') + '"data": '
+		yield from _json_list_chunks({'x' : x, 'y' : y} for x, y in zip(time_labels, values))
+		yield '}'
+	yield ']}'
+
+def _cookfile_index_entry(filename, stat):
+	'''
+	Build the index entry for a cook file from its metadata
+	'''
+	metadata, status = read_json_file_data(filename, 'metadata')
+	entry = {
+		'mtime' : stat.st_mtime_ns,
+		'size' : stat.st_size,
+		'status' : status,
+		'title' : '',
+		'starttime' : 0,
+		'endtime' : 0,
+		'thumbnail' : '',
+		'id' : ''
+	}
+	if status == 'OK':
+		for key in ['title', 'starttime', 'endtime', 'thumbnail', 'id']:
+			if metadata.get(key):
+				entry[key] = metadata[key]
+	return entry
+
+def read_cookfile_index(folder=HISTORY_FOLDER):
+	'''
+	Get the metadata index of the cook files in folder, without opening every archive.  
+
+	Each entry is validated against the cook file's modification time and size, so only new or 
+	changed files are opened, and entries for removed files are dropped.  The index is saved back 
+	to the folder when anything changed.  
+
+	:return: Dictionary of {filename : {'title', 'starttime', 'endtime', 'thumbnail', 'id', 'size', 'mtime', 'status'}}
+	'''
+	if not os.path.exists(folder):
+		os.mkdir(folder)
+	index_path = os.path.join(folder, COOKFILE_INDEX)
+
+	with _cookfile_index_lock, file_lock(index_path):
+		index = read_index_file(index_path)
+		current_index = {}
+		changed = False
+		for dir_entry in os.scandir(folder):
+			if not dir_entry.name.endswith('.pifire') or not dir_entry.is_file():
+				continue
+			stat = dir_entry.stat()
+			entry = index.get(dir_entry.name)
+			if entry is None or entry['mtime'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+				entry = _cookfile_index_entry(dir_entry.path, stat)
+				changed = True
+			current_index[dir_entry.name] = entry
+
+		if changed or len(current_index) != len(index):
+			write_index_file(current_index, index_path)
+
+	return current_index
+
+def update_cookfile_index(filename, remove=False):
+	'''
+	Update (or remove) the index entry of a single cook file, i.e. after it was created or deleted
+	'''
+	folder, name = os.path.split(filename)
+	index_path = os.path.join(folder, COOKFILE_INDEX)
+
+	with _cookfile_index_lock, file_lock(index_path):
+		index = read_index_file(index_path)
+		if remove or not os.path.exists(filename):
+			index.pop(name, None)
+		else:
+			index[name] = _cookfile_index_entry(filename, os.stat(filename))
+		write_index_file(index, index_path)
+
 def read_cookfile(filename):
 	'''
-	Read FULL Cook File into Python Dictionary
+	Read Cook File into a Python Dictionary
+
+	All members except raw_data are read (and decoded) immediately, so the status reflects them.  
+	raw_data is read from the cached archive the first time it is accessed (the status only 
+	reflects that it is present).  
 	'''
 	settings = read_settings()
 
-	cook_file_struct = {}
-	status = 'OK'
-	json_types = ['metadata', 'graph_data', 'raw_data', 'graph_labels', 'events', 'comments', 'assets']
-	for jsonfile in json_types:
-		cook_file_struct[jsonfile], status = read_json_file_data(filename, jsonfile)
-		if jsonfile == 'metadata':
-			fileversion = semantic_ver_to_list(cook_file_struct['metadata']['version'])
-			minfileversion = semantic_ver_to_list(settings['versions']['cookfile']) # Minimum file version to load assets
-			if not ( (fileversion[0] >= minfileversion[0]) and (fileversion[1] >= minfileversion[1]) and (fileversion[2] >= minfileversion[2]) ):
-				status = 'WARNING: Older cookfile version format! '
-		if status != 'OK':
-			break  # Exit loop and function, error string in status
+	try:
+		cookfile = open_cookfile(filename)
+	except zipfile.BadZipFile as error:
+		return({}, f'Error: {error}')
+	except:
+		return({}, 'Error: Unspecified')
+
+	cook_file_struct = CookFileData(cookfile)
+	cook_file_struct['metadata'], status = cookfile.read('metadata')
+	if status == 'OK':
+		fileversion = semantic_ver_to_list(cook_file_struct['metadata']['version'])
+		minfileversion = semantic_ver_to_list(settings['versions']['cookfile']) # Minimum file version to load assets
+		if not ( (fileversion[0] >= minfileversion[0]) and (fileversion[1] >= minfileversion[1]) and (fileversion[2] >= minfileversion[2]) ):
+			status = 'WARNING: Older cookfile version format! '
+
+	if status == 'OK':
+		for member in COOKFILE_MEMBERS:
+			if member == 'metadata':
+				continue
+			if member in COOKFILE_LAZY_MEMBERS:
+				if not cookfile.has_member(member):
+					status = 'Error: Unspecified'
+					break
+			else:
+				cook_file_struct[member], status = cookfile.read(member)
+				if status != 'OK':
+					break
 
 	return(cook_file_struct, status)
 
@@ -296,8 +624,81 @@ def upgrade_cookfile(cookfilename, repair=False):
 
 	return(cookfilestruct, status)
 
-def prepare_chartdata(probe_config, chart_info={}, num_items=10, reduce=True, data_points=60, history=None):
-	''' Build Probe Mapper and Chart Data Struct '''
+def prepare_chartdata(probe_config, chart_info={}, num_items=10, reduce=True, data_points=60, history=None, algorithm='lttb'):
+	'''
+	Build Probe Mapper and Chart Data Struct 
+
+	If reduce is True, each series is downsampled to data_points using the selected algorithm 
+	('lttb', 'minmax' or 'nth').  See common/downsample.py 
+	'''
+	chart_data, probe_mapper, graph_labels = _prepare_chart_objects(probe_config, chart_info)
+
+	''' Populate history data into chart data '''
+	if history == None:
+		history = read_history_columns(num_items)
+		list_length = len(history['T']) if history else 0 # Length of list(s)
+	else: 
+		list_length = len(history['T']) # Length of list(s)
+
+	if (list_length < num_items) and (list_length > 0):
+		num_items = list_length
+
+	if num_items == 0: 
+		num_items = list_length
+
+	# Target number of points per series (0 = keep all points)
+	threshold = data_points if reduce and (num_items > data_points) else 0
+
+	time_labels = []
+
+	if (list_length > 0):
+		# Build all lists from file data
+		first = list_length - num_items
+		time_list = history['T'][first:]
+		series = []  # List of (chart_data index, values)
+		for key in history['P']:
+			series.append((probe_mapper['probes'][key], history['P'][key][first:]))
+		for key in history['F']:
+			series.append((probe_mapper['probes'][key], history['F'][key][first:]))
+		for key in history['NT']:
+			series.append((probe_mapper['targets'][key], history['NT'][key][first:]))
+		for key in probe_mapper['primarysp']: 
+			series.append((probe_mapper['primarysp'][key], history['PSP'][first:]))
+			break 
+
+		# Downsample each series individually so that spikes in any probe are kept
+		label_indices = set()
+		for chart_index, values in series:
+			indices = downsample_indices(time_list, values, threshold, algorithm=algorithm)
+			chart_data[chart_index]['data'] = [{'x':time_list[index], 'y':values[index]} for index in indices]
+			label_indices.update(indices)
+
+		time_labels = [time_list[index] for index in sorted(label_indices)]
+	else:
+		now = datetime.datetime.now()
+		time_now = int(now.timestamp() * 1000)  # Use timestamp format * 1000 for JavaScript usages
+		time_labels.append(time_now)
+		for key in probe_mapper['probes'].keys():
+			chart_data[probe_mapper['probes'][key]]['data'].append(0)
+		for key in probe_mapper['targets'].keys():
+			chart_data[probe_mapper['targets'][key]]['data'].append(0)
+		for key in probe_mapper['primarysp'].keys(): 
+			chart_data[probe_mapper['primarysp'][key]]['data'].append(0)
+
+	''' Create data structure to return '''
+	data_blob = {
+		'time_labels' : time_labels,
+		'probe_mapper' : probe_mapper, 
+		'chart_data' : chart_data, 
+		'graph_labels' : graph_labels
+	}
+
+	return data_blob
+
+def _prepare_chart_objects(probe_config, chart_info={}):
+	'''
+	Build the (empty) chart datasets, probe mapper and graph labels for the probe configuration
+	'''
 	chart_data = []
 
 	if chart_info == {}:
@@ -379,61 +780,23 @@ def prepare_chartdata(probe_config, chart_info={}, num_items=10, reduce=True, da
 		''' Increment Index '''
 		index += 1
 
-	''' Populate history data into chart data '''
-	if history == None:
-		history = read_history(num_items)
-		if history !=[]: 
-			history = unpack_history(history)
-			list_length = len(history['T']) # Length of list(s)
-		else: 
-			list_length = 0
-	else: 
-		list_length = len(history['T']) # Length of list(s)
-
-	if (list_length < num_items) and (list_length > 0):
-		num_items = list_length
+	return chart_data, probe_mapper, graph_labels
 
-	if reduce and (num_items > data_points):
-		step = int(num_items/data_points)
-	else:
-		step = 1
-
-	if num_items == 0: 
-		num_items = list_length
-
-	time_labels = []
-
-	if (list_length > 0):
-		# Build all lists from file data
-		for index in range(list_length - num_items, list_length, step):
-			for key, value in history['P'].items():
-				chart_data[probe_mapper['probes'][key]]['data'].append({'x':history['T'][index], 'y':history['P'][key][index]})
-			for key, value in history['F'].items():
-				chart_data[probe_mapper['probes'][key]]['data'].append({'x':history['T'][index], 'y':history['F'][key][index]})
-			for key, value in history['NT'].items():
-				chart_data[probe_mapper['targets'][key]]['data'].append({'x':history['T'][index], 'y':history['NT'][key][index]})
-			for key in probe_mapper['primarysp']: 
-				chart_data[probe_mapper['primarysp'][key]]['data'].append({'x':history['T'][index], 'y':history['PSP'][index]})
-				break 
-
-			time_labels.append(history['T'][index])
-	else:
-		now = datetime.datetime.now()
-		time_now = int(now.timestamp() * 1000)  # Use timestamp format * 1000 for JavaScript usages
-		time_labels.append(time_now)
-		for key in probe_mapper['probes'].keys():
-			chart_data[probe_mapper['probes'][key]]['data'].append(0)
-		for key in probe_mapper['targets'].keys():
-			chart_data[probe_mapper['targets'][key]]['data'].append(0)
-		for key in probe_mapper['primarysp'].keys(): 
-			chart_data[probe_mapper['primarysp'][key]]['data'].append(0)
-
-	''' Create data structure to return '''
-	data_blob = {
-		'time_labels' : time_labels,
-		'probe_mapper' : probe_mapper, 
-		'chart_data' : chart_data, 
-		'graph_labels' : graph_labels
-	}
+def downsample_chartdata(chart_data, data_points, algorithm='lttb'):
+	'''
+	Downsample already prepared chart data (i.e. graph_data from a cookfile) to data_points per series
 
-	return data_blob
+	:param chart_data: List of chart objects, each with a 'data' list of {'x', 'y'} points
+	:param data_points: Target number of points per series (0 = keep all points)
+	:param algorithm: 'lttb', 'minmax' or 'nth'
+	:return: Tuple of (chart_data, time_labels)
+	'''
+	time_labels = set()
+	for chart_obj in chart_data:
+		data = chart_obj['data']
+		if data and isinstance(data[0], dict):
+			x_values = [point['x'] for point in data]
+			indices = downsample_indices(x_values, [point['y'] for point in data], data_points, algorithm=algorithm)
+			chart_obj['data'] = [data[index] for index in indices]
+			time_labels.update(x_values[index] for index in indices)
+	return chart_data, sorted(time_labels)
@@ -11,10 +11,17 @@ Imported Modules
 ================
 '''
 import os
+import json
 import zipfile
 from common import generate_uuid
-from file_mgmt.common import update_json_file_data, read_json_file_data
-from PIL import Image, ExifTags
+from common.redis_queue import RedisQueue
+from file_mgmt.common import update_json_file_data, read_json_file_data, file_lock
+from PIL import Image, ImageOps
+
+MEDIA_QUEUE = 'media:queue'  # Queue of images to be processed by the media worker
+MEDIA_JOB_KEY = 'media:job:'  # Status of a queued image (+ job id)
+MEDIA_JOB_EXPIRE = 3600  # Seconds to keep the status of a job
+MEDIA_WORKER_KEY = 'media:worker'  # Heartbeat of the media worker (expires if the worker isn't running)
 
 
 '''
@@ -23,129 +30,151 @@ Functions
 '''
 
 def add_asset(filename, assetpath, assetfile):
-    assetsjson, status = read_json_file_data(filename, 'assets')
-	#  Guess the filetype
-    filetype = assetfile.rsplit('.', 1)[1].lower()
-	#  Create new asset ID
-    asset_id = generate_uuid()
-	#  Create new asset structure
-    newasset = {
-			'id' : asset_id,
-			'filename' : asset_id + f'.{filetype}',
-			'type' : filetype
-		}
-	
-    if status == 'OK':
-		#  Append the new asset information to the file
-        assetsjson.append(newasset)
-		#  Update cookfile with new asset information
-        update_json_file_data(assetsjson, filename, 'assets')
-		#  Rename asset file to [asset_id].[filetype]
-        fullsize = f'{assetpath}/{asset_id}.{filetype}'
-        os.rename(os.path.join(assetpath, assetfile), fullsize)
+	'''
+	Add an image file to the cook / recipe file (rotate, resize and create the thumbnail) and 
+	wait for it to be done.  Use queue_asset() to process the image in the background instead.  
+	'''
+	asset_id, filetype = _new_asset(assetpath, assetfile)
+	status = _add_asset_files(filename, assetpath, asset_id, filetype)
+	if status != 'OK':
+		print(f'status: {status}')
+
+	return(asset_id, filetype)
 
-		#  Rotate image if needed
-        _rotate_image(assetpath, asset_id, filetype)
+def queue_asset(filename, assetpath, assetfile, thumbnail=False):
+	'''
+	Queue an image file to be added to the cook / recipe file by the media worker (media_worker.py).  If the 
+	media worker isn't running, the image is processed right away.  
 
-		#  Create a thumbnail from the image
-        thumbpathname, status = _create_thumbnail(assetpath, asset_id, filetype)
+	:param thumbnail: True to set the image as the thumbnail of the file once it is added
 
-		#  Resize original image
-        status = _resize_image(assetpath, asset_id, filetype, max_size=(800, 600))
+	:return: Tuple of (job_id, asset_id, filetype), poll the job with read_media_job(job_id)
+	'''
+	asset_id, filetype = _new_asset(assetpath, assetfile)
+	job = {
+		'job_id' : asset_id,
+		'filename' : filename,
+		'assetpath' : assetpath,
+		'asset_id' : asset_id,
+		'filetype' : filetype,
+		'thumbnail' : thumbnail
+	}
+	media_queue = RedisQueue(MEDIA_QUEUE)
+	if media_queue.redis_db.exists(MEDIA_WORKER_KEY):
+		_write_media_job(media_queue.redis_db, job, 'queued')
+		media_queue.push(job)
+	else:
+		process_media_job(job, media_queue.redis_db)
+
+	return(job['job_id'], asset_id, filetype)
+
+def process_media_job(job, redis_db):
+	'''
+	Process a media job from the queue (see queue_asset) and record the result
+	'''
+	_write_media_job(redis_db, job, 'processing')
+	try:
+		status = _add_asset_files(job['filename'], job['assetpath'], job['asset_id'], job['filetype'])
+		if status == 'OK' and job.get('thumbnail'):
+			set_thumbnail(job['filename'], f'{job["asset_id"]}.{job["filetype"]}')
+	except Exception as error:
+		status = f'ERROR: {error}'
+	_write_media_job(redis_db, job, 'done' if status == 'OK' else 'error', status)
+	return status
 
-		#  Add the files to the zipfile
-        with zipfile.ZipFile(filename, 'a') as archive:
-            if status=='OK':
-                archive.write(thumbpathname, arcname=f'assets/thumbs/{asset_id}.{filetype}')
-            archive.write(fullsize, arcname=f'assets/{asset_id}.{filetype}')
-    else: 
-        print(f'status: {status}')
+def read_media_job(job_id, redis_db=None):
+	'''
+	:return: Job status dictionary ('status' is one of queued / processing / done / error) or None if the job is unknown
+	'''
+	if redis_db is None:
+		redis_db = RedisQueue(MEDIA_QUEUE).redis_db
+	job = redis_db.get(f'{MEDIA_JOB_KEY}{job_id}')
+	return json.loads(job) if job is not None else None
 
-    return(asset_id, filetype)
+def _write_media_job(redis_db, job, status, message=''):
+	job_status = {'status' : status, 'message' : message, 'asset_id' : job['asset_id'], 'filetype' : job['filetype']}
+	redis_db.set(f'{MEDIA_JOB_KEY}{job["job_id"]}', json.dumps(job_status), ex=MEDIA_JOB_EXPIRE)
 
-def _rotate_image(filepath, asset_id, filetype):
-	status = 'OK'
+def _new_asset(assetpath, assetfile):
 	'''
-		Rotates the image if necessary.	
+	Rename the uploaded file to [asset_id].[filetype] 
 	'''
+	#  Guess the filetype
+	filetype = assetfile.rsplit('.', 1)[1].lower()
+	#  Create new asset ID
+	asset_id = generate_uuid()
+	os.rename(os.path.join(assetpath, assetfile), f'{assetpath}/{asset_id}.{filetype}')
+	return(asset_id, filetype)
 
-	try:
-		#  Load image into memory
-		imagefile = f'{filepath}/{asset_id}.{filetype}'
-		image = Image.open(imagefile)
-
-		for orientation in ExifTags.TAGS.keys():
-			if ExifTags.TAGS[orientation]=='Orientation':
-				break
-		
-		exif = image._getexif()
-
-		if(exif is not None):
-			rotate = True
-			if exif[orientation] == 3:
-				image=image.rotate(180, expand=True)
-			elif exif[orientation] == 6:
-				image=image.rotate(270, expand=True)
-			elif exif[orientation] == 8:
-				image=image.rotate(90, expand=True)
-			else:
-				rotate=False
-			
-			if rotate:
-				image.save(imagefile)
-		
-		image.close()
-	
-	except (AttributeError, KeyError, IndexError):
-		status = 'ERROR: Rotation Failed.'
-	except:
-		status = 'ERROR: Rotation Failed, Unspecified Error.'
+def _add_asset_files(filename, assetpath, asset_id, filetype):
+	'''
+	Process the image and add it (and its thumbnail) to the assets of the cook / recipe file
+	'''
+	#  Rotate, resize and create the thumbnail 
+	thumbpathname, image_status = _process_image(assetpath, asset_id, filetype)
+
+	#  Add the files to the zipfile and the asset to the assets list, holding the lock for the whole 
+	#  read-modify-write so that concurrent workers don't lose each other's assets
+	fullsize = f'{assetpath}/{asset_id}.{filetype}'
+	with file_lock(filename):
+		assetsjson, status = read_json_file_data(filename, 'assets', unpackassets=False)
+		if status != 'OK':
+			return status
+
+		with zipfile.ZipFile(filename, 'a') as archive:
+			if image_status == 'OK':
+				archive.write(thumbpathname, arcname=f'assets/thumbs/{asset_id}.{filetype}')
+			archive.write(fullsize, arcname=f'assets/{asset_id}.{filetype}')
 
+		#  Append the new asset information to the file
+		assetsjson.append({
+				'id' : asset_id,
+				'filename' : asset_id + f'.{filetype}',
+				'type' : filetype
+			})
+		status = update_json_file_data(assetsjson, filename, 'assets')
 	return status
 
-def _create_thumbnail(filepath, asset_id, filetype, crop=True):
-	status = 'OK'
-	#  Import PIL for image manipulations
-	from PIL import Image
-	#  Load image into memory
-	imagefile = f'{filepath}/{asset_id}.{filetype}'
-	image = Image.open(imagefile)
-	width, height = image.size
-
-	#  Crop Image 
-	if crop:
-		if width > height:
-			image = image.crop((width//2 - height//2, 0, width//2 + height//2, height))
-		elif height > width:
-			image = image.crop((0, height//2 - width//2, width, height//2 + width//2))
-		#  Get new width & height
-		width, height = image.size
-
-	#  Resize Image to 128px x 128px unless it's already the right size
-	if (width != 128) and (height != 128):
-		image = image.resize((128, 128))
-
-	#  Save thumb image in filepath + /thumbs
-	if not os.path.exists(f'{filepath}/thumbs'):
-		os.mkdir(f'{filepath}/thumbs')
-	thumbpathname = f'{filepath}/thumbs/{asset_id}.{filetype}'
-	image.save(thumbpathname)
-
-	return(thumbpathname, status)
+def _process_image(assetpath, asset_id, filetype, max_size=(800, 600), thumb_size=128, crop=True):
+	'''
+	Rotate the image (EXIF orientation), resize it to fit into max_size and create a square thumbnail, 
+	decoding the image only once.  JPEGs are decoded at a reduced scale (the smallest of 1/1, 1/2, 1/4 
+	or 1/8 that is still larger than max_size).  
 
-def _resize_image(assetpath, asset_id, filetype, max_size=(800, 600)):
+	:return: Tuple of (thumbnail path, status)
+	'''
 	status = 'OK'
-	#  Import PIL for image manipulations
-	from PIL import Image, ImageOps
-	#  Load image into memory
 	imagefile = f'{assetpath}/{asset_id}.{filetype}'
-	image = Image.open(imagefile)
-	#  Resizes image to fit into max_size and maintains aspect ratio
-	image = ImageOps.contain(image, max_size)
-	#  Saves the image file
-	image.save(imagefile)
+	thumbpathname = f'{assetpath}/thumbs/{asset_id}.{filetype}'
+
+	try:
+		with Image.open(imagefile) as original:
+			if original.format == 'JPEG':
+				original.draft(original.mode, (max(max_size), max(max_size)))
+			image = ImageOps.exif_transpose(original)
+
+		#  Crop the thumbnail to a square and resize it to thumb_size x thumb_size
+		thumb = image
+		width, height = thumb.size
+		if crop:
+			if width > height:
+				thumb = thumb.crop((width//2 - height//2, 0, width//2 + height//2, height))
+			elif height > width:
+				thumb = thumb.crop((0, height//2 - width//2, width, height//2 + width//2))
+		if thumb.size != (thumb_size, thumb_size):
+			thumb = thumb.resize((thumb_size, thumb_size), reducing_gap=2.0)
+		if not os.path.exists(f'{assetpath}/thumbs'):
+			os.mkdir(f'{assetpath}/thumbs')
+		thumb.save(thumbpathname)
+
+		#  Resize the image to fit into max_size (maintains aspect ratio) 
+		image = ImageOps.contain(image, max_size)
+		image.save(imagefile)
 
-	return(status)
+	except:
+		status = 'ERROR: Image processing failed.'
+
+	return(thumbpathname, status)
 
 def set_thumbnail(filename, thumbfilename):
 	'''
@@ -153,12 +182,17 @@ def set_thumbnail(filename, thumbfilename):
 	thumbfilename = filename of the thumbnail image which is being set
 		without the assets/thumbs/ folder in the path 
 	'''
-	metadata, status = read_json_file_data(filename, 'metadata')
-	if status=='OK':
-		metadata['thumbnail'] = f'{thumbfilename}'
-		update_json_file_data(metadata, filename, 'metadata')
+	with file_lock(filename):
+		metadata, status = read_json_file_data(filename, 'metadata')
+		if status=='OK':
+			metadata['thumbnail'] = f'{thumbfilename}'
+			update_json_file_data(metadata, filename, 'metadata')
 
 def unpack_thumb(thumbname, filename, tmp_id):
+	# Skip opening the archive if the thumbnail was already unpacked
+	if os.path.exists(f'./static/img/tmp/{tmp_id}/{thumbname}'):
+		return f'{tmp_id}/{thumbname}'
+
 	try:
 		with zipfile.ZipFile(filename, mode="r") as archive:
 			thumb = archive.read(f'assets/thumbs/{thumbname}')  # Read bytes into variable
@@ -16,13 +16,19 @@ import os
 import json
 import zipfile
 import pathlib
+import hashlib
+import threading
 
 from flask import current_app
 from common import read_settings, generate_uuid, convert_temp
-from file_mgmt.common import read_json_file_data
-from file_mgmt.media import unpack_thumb
+from file_mgmt.common import read_json_file_data, read_index_file, write_index_file, file_lock
 
 RECIPE_FOLDER = './recipes/'  # Path to recipe files
+RECIPE_CATALOG = 'recipe_catalog.json'  # Catalog of the recipe files (stored in the recipe folder)
+RECIPE_ASSET_FOLDER = './static/img/recipes/'  # Content-hashed recipe images, served as static files
+RECIPE_ASSET_URL = '/static/img/recipes/'
+
+_recipe_catalog_lock = threading.Lock()
 
 '''
 Functions
@@ -218,16 +224,110 @@ def get_recipefilelist(folder=None):
             recipefiles.append(file)
     return(recipefiles)
 
-def get_recipefilelist_details(recipefilelist):
+def get_recipefilelist_details(recipefilelist, folder=RECIPE_FOLDER):
+    catalog = read_recipe_catalog(folder)
     recipefiledetails = []
     for item in recipefilelist:
-        filename = RECIPE_FOLDER + item['filename']
-        recipefiledata, status = read_json_file_data(filename, 'metadata')
-        if status == 'OK':
-            thumbnail = unpack_thumb(recipefiledata['thumbnail'], filename, recipefiledata["id"]) if (
-                    'thumbnail' in recipefiledata) else ''
+        entry = catalog.get(item['filename'])
+        if entry is not None and entry['status'] == 'OK':
             recipefiledetails.append(
-                {'filename': item['filename'], 'title': recipefiledata['title'], 'thumbnail': thumbnail})
+                {'filename': item['filename'], 'title': entry['details']['metadata']['title'], 'thumbnail': entry['thumbnail']})
         else:
             recipefiledetails.append({'filename': item['filename'], 'title': 'ERROR', 'thumbnail': ''})
-    return recipefiledetails
\ No newline at end of file
+    return recipefiledetails
+
+def _store_recipe_asset(data, filetype):
+    '''
+    Store image data under a name derived from its content, so the file never changes once written 
+    and can be cached by clients (and revalidated with its ETag) indefinitely.  
+
+    :return: Name of the stored file in RECIPE_ASSET_FOLDER
+    '''
+    name = f'{hashlib.sha1(data).hexdigest()[:20]}.{filetype}'
+    path = os.path.join(RECIPE_ASSET_FOLDER, name)
+    if not os.path.exists(path):
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'wb') as asset_file:
+            asset_file.write(data)
+        os.replace(temp_path, path)
+    return name
+
+def _recipe_catalog_entry(filename, stat):
+    '''
+    Build the catalog entry for a recipe file.  The JSON members are stored as they are, the images 
+    are extracted to RECIPE_ASSET_FOLDER and referenced by name ('image_file' / 'thumb_file') and URL 
+    ('image_url' / 'thumb_url') instead of being inlined.  
+    '''
+    entry = {
+        'mtime' : stat.st_mtime_ns,
+        'size' : stat.st_size,
+        'status' : 'OK',
+        'details' : {},
+        'thumbnail' : '',
+        'asset_files' : []
+    }
+    for jsonfile in ['metadata', 'recipe', 'comments', 'assets']:
+        entry['details'][jsonfile], entry['status'] = read_json_file_data(filename, jsonfile, unpackassets=False)
+        if entry['status'] != 'OK':
+            return entry
+
+    if not os.path.exists(RECIPE_ASSET_FOLDER):
+        os.makedirs(RECIPE_ASSET_FOLDER)
+
+    try:
+        with zipfile.ZipFile(filename, mode='r') as archive:
+            members = set(archive.namelist())
+            for asset in entry['details']['assets']:
+                for key, member in [('image', f'assets/{asset["filename"]}'), ('thumb', f'assets/thumbs/{asset["filename"]}')]:
+                    if member in members:
+                        asset[f'{key}_file'] = _store_recipe_asset(archive.read(member), asset['type'])
+                        asset[f'{key}_url'] = RECIPE_ASSET_URL + asset[f'{key}_file']
+                        entry['asset_files'].append(asset[f'{key}_file'])
+                if asset['filename'] == entry['details']['metadata'].get('thumbnail', '') and 'thumb_file' in asset:
+                    entry['thumbnail'] = asset['thumb_file']
+    except:
+        entry['status'] = 'Error: Error opening assets.'
+
+    return entry
+
+def read_recipe_catalog(folder=RECIPE_FOLDER):
+    '''
+    Get the catalog of the recipe files in folder.  
+
+    Each entry holds the JSON members of the recipe file ('details') and the names of its images, which are 
+    extracted once to RECIPE_ASSET_FOLDER.  Entries are validated against the modification time and size of 
+    the recipe file, so only new or changed files are opened.  Images that are no longer referenced by any 
+    recipe file are removed.  
+
+    :return: Dictionary of {filename : {'details', 'thumbnail', 'asset_files', 'size', 'mtime', 'status'}}
+    '''
+    if not os.path.exists(folder):
+        os.mkdir(folder)
+    catalog_path = os.path.join(folder, RECIPE_CATALOG)
+
+    with _recipe_catalog_lock, file_lock(catalog_path):
+        catalog = read_index_file(catalog_path)
+        current_catalog = {}
+        changed = False
+        for dir_entry in os.scandir(folder):
+            if not dir_entry.name.endswith('.pfrecipe') or not dir_entry.is_file():
+                continue
+            stat = dir_entry.stat()
+            entry = catalog.get(dir_entry.name)
+            if entry is None or entry['mtime'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+                entry = _recipe_catalog_entry(dir_entry.path, stat)
+                changed = True
+            current_catalog[dir_entry.name] = entry
+
+        if changed or len(current_catalog) != len(catalog):
+            write_index_file(current_catalog, catalog_path)
+            # Remove images that are no longer referenced 
+            referenced = set()
+            for entry in current_catalog.values():
+                referenced.update(entry['asset_files'])
+            if os.path.exists(RECIPE_ASSET_FOLDER):
+                for asset_file in os.listdir(RECIPE_ASSET_FOLDER):
+                    if asset_file not in referenced:
+                        os.remove(os.path.join(RECIPE_ASSET_FOLDER, asset_file))
+
+    return current_catalog
\ No newline at end of file
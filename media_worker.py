@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+'''
+==============================================================================
+ PiFire Media Worker Process
+==============================================================================
+
+Description: This script processes the images that are uploaded to cook files 
+  and recipe files (rotate, resize and create thumbnails), so that the web 
+  interface doesn't stall while the images are decoded.  
+
+ This script runs as a separate process from the Flask / Gunicorn
+ implementation which queues the images (see file_mgmt/media.py).
+
+==============================================================================
+'''
+
+'''
+==============================================================================
+ Imported Modules
+==============================================================================
+'''
+import time
+import atexit
+from common import create_logger
+from common.redis_queue import RedisQueue
+from file_mgmt.media import MEDIA_QUEUE, MEDIA_WORKER_KEY, process_media_job
+
+'''
+==============================================================================
+ Constants & Globals
+==============================================================================
+'''
+HEARTBEAT_INTERVAL = 10  # Seconds between heartbeats (the heartbeat expires after 3 intervals)
+
+'''
+==============================================================================
+ Main Program
+==============================================================================
+'''
+def _remove_heartbeat(media_queue):
+	try:
+		media_queue.redis_db.delete(MEDIA_WORKER_KEY)
+	except:
+		pass
+
+def main():
+	mediaLogger = create_logger('media', filename='./logs/media.log')
+	media_queue = RedisQueue(MEDIA_QUEUE)
+	atexit.register(_remove_heartbeat, media_queue)
+	mediaLogger.info('Media worker started.')
+
+	while True:
+		try:
+			media_queue.redis_db.set(MEDIA_WORKER_KEY, int(time.time()), ex=HEARTBEAT_INTERVAL * 3)
+			job = media_queue.pop_wait(timeout=HEARTBEAT_INTERVAL)
+			if job is not None:
+				start_time = time.time()
+				status = process_media_job(job, media_queue.redis_db)
+				mediaLogger.debug(f'Processed {job["asset_id"]}.{job["filetype"]} for {job["filename"]} in {time.time() - start_time:.2f}s: {status}')
+				if status != 'OK':
+					mediaLogger.error(f'Error processing {job["asset_id"]}.{job["filetype"]} for {job["filename"]}: {status}')
+		except:
+			mediaLogger.exception('Error occurred in the media worker. Trace dump: ')
+			time.sleep(HEARTBEAT_INTERVAL)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,176 @@
+"""
+Class to deliver notifications in the background, so that a slow or unreachable notification service
+never delays the control loop.
+
+Each service (apprise, pushover, mqtt, wled, ...) gets its own queue and worker thread, so one service
+can't hold up the others.  Failed deliveries are retried with exponential backoff (scheduled, so a failing
+delivery doesn't hold up the later ones), duplicate deliveries (same service and key) are dropped while
+pending or within the deduplication window, and the delivery metrics of each service are published to
+Redis (see read_notify_metrics()).
+"""
+import heapq
+import json
+import queue
+import threading
+import time
+import redis
+
+NOTIFY_METRICS_KEY = 'notify:metrics'
+
+
+def read_notify_metrics():
+    """
+    :return: Dictionary of {service : metrics} as published by the dispatcher of the control process
+    """
+    try:
+        redis_db = redis.StrictRedis('localhost', 6379, charset="utf-8", decode_responses=True)
+        return {service : json.loads(metrics) for service, metrics in redis_db.hgetall(NOTIFY_METRICS_KEY).items()}
+    except:
+        return {}
+
+
+class NotificationDispatcher():
+    def __init__(self, max_retries=3, backoff=2.0, max_backoff=60.0, dedup_window=60, max_queue=50):
+        """
+        :param max_retries: Number of retries of a failed delivery
+        :param backoff: Seconds to wait before the first retry (doubled for each retry)
+        :param max_backoff: Maximum seconds to wait between retries
+        :param dedup_window: Default seconds to drop duplicates of a delivered notification
+        :param max_queue: Maximum number of pending deliveries per service (more are dropped)
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.dedup_window = dedup_window
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.metrics = {}
+        self.recent = {}
+        self.redis_db = redis.StrictRedis('localhost', 6379, charset="utf-8", decode_responses=True)
+
+    def dispatch(self, service, send_function, args=(), kwargs=None, dedup_key=None, dedup_window=None, retry=True):
+        """
+        Queue a delivery for the service's worker
+
+        :param service: Name of the notification service
+        :param send_function: Function that delivers the notification, returns False (or raises) on failure
+        :param args: Arguments for send_function
+        :param kwargs: Keyword arguments for send_function
+        :param dedup_key: Key to identify duplicates (None = no deduplication)
+        :param dedup_window: Seconds to drop duplicates after delivery (0 = only while pending)
+        :param retry: Retry a failed delivery
+        :return: True if queued, False if dropped
+        """
+        dedup_window = self.dedup_window if dedup_window is None else dedup_window
+        now = time.time()
+        with self.lock:
+            metrics = self._service_metrics(service)
+            if dedup_key is not None:
+                if now - self.recent.get((service, dedup_key), -dedup_window) < dedup_window:
+                    metrics['duplicates'] += 1
+                    return False
+                self.recent[(service, dedup_key)] = float('inf')  # Pending
+                self._prune_recent(now)
+            worker_queue = self._worker_queue(service)
+
+            try:
+                worker_queue.put_nowait((send_function, args, kwargs or {}, dedup_key, retry))
+            except queue.Full:
+                metrics['dropped'] += 1
+                self.recent.pop((service, dedup_key), None)
+                return False
+            metrics['queued'] += 1
+            metrics['pending'] = worker_queue.qsize()
+        return True
+
+    def flush(self, timeout=30):
+        """
+        Wait for the pending deliveries (i.e. before the process exits)
+
+        :return: True if all deliveries finished within the timeout
+        """
+        end_time = time.time() + timeout
+        while time.time() < end_time:
+            with self.lock:
+                if all(worker_queue.unfinished_tasks == 0 for worker_queue in self.queues.values()):
+                    return True
+            time.sleep(0.1)
+        return False
+
+    def get_metrics(self):
+        with self.lock:
+            return {service : dict(metrics) for service, metrics in self.metrics.items()}
+
+    def _service_metrics(self, service):
+        if service not in self.metrics:
+            self.metrics[service] = {
+                'queued' : 0, 'sent' : 0, 'failed' : 0, 'retries' : 0, 'duplicates' : 0, 'dropped' : 0,
+                'pending' : 0, 'last_latency' : None, 'last_success' : None, 'last_error' : ''
+            }
+        return self.metrics[service]
+
+    def _worker_queue(self, service):
+        if service not in self.queues:
+            self.queues[service] = queue.Queue(maxsize=self.max_queue)
+            worker = threading.Thread(target=self._run, args=(service, self.queues[service]), name=f'notify-{service}', daemon=True)
+            worker.start()
+        return self.queues[service]
+
+    def _prune_recent(self, now):
+        if len(self.recent) > 256:
+            for key, delivered in list(self.recent.items()):
+                if delivered != float('inf') and now - delivered > self.dedup_window:
+                    self.recent.pop(key)
+
+    def _run(self, service, worker_queue):
+        retries = []  # Heap of (due time, sequence, delivery, attempt) of the failed deliveries waiting for a retry
+        sequence = 0
+        while True:
+            # Take a retry that is due, else wait for a new delivery (or until the next retry is due), so a
+            # failing delivery doesn't hold up the later ones
+            if retries and retries[0][0] <= time.time():
+                _, _, delivery, attempt = heapq.heappop(retries)
+            else:
+                try:
+                    delivery = worker_queue.get(timeout=max(0.0, retries[0][0] - time.time()) if retries else None)
+                except queue.Empty:
+                    continue
+                attempt = 0
+            send_function, args, kwargs, dedup_key, retry = delivery
+
+            start_time = time.time()
+            try:
+                success = send_function(*args, **kwargs) is not False
+                error = '' if success else 'Delivery failed.'
+            except Exception as e:
+                success = False
+                error = str(e)
+            latency = time.time() - start_time
+            if not success and retry and attempt < self.max_retries:
+                attempt += 1
+                with self.lock:
+                    self.metrics[service]['retries'] += 1
+                sequence += 1
+                due = time.time() + min(self.backoff * (2 ** (attempt - 1)), self.max_backoff)
+                heapq.heappush(retries, (due, sequence, delivery, attempt))
+                continue
+
+            with self.lock:
+                metrics = self.metrics[service]
+                metrics['sent' if success else 'failed'] += 1
+                metrics['last_latency'] = round(latency, 3)
+                if success:
+                    metrics['last_success'] = time.time()
+                else:
+                    metrics['last_error'] = error
+                metrics['pending'] = worker_queue.qsize() + len(retries)
+                if dedup_key is not None:
+                    self.recent[(service, dedup_key)] = time.time()
+                metrics_json = json.dumps(metrics)
+            worker_queue.task_done()
+
+            try:
+                self.redis_db.hset(NOTIFY_METRICS_KEY, service, metrics_json)
+            except:
+                pass
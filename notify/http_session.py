@@ -0,0 +1,67 @@
+"""
+Shared HTTP sessions for the notification services (WLED, OneSignal, IFTTT)
+
+Requests made with a bare requests.post() open (and close) a new connection every time, paying the TCP
+(and TLS) handshake for each notification.  The sessions here keep the connections to each host alive,
+so i.e. a WLED state update is a single small request on a warm connection.
+
+    from notify.http_session import get_session
+    response = get_session('wled').post(url, json=payload)
+
+Each named session has its own connection pools (one per host, keeping up to pool_maxsize connections
+alive) and a default timeout, which is used for any request that doesn't specify one.
+"""
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_TIMEOUT = (3.05, 10)  # (connect, read) seconds
+POOL_CONNECTIONS = 4  # Number of hosts to keep connection pools for
+POOL_MAXSIZE = 2  # Number of connections kept alive per host
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class PooledSession(requests.Session):
+    def __init__(self, timeout=DEFAULT_TIMEOUT, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, retries=0):
+        """
+        :param timeout: Default timeout for requests, seconds or a tuple of (connect, read) seconds
+        :param pool_connections: Number of hosts to keep connection pools for
+        :param pool_maxsize: Number of connections kept alive per host
+        :param retries: Number of retries for failed connections
+        """
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retries)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().request(method, url, **kwargs)
+
+
+def get_session(name='default', timeout=DEFAULT_TIMEOUT):
+    """
+    Get the shared session for name (created on first use)
+
+    :param name: Name of the session, i.e. the service ('wled', 'onesignal', 'ifttt')
+    :param timeout: Default timeout (only used when the session is created)
+    :return: PooledSession
+    """
+    with _sessions_lock:
+        if name not in _sessions:
+            _sessions[name] = PooledSession(timeout=timeout)
+        return _sessions[name]
+
+
+def close_sessions():
+    """
+    Close all shared sessions (and their connections)
+    """
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
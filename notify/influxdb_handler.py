@@ -1,60 +1,150 @@
+import os
 import time
-from datetime import datetime
 import threading
+from collections import deque
+from notify.http_session import get_session
+
+'''
+InfluxDB exporter
+
+The control loop encodes each grill state as a line of InfluxDB line protocol and appends it to a bounded
+ring buffer (a deque, so the control loop never waits on a lock and the memory used is capped).  A publishing
+thread takes the lines from the buffer and writes them in batches to the InfluxDB v2 write API.  While the
+server can't be reached, the lines are spilled to a file and sent (before any new lines) once it is back.
+'''
+
+BUFFER_SIZE = 3600  # Maximum lines held in memory (oldest are dropped)
+BATCH_SIZE = 500  # Maximum lines per write request
+FLUSH_INTERVAL = 5  # Seconds between writes
+RETRY_INTERVAL = 10  # Seconds to wait before retrying after a failed write
+SPILL_FILE = '/tmp/pifire/influxdb_spill.lp'  # Lines that couldn't be written yet
+SPILL_MAX_BYTES = 20 * 1024 * 1024  # Maximum size of the spill file (new lines are dropped when full)
+
+
+def _escape_key(key):
+	return str(key).replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+def _escape_measurement(name):
+	return str(name).replace('\\', '\\\\').replace(',', '\\,').replace(' ', '\\ ')
+
+def _field_value(value):
+	if isinstance(value, bool):
+		return 'true' if value else 'false'
+	if isinstance(value, int):
+		return f'{value}i'
+	if isinstance(value, float):
+		return repr(value)
+	return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def encode_line(measurement, fields, timestamp_ns, tags={}):
+	'''
+	Encode a point as InfluxDB line protocol (fields with a value of None are skipped)
+	'''
+	tag_set = ''.join(f',{_escape_key(key)}={_escape_key(value)}' for key, value in sorted(tags.items()))
+	field_set = ','.join(f'{_escape_key(key)}={_field_value(value)}' for key, value in fields.items() if value is not None)
+	return f'{_escape_measurement(measurement)}{tag_set} {field_set} {timestamp_ns}'
 
 
 class InfluxNotificationHandler:
 
 	def __init__(self, settings) -> None:
-		self.queue = []
+		self.buffer = deque(maxlen=BUFFER_SIZE)
 		self.last_updated = time.time()
+		self.dropped = 0
+		self.spill_offset = 0  # Bytes of the spill file that were already written to the server
 
-		t1 = threading.Thread(target=self.publishing_thread, daemon=True,
-							  args=(
-								  settings['notify_services']['influxdb']['url'],
-								  settings['notify_services']['influxdb']['token'],
-								  settings['notify_services']['influxdb']['org'],
-								  settings['notify_services']['influxdb']['bucket']))
-		t1.start()
-
-	def publishing_thread(self, url, token, org, bucket):
-		from influxdb_client import InfluxDBClient
-
-		bucket = bucket
+		influxdb = settings['notify_services']['influxdb']
+		self.write_url = influxdb['url'].rstrip('/') + '/api/v2/write'
+		self.params = {'org' : influxdb['org'], 'bucket' : influxdb['bucket'], 'precision' : 'ns'}
+		self.headers = {'Authorization' : f'Token {influxdb["token"]}', 'Content-Type' : 'text/plain; charset=utf-8'}
 
-		client = InfluxDBClient(url=url, token=token,
-								org=org)
-
-		from influxdb_client import WriteOptions
-		write_api = None
+		self.wake = threading.Event()
+		t1 = threading.Thread(target=self.publishing_thread, daemon=True)
+		t1.start()
 
+	def publishing_thread(self):
 		while True:
-			time.sleep(1)
-			if not write_api:
-
-				write_api = client.write_api(write_options=WriteOptions(batch_size=100,
-																		flush_interval=5_000,
-																		jitter_interval=2_000,
-																		retry_interval=2_000,
-																		max_retries=3,
-																		max_retry_delay=30_000,
-																		exponential_base=2))
-
-			try:
-				buf = self.queue.copy()
-				self.queue.clear()
-				if len(buf) > 0:
-					write_api.write(bucket, org, buf)
-				time.sleep(5)
-			except:
-				write_api = None
-				time.sleep(10)
+			self.wake.wait(FLUSH_INTERVAL)
+			self.wake.clear()
+
+			# Send the spilled lines first to keep the points in order
+			if os.path.exists(SPILL_FILE) and not self._send_spill():
+				self._spill()
+				time.sleep(RETRY_INTERVAL)
+				continue
+
+			while self.buffer:
+				lines = self._take(BATCH_SIZE)
+				if not self._write(lines):
+					self._spill(lines)
+					time.sleep(RETRY_INTERVAL)
+					break
+
+	def _take(self, count):
+		lines = []
+		while self.buffer and len(lines) < count:
+			lines.append(self.buffer.popleft())
+		return lines
+
+	def _write(self, lines):
+		'''
+		Write lines to the server.  Returns False if the lines should be retried later.
+		'''
+		try:
+			response = get_session('influxdb').post(self.write_url, params=self.params, headers=self.headers, data='\n'.join(lines).encode('utf-8'))
+		except:
+			return False
+		if response.status_code in (429,) or response.status_code >= 500:
+			return False
+		# Any other error (i.e. invalid data or credentials) won't succeed on a retry, drop the lines
+		if response.status_code >= 300:
+			self.dropped += len(lines)
+		return True
+
+	def _spill(self, lines=[]):
+		'''
+		Move the lines (and everything in the buffer) to the spill file
+		'''
+		lines = lines + self._take(len(self.buffer))
+		if not lines:
+			return
+		try:
+			os.makedirs(os.path.dirname(SPILL_FILE), exist_ok=True)
+			size = os.path.getsize(SPILL_FILE) if os.path.exists(SPILL_FILE) else 0
+			data = ('\n'.join(lines) + '\n').encode('utf-8')
+			if size + len(data) > SPILL_MAX_BYTES:
+				self.dropped += len(lines)
+				return
+			with open(SPILL_FILE, 'ab') as spill_file:
+				spill_file.write(data)
+		except:
+			self.dropped += len(lines)
+
+	def _send_spill(self):
+		'''
+		Send the spill file in batches, remove it when done.  Returns False if the server is still unreachable.
+		'''
+		try:
+			with open(SPILL_FILE, 'rb') as spill_file:
+				spill_file.seek(self.spill_offset)
+				while True:
+					lines = [spill_file.readline() for _ in range(BATCH_SIZE)]
+					lines = [line.decode('utf-8').rstrip('\n') for line in lines if line]
+					if not lines:
+						break
+					if not self._write(lines):
+						return False
+					self.spill_offset = spill_file.tell()
+			os.remove(SPILL_FILE)
+			self.spill_offset = 0
+		except FileNotFoundError:
+			self.spill_offset = 0
+		return True
 
 	def notify(self, notifyevent, control, settings, pelletdb, in_data, grill_platform):
 		if time.time() - self.last_updated < 1:
 			return
 
-		from influxdb_client import Point
 		name = settings['globals']['grill_name']
 		if len(name) == 0:
 			name = 'Smoker'
@@ -64,36 +154,45 @@ class InfluxNotificationHandler:
 				return data[k]
 			return default
 
-		PrimaryKey = list(in_data['probe_history']['primary'].keys())[0]
-		Probe1Key = list(in_data['probe_history']['food'].keys())[0]
-		Probe2Key = list(in_data['probe_history']['food'].keys())[1]
-		
-		PrimaryTemp = in_data['probe_history']['primary'][PrimaryKey]
-		PrimarySetpoint = in_data['primary_setpoint']
-		PrimaryNotify = in_data['notify_targets'][PrimaryKey]
-		Probe1Temp = in_data['probe_history']['food'][Probe1Key]
-		Probe1Notify = in_data['notify_targets'][Probe1Key]
-		Probe2Temp = in_data['probe_history']['food'][Probe2Key]
-		Probe2Notify = in_data['notify_targets'][Probe2Key]
-
-		p = Point(name).time(time=datetime.utcnow()) \
-			.field("GrillTemp", float(PrimaryTemp)) \
-			.field('GrillSetPoint', float(PrimarySetpoint)) \
-			.field('GrillNotifyPoint', float(PrimaryNotify)) \
-			.field('Probe1Temp', float(Probe1Temp)) \
-			.field('Probe1SetPoint', float(Probe1Notify)) \
-			.field('Probe2Temp', float(Probe2Temp)) \
-			.field('Probe2SetPoint', float(Probe2Notify)) \
-			.field("Mode", str(get_or_default(control, "mode", 'unknown'))) \
-			.field('PelletLevel', int(get_or_default(get_or_default(pelletdb, 'current', {}), 'hopper_level', 100)))
+		def to_float(value):
+			return float(value) if isinstance(value, (int, float)) else None
+
+		probe_history = in_data['probe_history']
+		notify_targets = in_data.get('notify_targets', {})
+		fields = {}
+
+		# Legacy fields (first primary probe and the first two food probes)
+		primary_labels = list(probe_history['primary'].keys())
+		food_labels = list(probe_history.get('food', {}).keys())
+		if primary_labels:
+			fields['GrillTemp'] = to_float(probe_history['primary'][primary_labels[0]])
+			fields['GrillSetPoint'] = to_float(in_data['primary_setpoint'])
+			fields['GrillNotifyPoint'] = to_float(notify_targets.get(primary_labels[0], 0))
+		for index, label in enumerate(food_labels[:2]):
+			fields[f'Probe{index + 1}Temp'] = to_float(probe_history['food'][label])
+			fields[f'Probe{index + 1}SetPoint'] = to_float(notify_targets.get(label, 0))
+
+		# All probes (primary / food / aux) by label and the extended data
+		for group in ['primary', 'food', 'aux']:
+			for label, temp in probe_history.get(group, {}).items():
+				fields[f'Temp_{label}'] = to_float(temp)
+				if notify_targets.get(label):
+					fields[f'Target_{label}'] = to_float(notify_targets[label])
+		for key, value in in_data.get('ext_data', {}).items():
+			fields[f'EXD_{key}'] = to_float(value)
+
+		fields['Mode'] = str(get_or_default(control, 'mode', 'unknown'))
+		fields['PelletLevel'] = int(get_or_default(get_or_default(pelletdb, 'current', {}), 'hopper_level', 100))
 		if grill_platform is not None:
-			outputs = grill_platform.GetOutputStatus()
+			outputs = grill_platform.current
 			for key in outputs:
-				p = p.field(key, int(outputs[key]))
+				fields[key] = int(outputs[key])
 
 		if notifyevent and 'GRILL_STATE' != notifyevent:
-			p = p.field('Event', str(notifyevent))
+			fields['Event'] = str(notifyevent)
 
-		self.queue.append(p)
+		self.buffer.append(encode_line(name, fields, time.time_ns()))
+		if len(self.buffer) >= BATCH_SIZE:
+			self.wake.set()
 
 		self.last_updated = time.time()
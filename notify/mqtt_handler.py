@@ -18,9 +18,16 @@ import paho.mqtt.client as mqtt
 import json
 import logging
 import time
+import threading
 from socket import getfqdn
-from common import create_logger
+from common import create_logger, process_commands
+from common.redis_queue import RedisQueue
 import psutil
+
+OUTBOX_QUEUE = 'mqtt:outbox'	# Messages that couldn't be published yet (replayed on reconnect)
+OUTBOX_SIZE = 1000				# Maximum number of messages kept in the outbox (oldest are dropped)
+REPLAY_CHUNK = 100				# Messages replayed per read of the outbox
+COMMAND_INTERVAL = 1.0			# Seconds to collect (and coalesce) commands before they are sent to control
 #from common import write_control
 
 
@@ -37,12 +44,17 @@ class MqttNotificationHandler:
 
 		try:	
 			self.client = None				# Initialize to none so we can check its existance later
-			self.initialized_topics = []	# Topics that have already sent auto-discover data
-			self.last = {}					# Last published values so we can send by exception
+			self.initialized_topics = set()	# Topics that have already sent auto-discover data
+			self.last = {}					# Last published values of each context so we can send by exception
+			self.discovered = {}			# Devices of each context that have been checked for auto-discover
+			self.filters = {}				# Devices published for each context (None = all)
 			self.last_mode = None			# Last mode we were in
 			self.last_conn_time = 0			# Last time we tried to connect to the mqtt broker
 			self.subscriptions = []			# Topics we have subscribed to so we can be remotely controlled
 			self.control = None				# Link to the control structure so we can send controls to the Control app
+			self.commands = {}				# Pending commands {topic : payload}, only the latest payload of each topic is kept
+			self.commands_lock = threading.Lock()
+			self.commands_event = threading.Event()
 
 			# Keep track of the last time we published different types of MQTT data so that we can
 			# throttle our updates to the configured rate
@@ -70,6 +82,41 @@ class MqttNotificationHandler:
 			#self.LAST_NOTIFICATION = ['msg']
 			self.SYSTEM_SENSORS = ['cpu','available_memory','free_memory','cpu_temp']
 
+			# Command topics (<id>/command/<command>[/<arguments>]) and the set command of the API they map to
+			self.COMMANDS = {
+				'mode': 'mode',						# payload: smoke, hold/225, prime/10/startup, ...
+				'primary_setpoint': 'psp',			# payload: temperature
+				'psp': 'psp',
+				'notify': 'notify',					# <id>/command/notify/<label>/<req|target|shutdown|keep_warm>, payload: value
+				's_plus': 'splus',					# payload: true/false (or ON/OFF)
+				'splus': 'splus',
+			}
+
+			# Devices published for each context (None = all), contexts that aren't listed publish nothing
+			self.CONTEXT_FILTERS = {
+				'devices': frozenset(self.DEVICE_SENSORS),
+				'control': frozenset(self.CONTROL_SENSORS),
+				'pid_config': frozenset(self.PID_CONFIG_SENSORS),
+				'pid_cycle_data': frozenset(self.PID_CYCLE_TIME_SENSORS),
+				'pellet': frozenset(self.HOPPER_SENSORS),
+				'pid': frozenset(self.PID_SENSORS),
+				'control_notify_data': frozenset(self.CONTROL_NOTIFY_SENSORS),
+				'probe_data': None,
+				'notify_event': None,
+				'system': None,
+			}
+
+			# Outbox for messages published while the broker can't be reached (kept in Redis, so it survives a restart)
+			self.outbox = RedisQueue(OUTBOX_QUEUE)
+			self.outbox_lock = threading.Lock()
+			self.outbox_pending = self.outbox.length() > 0
+
+			# The outbox is replayed on its own thread (woken on connect), so neither the network loop nor 
+			# the threads publishing data are held up by a replay
+			self.replay_event = threading.Event()
+			replay_thread = threading.Thread(target=self._replay_thread, name='mqtt-replay', daemon=True)
+			replay_thread.start()
+
 			# Setup logging
 			log_level = logging.DEBUG if settings['globals']['debug_mode'] else logging.INFO
 			self._mqttLogger = create_logger('mqtt', filename='./logs/mqtt.log', level=log_level, 
@@ -94,6 +141,12 @@ class MqttNotificationHandler:
 				'enabled_by_default': True,
 				}
 			
+			# Accept commands if remote control is enabled (subscribed when connected)
+			if self._mqtt_settings.get('control', False):
+				self.subscriptions.append(f"{self._mqtt_settings['id']}/command/#")
+				command_thread = threading.Thread(target=self._command_thread, name='mqtt-commands', daemon=True)
+				command_thread.start()
+
 			# Connect to the broker
 			self._check_connection()
 						
@@ -102,7 +155,7 @@ class MqttNotificationHandler:
 
 	def __del__(self):
 		try:
-			self._publish_data(topic=f"{self._mqtt_settings['id']}/availability",payload="offline")
+			self._publish_data(topic=f"{self._mqtt_settings['id']}/availability",payload="offline", queue=False)
 			self.client.loop_stop()
 			self.client.disconnect()
 		except:
@@ -143,44 +196,68 @@ class MqttNotificationHandler:
 	def _on_connect(self, client, userdata, flags, rc, properties):
 		self._mqttLogger.info(f"Connection to '{self._mqtt_settings['broker']}' returned result: '{mqtt.connack_string(rc)}'")
 		self.last_conn_time = 0
-		self._publish_data(topic=f"{self._mqtt_settings['id']}/availability",payload="online", qos=1)
+		self.client.publish(f"{self._mqtt_settings['id']}/availability", "online", 1)
 
 		# Restore any subscriptions that we have
 		for sub in self.subscriptions:
 			self._subscribe(sub)
 
-	def _on_message(self, client, userdata, msg):
-		
-		# Ignore if we haven't finished intializing or haven't enabled control
-		#if self.control == None: return
-		#if self._mqtt_settings['control'] == False: return
-		
-		# element = msg.topic.split('/')[-1]
-		# payload = msg.payload.decode('utf-8')
-
-		# self._mqttLogger.debug(f"Recieved message {payload} for {element}")
-
-		# if element == "mode":
-		# 		# If going into Hold mode we need to set the setpoint as well.  Default to 150 if not set.
-		# 		if payload == 'Hold':
-		# 			self.control['primary_setpoint'] = max(self.control['primary_setpoint'], 150)
-
-		# 		self.control[element] = payload
-		# 		self.control['updated'] = 'yes'
-		# 		write_control(self.control, direct_write=False, origin='mqtt')
-
-		# 		#TODO when switching to HOLD mode we also need to send a setpoint
-
-		# elif element == "primary_setpoint":
-		# 		#Only adjust the setpoint if we are in Hold mode
-		# 		if (self.control['mode']) == 'Hold':
-		# 			self.control[element] = int(payload)
-		# 			self.control['updated'] = 'yes'
-		# 			write_control(self.control, direct_write=False, origin='mqtt')
+		# Send what was published while disconnected
+		if self.outbox_pending:
+			self.replay_event.set()
 
-		# 	else:
-		# 		pass
-		pass
+	def _on_message(self, client, userdata, msg):
+		""" Queue a command, replacing a pending command for the same topic (so a burst of i.e. setpoint 
+		changes results in a single control write) """
+		if not self._mqtt_settings.get('control', False): return
+
+		payload = msg.payload.decode('utf-8').strip()
+		self._mqttLogger.debug(f"Received command {payload} for {msg.topic}")
+		with self.commands_lock:
+			self.commands.pop(msg.topic, None)
+			self.commands[msg.topic] = payload
+		self.commands_event.set()
+
+	def _command_thread(self):
+		while True:
+			self.commands_event.wait()
+			# Collect the commands sent within the interval, this also limits control writes to one batch per interval
+			time.sleep(COMMAND_INTERVAL)
+			with self.commands_lock:
+				commands = self.commands
+				self.commands = {}
+				self.commands_event.clear()
+
+			# The whole batch (i.e. mode and set point) is applied to the control data with a single write
+			batch = []
+			for topic, payload in commands.items():
+				arglist = self._command_arglist(topic, payload)
+				if arglist is not None:
+					batch.append((topic, payload, arglist))
+			try:
+				results = process_commands([('set', arglist) for topic, payload, arglist in batch], origin='mqtt')
+			except:
+				self._mqttLogger.exception(f'Error processing commands {commands}: ')
+				continue
+
+			for (topic, payload, arglist), data in zip(batch, results):
+				if data['result'] != 'OK':
+					self._mqttLogger.error(f"Command {payload} for {topic} failed: {data['message']}")
+				self._publish_data(topic=f"{self._mqtt_settings['id']}/command_result", 
+							 payload=json.dumps({'topic': topic, 'payload': payload, 'result': data['result'], 'message': data['message']}), queue=False)
+
+	def _command_arglist(self, topic, payload):
+		# <id>/command/<command>[/<arguments>], the payload is the last argument
+		elements = topic.split('/')[2:]
+		if len(elements) == 0 or elements[0] not in self.COMMANDS:
+			self._mqttLogger.error(f"Unknown command topic {topic}")
+			return None
+
+		if payload.lower() in ['on', 'off', 'true', 'false']:
+			payload = 'true' if payload.lower() in ['on', 'true'] else 'false'
+		elif elements[0] == 'mode':
+			payload = payload.lower()
+		return [self.COMMANDS[elements[0]]] + elements[1:] + payload.split('/')
 
 	def _on_disconnect(self, client, userdata, rc, properties):
 		if rc != 0:
@@ -207,12 +284,26 @@ class MqttNotificationHandler:
 	def _check_homeassistant(self):
 		return len(self._mqtt_settings['homeassistant_autodiscovery_topic']) > 0
 
-	def _publish_data(self, topic, payload, qos=0, retain=False, properties=None):
-
-		if not self._check_connection(): 
-			return False
-
-		ret= self.client.publish(topic, payload, qos, retain, properties)
+	def _publish_data(self, topic, payload, qos=0, retain=False, properties=None, queue=True):
+		""" Publish a message, or add it to the outbox if the broker can't be reached (queue=True).
+		Returns True if published or queued.
+		"""
+		with self.outbox_lock:
+			connected = self._check_connection()
+			# While the outbox is waiting to be replayed, add to it, so newer messages don't get overtaken by older ones
+			if connected and self.outbox_pending and queue:
+				self._queue_message(topic, payload, qos, retain)
+				self.replay_event.set()
+				return True
+			if not connected:
+				if queue:
+					self._queue_message(topic, payload, qos, retain)
+				return queue
+
+			ret= self.client.publish(topic, payload, qos, retain, properties)
+			if ret.rc in (mqtt.MQTT_ERR_NO_CONN, mqtt.MQTT_ERR_CONN_LOST) and queue:
+				self._queue_message(topic, payload, qos, retain)
+				return True
 
 		# Check the return
 		if ret.rc == mqtt.MQTT_ERR_SUCCESS:
@@ -227,14 +318,80 @@ class MqttNotificationHandler:
 			self._mqttLogger.error(f"Cannot publish data for {topic} because of error {mqtt.connack_string(ret.rc)}")
 			return False
 			
+	def _queue_message(self, topic, payload, qos, retain):
+		self.outbox.push({'topic': topic, 'payload': payload, 'qos': qos, 'retain': retain})
+		self.outbox.redis_db.ltrim(OUTBOX_QUEUE, -OUTBOX_SIZE, -1)
+		self.outbox_pending = True
+
+	def _replay_thread(self):
+		while True:
+			self.replay_event.wait()
+			self.replay_event.clear()
+			try:
+				self._replay_outbox()
+			except:
+				self._mqttLogger.exception(f'Error occurred replaying the queued messages: ')
+
+	def _replay_outbox(self):
+		""" Publish the outbox in order, REPLAY_CHUNK messages at a time, so subscribers get every sample 
+		taken while the broker was unreachable (up to OUTBOX_SIZE).  Every message is replayed with its own 
+		QoS, QoS 0 state messages included, since skipping all but the latest one would leave gaps in the 
+		graphs (i.e. Home Assistant).  The messages of a chunk are removed from the outbox once published, 
+		in the same pipelined call that reads the next chunk, so nothing is lost if the replay is interrupted.
+		Returns False if the connection was lost while replaying (the rest stays in the outbox).
+		"""
+		replayed = 0
+		published = 0
+		while True:
+			with self.outbox_lock:
+				if self.client is None or not self.client.is_connected():
+					self.outbox.redis_db.ltrim(OUTBOX_QUEUE, published, -1)
+					return False
+
+				pipe = self.outbox.redis_db.pipeline()
+				pipe.ltrim(OUTBOX_QUEUE, published, -1)
+				pipe.lrange(OUTBOX_QUEUE, 0, REPLAY_CHUNK - 1)
+				_, messages = pipe.execute()
+				if not messages:
+					self.outbox_pending = False
+					break
+
+				published = 0
+				for message in messages:
+					message = json.loads(message)
+					ret = self.client.publish(message['topic'], message['payload'], message['qos'], message['retain'])
+					if ret.rc != mqtt.MQTT_ERR_SUCCESS:
+						break
+					published += 1
+				replayed += published
+
+				if published < len(messages):
+					self.outbox.redis_db.ltrim(OUTBOX_QUEUE, published, -1)
+					self._mqttLogger.error(f"Replayed {replayed} queued messages before the connection was lost.")
+					return False
+
+		if replayed:
+			self._mqttLogger.info(f"Replayed {replayed} queued messages.")
+		return True
+
+	def _context_filter(self, context):
+		""" Devices published for the context (None = all), looked up once per context """
+		if context not in self.filters:
+			if context.startswith('control_notify_data'):
+				self.filters[context] = self.CONTEXT_FILTERS['control_notify_data']
+			elif context.startswith('probe_data'):
+				self.filters[context] = self.CONTEXT_FILTERS['probe_data']
+			else:
+				self.filters[context] = self.CONTEXT_FILTERS.get(context, frozenset())
+		return self.filters[context]
+
 	def _publish_autodiscover(self, category, topic, payload, qos=2, retain=True, properties=None):
 
 		ret= self.client.publish(topic, payload, qos, retain, properties)
 
 		# Check the return
 		if ret.rc == mqtt.MQTT_ERR_SUCCESS:
-			if not category in self.initialized_topics:
-				self.initialized_topics.append(category)
+			self.initialized_topics.add(category)
 		elif ret.rc == mqtt.MQTT_ERR_CONN_LOST:
 			self._mqttLogger.error(f"Cannot publish autodiscover data for {topic} because the mqtt connection is lost.")
 		else:
@@ -243,35 +400,24 @@ class MqttNotificationHandler:
 	def _publish(self, context, data):
 
 		# Extract the supported attributes and verify there is a change
+		allowed = self._context_filter(context)
+		last = self.last.setdefault(context, {})
 		change_detected = False
 		payload = {}
-		for device in data:		
-			if (context == 'devices' and device in self.DEVICE_SENSORS) or \
-			   (context == 'control' and device in self.CONTROL_SENSORS) or \
-			   (context == 'pid_config' and device in self.PID_CONFIG_SENSORS) or \
-			   (context == 'pid_cycle_data' and device in self.PID_CYCLE_TIME_SENSORS) or \
-			   (context == 'pellet') and device in self.HOPPER_SENSORS or \
-			   (context == 'pid' and device in self.PID_SENSORS) or \
-			   (context == 'notify_event') or \
-			   (context == 'system') or \
-			   (context.startswith('control_notify_data') and device in self.CONTROL_NOTIFY_SENSORS) or \
-			   (context.startswith("probe_data")):
-
-				device_name = context + '_' + device
-				last_val = self.last.get(device_name)
-				payload[device] = data[device]
-				new_val = data[device]
-				if new_val != last_val:
-					change_detected = True
-					self.last[device_name] = new_val
-
-		if not change_detected: return
-		
-		if self._publish_data(topic=f"{self._mqtt_settings['id']}/{context}", payload=json.dumps(payload)):
-
-			# Publish home assitant auto-discovery info
-			if self._check_homeassistant:
-				self._create_autodiscover(context, data)
+		for device, new_val in data.items():
+			if allowed is not None and device not in allowed:
+				continue
+			payload[device] = new_val
+			if device not in last or new_val != last[device]:
+				change_detected = True
+				last[device] = new_val
+
+		if change_detected:
+			self._publish_data(topic=f"{self._mqtt_settings['id']}/{context}", payload=json.dumps(payload))
+
+		# Publish home assitant auto-discovery info (once per device, also for devices first seen while disconnected)
+		if self._check_homeassistant() and self.client is not None and self.client.is_connected():
+			self._create_autodiscover(context, data)
 	
 	def _subscribe(self,topic):
 		self.client.subscribe(topic)
@@ -279,110 +425,114 @@ class MqttNotificationHandler:
 			self.subscriptions.append(topic)
 
 	def _create_autodiscover(self, context, data):
+		last = self.last.get(context, {})
+		discovered = self.discovered.setdefault(context, set())
 		for device in data:
+			if device in discovered or device not in last:
+				continue
+			discovered.add(device)
 			device_name = context + '_' + device
 			topic_name = device_name
-			if device_name in self.last:
-				if not device_name in set(self.initialized_topics):
-
-					discovery = self.default_payload.copy()
-					discovery['state_topic'] = f"{self.pifire_id}/{context}"
-					discovery['object_id'] = f"{self.pifire_id}_{device_name}".lower()
-					discovery['unique_id'] = f"{self.pifire_id}_{device_name}".lower()
-					discovery['value_template'] = f"{{{{ value_json.{device} }}}}"
-					discovery['name'] = device.title().replace('_',' ')	
-
-					datatype = type(data[device])			
-
-					if datatype == bool:
-						component = "binary_sensor"
-						discovery['payload_on'] = True
-						discovery['payload_off'] = False
-						
-						if device not in {'auger','igniter','power','fan'}:
-							discovery['enabled_by_default'] = False
-
-					elif datatype == str:
-						component = "sensor"
-
-					elif datatype == int or datatype == float:
-						component = "sensor"
-						discovery['state_class'] = "measurement"
-
-						if context in ['probe_data_primary', 'probe_data_food','probe_data_aux']:
-							discovery['device_class'] = "temperature"
-							discovery['unit_of_measurement'] = f"°{self._global_settings['units']}"
-							suffix = 'Temp'
-
-						elif context == 'probe_data_tr':
-							discovery['unit_of_measurement'] = "ohms"
-							discovery['enabled_by_default'] = False
-							discovery['entity_category'] = "diagnostic"
-							suffix = 'RTD Ohms'
-
-						elif context.startswith('probe_data'):
-							# Find this probes name in the settings
-							for probe in self._probe_settings:
-								if probe['label'] == device:
-									discovery['name'] = f"{discovery['name']} {suffix}"
-									topic_name = context + '_' + probe['port']
-									break
-
-						elif context.startswith('control_notify'):
-							discovery['device_class'] = "temperature"
-							discovery['unit_of_measurement'] = f"°{self._global_settings['units']}"
-							suffix = 'Target'
-							for probe in self._probe_settings:
-								if probe['label'] == data['label']:
-									discovery['name'] = f"{data['name']} {suffix}"
-									topic_name = context
-									break
-
-						elif context.startswith('pid'):
-							discovery['entity_category'] = "diagnostic"
-							discovery['enabled_by_default'] = False
-						
-						if device in ['u_min','u_max','center','p','i','d','u','cycle_ratio']:
-							discovery['unit_of_measurement'] = "%"
-							discovery['enabled_by_default'] = False
-							discovery['value_template'] = f"{{{{ value_json.{device} | round(2)}}}}"
-
-						elif device in ['available_memory', 'free_memory']:
-								discovery['unit_of_measurement'] = "b"
-
-						elif device in ['duty_cycle', 'hopper_level','cpu']:
-							discovery['unit_of_measurement'] = "%"
-
-						elif device in ['PB', 'Td', 'Ti', 'HoldCycleTime', 'LidOpenPauseTime']:
-							discovery['unit_of_measurement'] = "s"
-							discovery['enabled_by_default'] = False
-
-						elif device == 'cpu_temp':
-							discovery['device_class'] = "temperature"
-							discovery['unit_of_measurement'] = "°C"
-
-						elif device in ['primary_setpoint']:
-							discovery['device_class'] = "temperature"
-							discovery['unit_of_measurement'] = f"°{self._global_settings['units']}"
-
-							#if self._mqtt_settings['control']:
-								#component = "number"
-
-								# Make setpoint subscribeable and subscribe to it
-								#discovery['command_topic'] = f"{discovery['state_topic']}/set/{device}"
-								#discovery['min'] = 100
-								#discovery['max'] = 700
-								#discovery['mode'] = 'auto'
-								#discovery['optimistic'] = 'false'
-								#discovery['step'] = 1
-								#self._subscribe(discovery['command_topic'])
-							
-					self._publish_autodiscover(
-									device, 
-									f"{self.discovery_topic}/{component}/{self.pifire_id}/{topic_name}/config", 
-									json.dumps(discovery))
+			if not device_name in self.initialized_topics:
+
+				discovery = self.default_payload.copy()
+				discovery['state_topic'] = f"{self.pifire_id}/{context}"
+				discovery['object_id'] = f"{self.pifire_id}_{device_name}".lower()
+				discovery['unique_id'] = f"{self.pifire_id}_{device_name}".lower()
+				discovery['value_template'] = f"{{{{ value_json.{device} }}}}"
+				discovery['name'] = device.title().replace('_',' ')	
+
+				datatype = type(data[device])			
+
+				if datatype == bool:
+					component = "binary_sensor"
+					discovery['payload_on'] = True
+					discovery['payload_off'] = False
+					
+					if device not in {'auger','igniter','power','fan'}:
+						discovery['enabled_by_default'] = False
+
+				elif datatype == str:
+					component = "sensor"
+
+				elif datatype == int or datatype == float:
+					component = "sensor"
+					discovery['state_class'] = "measurement"
+
+					if context in ['probe_data_primary', 'probe_data_food','probe_data_aux']:
+						discovery['device_class'] = "temperature"
+						discovery['unit_of_measurement'] = f"°{self._global_settings['units']}"
+						suffix = 'Temp'
+
+					elif context == 'probe_data_tr':
+						discovery['unit_of_measurement'] = "ohms"
+						discovery['enabled_by_default'] = False
+						discovery['entity_category'] = "diagnostic"
+						suffix = 'RTD Ohms'
+
+					elif context.startswith('probe_data'):
+						# Find this probes name in the settings
+						for probe in self._probe_settings:
+							if probe['label'] == device:
+								discovery['name'] = f"{discovery['name']} {suffix}"
+								topic_name = context + '_' + probe['port']
+								break
+
+					elif context.startswith('control_notify'):
+						discovery['device_class'] = "temperature"
+						discovery['unit_of_measurement'] = f"°{self._global_settings['units']}"
+						suffix = 'Target'
+						for probe in self._probe_settings:
+							if probe['label'] == data['label']:
+								discovery['name'] = f"{data['name']} {suffix}"
+								topic_name = context
+								break
+
+					elif context.startswith('pid'):
+						discovery['entity_category'] = "diagnostic"
+						discovery['enabled_by_default'] = False
 					
-					self.initialized_topics.append(device_name)
+					if device in ['u_min','u_max','center','p','i','d','u','cycle_ratio']:
+						discovery['unit_of_measurement'] = "%"
+						discovery['enabled_by_default'] = False
+						discovery['value_template'] = f"{{{{ value_json.{device} | round(2)}}}}"
+
+					elif device in ['available_memory', 'free_memory']:
+							discovery['unit_of_measurement'] = "b"
+
+					elif device in ['duty_cycle', 'hopper_level','cpu']:
+						discovery['unit_of_measurement'] = "%"
+
+					elif device in ['PB', 'Td', 'Ti', 'HoldCycleTime', 'LidOpenPauseTime']:
+						discovery['unit_of_measurement'] = "s"
+						discovery['enabled_by_default'] = False
+
+					elif device == 'cpu_temp':
+						discovery['device_class'] = "temperature"
+						discovery['unit_of_measurement'] = "°C"
+
+					elif device in ['primary_setpoint']:
+						discovery['device_class'] = "temperature"
+						discovery['unit_of_measurement'] = f"°{self._global_settings['units']}"
+
+						#if self._mqtt_settings['control']:
+							#component = "number"
+
+							# Make setpoint subscribeable and subscribe to it
+							#discovery['command_topic'] = f"{discovery['state_topic']}/set/{device}"
+							#discovery['min'] = 100
+							#discovery['max'] = 700
+							#discovery['mode'] = 'auto'
+							#discovery['optimistic'] = 'false'
+							#discovery['step'] = 1
+							#self._subscribe(discovery['command_topic'])
+						
+				self._publish_autodiscover(
+								device, 
+								f"{self.discovery_topic}/{component}/{self.pifire_id}/{topic_name}/config", 
+								json.dumps(discovery))
+				
+				self.initialized_topics.add(device_name)
 
 	def notify(self, context: str, data: dict):
 		""" Publish changed data to the mqtt broker
@@ -18,12 +18,21 @@ Description: This library provides notification functions for
 '''
 import datetime
 import time
-import requests
 import json
 import apprise
 import logging
-import math
-from common import write_settings, write_control, create_logger, read_history, read_settings, read_control, read_pellet_db
+import threading
+from common import write_settings, write_control, create_logger, read_settings, read_control, read_pellet_db
+from notify.dispatcher import NotificationDispatcher
+from notify.http_session import get_session
+
+'''
+==============================================================================
+ Globals
+==============================================================================
+'''
+dispatcher = None  # Delivers the notifications in the background (created on first use)
+_handler_lock = threading.Lock()  # Creation of the shared MQTT / WLED handlers (used by the dispatcher threads)
 
 '''
 ==============================================================================
@@ -32,7 +41,7 @@ from common import write_settings, write_control, create_logger, read_history, r
 '''
 
 
-def check_notify(settings, control, in_data=None, pelletdb=None, grill_platform=None, pid_data=None, update_eta=False):
+def check_notify(settings, control, in_data=None, pelletdb=None, grill_platform=None, pid_data=None, update_eta=False, eta_estimator=None):
 	"""
 	Check for any pending notifications
 
@@ -41,6 +50,8 @@ def check_notify(settings, control, in_data=None, pelletdb=None, grill_platform=
 	:param settings: Settings
 	:param pelletdb: Pellet DB
 	:param grill_platform: Grill Platform
+	:param update_eta: Update the ETA of the pending probe notifications
+	:param eta_estimator: ETAEstimator fed with the probe readings (required to update the ETA)
 	"""
 	# Forward to mqtt if enabled.
 	if settings['notify_services'].get('mqtt') != None and \
@@ -55,7 +66,8 @@ def check_notify(settings, control, in_data=None, pelletdb=None, grill_platform=
 		_send_influxdb_notification('GRILL_STATE', control, settings, pelletdb, in_data, grill_platform)
 
 	if settings['notify_services']['wled']['device_address'] != '' and settings['notify_services']['wled']['enabled']:
-		_send_wled_notification('GRILL_STATE', control, settings)
+		# Skip the update if the previous one is still pending
+		_get_dispatcher().dispatch('wled', _send_wled_notification, ('GRILL_STATE', control.copy(), settings), dedup_key='GRILL_STATE', dedup_window=0, retry=False)
 
 	''' Get simple list of temperatures key:value pairs '''
 	probe_temp_list = {}
@@ -70,23 +82,8 @@ def check_notify(settings, control, in_data=None, pelletdb=None, grill_platform=
 		if item['req']: 
 			if item['type'] in ['probe', 'probe_limit_low', 'probe_limit_high'] and in_data is not None:
 				# Update the ETA, if requested for any active probe
-				if item['type'] == 'probe' and update_eta:
-					num_minutes = 20  # Number of minutes of history to grab
-					num_seconds = num_minutes * 60 
-					time_interval = 3  # 3-Second Time Intervals
-					# Get temperature history for this probe 
-					temperatures = []
-					history = read_history(num_items=(num_seconds // time_interval))
-					for datapoint in history:
-						if item['label'] in datapoint['F']:
-							temperatures.append(datapoint['F'][item['label']])
-						elif item['label'] in datapoint['P']:
-							temperatures.append(datapoint['P'][item['label']])
-					# Call extrapolate ETA
-					#print(f'DEBUG: ETA: Interpolating {item["name"]}')
-					eta_seconds = _estimate_eta(temperatures, item['target'], interval_seconds=time_interval, max_history_minutes=num_minutes)
-					# Write to control
-					control['notify_data'][index]['eta'] = eta_seconds
+				if item['type'] == 'probe' and update_eta and eta_estimator is not None:
+					control['notify_data'][index]['eta'] = eta_estimator.eta(item['label'], item['target'])
 				# If target temperature meets the condition, send notification and clear request/data
 				if _check_condition(item['condition'], probe_temp_list[item['label']], item['target']):
 					if item['type'] == 'probe':
@@ -146,9 +143,26 @@ def check_notify(settings, control, in_data=None, pelletdb=None, grill_platform=
 
 	return control
 
+def _get_dispatcher():
+	global dispatcher
+	if dispatcher is None:
+		dispatcher = NotificationDispatcher()
+	return dispatcher
+
+def flush_notifications(timeout=30):
+	"""
+	Wait for the queued notifications to be delivered (i.e. before the process is stopped)
+
+	:param timeout: Maximum seconds to wait
+	"""
+	if dispatcher is not None:
+		return dispatcher.flush(timeout)
+	return True
+
 def send_notifications(notify_event, label='Probe', target=0):
 	"""
-	Build and send notification based on notify_event and write to log.
+	Build notification based on notify_event, write to log and queue it for delivery.  The services 
+	are called by the dispatcher in the background, so this returns without waiting for them.  
 
 	:param notify_event: String Event
 	:param label: Label
@@ -250,22 +264,25 @@ def send_notifications(notify_event, label='Probe', target=0):
 		query_args = {"value1": 'Unknown Notification issue'}
 		eventLogger.error(body_message)
 
+	# Queue the notification for each enabled service (duplicates of the same message are dropped)
+	dedup_key = f'{notify_event}:{title_message}:{body_message}'
+	dispatch = _get_dispatcher().dispatch
 	if settings['notify_services']['apprise']['locations'] != '' and settings['notify_services']['apprise']['enabled']:
-		_send_apprise_notifications(settings, title_message, body_message)
+		dispatch('apprise', _send_apprise_notifications, (settings, title_message, body_message), dedup_key=dedup_key)
 	if settings['notify_services']['ifttt']['APIKey'] != '' and settings['notify_services']['ifttt']['enabled']:
-		_send_ifttt_notification(settings, notify_event, query_args)
+		dispatch('ifttt', _send_ifttt_notification, (settings, notify_event, query_args), dedup_key=dedup_key)
 	if settings['notify_services']['pushbullet']['APIKey'] != '' and settings['notify_services']['pushbullet']['enabled']:
-		_send_pushbullet_notification(settings, title_message, body_message)
+		dispatch('pushbullet', _send_pushbullet_notification, (settings, title_message, body_message), dedup_key=dedup_key)
 	if settings['notify_services']['pushover']['APIKey'] != '' and settings['notify_services']['pushover']['UserKeys'] != '' \
 		and settings['notify_services']['pushover']['enabled']:
-		_send_pushover_notification(settings, title_message, body_message)
+		dispatch('pushover', _send_pushover_notification, (settings, title_message, body_message), dedup_key=dedup_key)
 	if settings['notify_services']['onesignal']['app_id'] != '' and settings['notify_services']['onesignal']['enabled']:
-		_send_onesignal_notification(settings, title_message, body_message, channel)
+		dispatch('onesignal', _send_onesignal_notification, (settings, title_message, body_message, channel), dedup_key=dedup_key)
 	if settings['notify_services']['mqtt']['broker'] != '' and settings['notify_services']['mqtt']['enabled']:
 		control = read_control()
-		_send_mqtt_notification(control, settings, notify_event=title_message)
+		dispatch('mqtt', _send_mqtt_notification, (control, settings), {'notify_event' : title_message}, dedup_key=dedup_key)
 	if settings['notify_services']['wled']['device_address'] != '' and settings['notify_services']['wled']['enabled']:
-		_send_wled_notification(notify_event, control, settings)
+		dispatch('wled', _send_wled_notification, (notify_event, control, settings), dedup_key=dedup_key)
 
 def _send_apprise_notifications(settings, title_message, body_message):
 	"""
@@ -288,8 +305,10 @@ def _send_apprise_notifications(settings, title_message, body_message):
 			title=title_message,
 			body=body_message,
 		)
+		return result
 	else:
 		eventLogger.warning("No Apprise Locations Configured")
+		return True  # Nothing to retry
 
 def _send_pushover_notification(settings, title_message, body_message):
 	"""
@@ -325,11 +344,13 @@ def _send_pushover_notification(settings, title_message, body_message):
 			eventLogger.debug(f"Pushover Notification to {user} was a success!")
 		else:
 			eventLogger.warning(f"Pushover Notification to {user} failed!")
+		return result
 
 	except Exception as e:
 		eventLogger.warning(f"Pushover Notification to {user} failed: {e}")
 	except:
 		eventLogger.warning(f"Pushover Notification to {user} failed for unknown reason.")
+	return False
 
 
 def _send_pushbullet_notification(settings, title_message, body_message):
@@ -365,11 +386,13 @@ def _send_pushbullet_notification(settings, title_message, body_message):
 			eventLogger.debug(f'Push Bullet Notification to {api_key} was a success!')
 		else:
 			eventLogger.warning(f'Push Bullet Notification to {api_key} failed!')
+		return result
 
 	except Exception as e:
 		eventLogger.warning(f'Push Bullet Notification to {api_key} failed: {e}')
 	except:
 		eventLogger.warning(f'Push Bullet Notification to {api_key} failed for unknown reason.')
+	return False
 
 
 def _send_onesignal_notification(settings, title_message, body_message, channel):
@@ -402,7 +425,7 @@ def _send_onesignal_notification(settings, title_message, body_message, channel)
 				   "ttl" : 3600 }
 
 		try:
-			response = requests.post(url, headers=headers, data=json.dumps(payload))
+			response = get_session('onesignal').post(url, headers=headers, data=json.dumps(payload), timeout=10)
 
 			if not response.status_code == 200:
 				eventLogger.warning("OneSignal Notification Failed: " + title_message)
@@ -419,12 +442,16 @@ def _send_onesignal_notification(settings, title_message, body_message, channel)
 							settings['onesignal']['devices'].pop(device)
 							write_settings(settings)
 
+			return response.status_code == 200
+
 		except Exception as e:
 			eventLogger.warning("OneSignal Notification failed: %s" % (e))
 		except:
 			eventLogger.warning("OneSignal Notification failed for unknown reason.")
+		return False
 	else:
 		eventLogger.warning("OneSignal Notification Failed No Devices Registered")
+		return True  # Nothing to retry
 
 
 def _send_ifttt_notification(settings, notify_event, query_args):
@@ -441,10 +468,12 @@ def _send_ifttt_notification(settings, notify_event, query_args):
 	url = 'https://maker.ifttt.com/trigger/' + notify_event + '/with/key/' + key
 
 	try:
-		r = requests.post(url, data=query_args)
+		r = get_session('ifttt').post(url, data=query_args, timeout=10)
 		eventLogger.info("IFTTT Notification Success: " + r.text)
+		return r.ok
 	except:
 		eventLogger.warning("IFTTT Notification Failed: " + url)
+		return False
 
 
 influx_handler = None
@@ -466,133 +495,6 @@ def _send_influxdb_notification(notify_event, control, settings, pelletdb, in_da
 		influx_handler = InfluxNotificationHandler(settings)
 	influx_handler.notify(notify_event, control, settings, pelletdb, in_data, grill_platform)
 
-def _smooth_temperatures(temperatures, window_size=3):
-	"""
-	Apply a simple moving average smoothing to the temperature data.
-	
-	Args:
-		temperatures: List of temperature readings
-		window_size: Size of the moving average window
-		
-	Returns:
-		List of smoothed temperature values
-	"""
-	if len(temperatures) < window_size:
-		return temperatures[:]
-		
-	smoothed = []
-	
-	# Keep first few points unchanged
-	for i in range(window_size // 2):
-		smoothed.append(temperatures[i])
-		
-	# Apply moving average
-	for i in range(window_size // 2, len(temperatures) - window_size // 2):
-		window = temperatures[i - window_size // 2:i + window_size // 2 + 1]
-		smoothed.append(sum(window) / len(window))
-		
-	# Keep last few points unchanged
-	for i in range(len(temperatures) - window_size // 2, len(temperatures)):
-		smoothed.append(temperatures[i])
-		
-	return smoothed
-
-def _estimate_eta(temperatures, target_temperature, interval_seconds=3, max_history_minutes=5, min_history_minutes=1):
-	"""
-	Estimates the ETA (Estimated Time of Arrival) for the food probe to reach a specific target temperature using 
-	a simple linear regression implementation with smoothing and weighted regression.
-
-	Args:
-		temperatures: A list of temperatures measured by the food probe over time.
-		target_temperature: The desired target temperature.  Value should be larger than the temperatures in the list.
-		interval_seconds: Time between temperature readings.  Value between 1 and 60. 
-		max_history_minutes:  Maximum minutes of history to use for calculating ETA 
-		min_history_minutes:  Minimum minutes of history to use for calculating ETA 
-
-	Returns:
-		The estimated time (in seconds) it will take for the food probe to reach the target temperature.
-		None if the target temperature is already reached or the probe data is insufficient.
-	"""
-	eventLogger = create_logger('events', filename='./logs/events.log')
-
-	# Ensure target temperature is not already reached
-	if target_temperature <= max(temperatures):
-		eventLogger.debug(f'ETA: Target temperature already achieved.')
-		return None
-
-	# Ensure that interval is between 1 and 60 seconds 
-	if interval_seconds > 60 or interval_seconds < 1:
-		eventLogger.debug(f'ETA: History data interval not between 1 and 60 seconds.')
-		return None
-
-	# Convert minutes to seconds
-	max_data_points = int(max_history_minutes * 60 / interval_seconds)
-	min_data_points = int(min_history_minutes * 60 / interval_seconds)
-
-	# Check if enough data points provided
-	if len(temperatures) < min_data_points:
-		eventLogger.debug(f'ETA: Not enough history data to make estimate.')
-		return None
-
-	# Truncate data to fit within limits
-	temperatures = temperatures[-max_data_points:]
-
-	try:
-		# Apply smoothing to reduce impact of fluctuations
-		smoothed_temps = _smooth_temperatures(temperatures, window_size=5)
-		
-		# Prepare for weighted linear regression
-		n = len(smoothed_temps)
-		x_values = list(range(n))
-		
-		# Create weights that emphasize more recent readings
-		# Exponential weighting - newer readings get more weight
-		weights = [math.exp(i/10) for i in range(n)]
-		weight_sum = sum(weights)
-		weights = [w / weight_sum for w in weights]  # Normalize weights
-		
-		# Calculate weighted means
-		mean_x = sum(x * w for x, w in zip(x_values, weights))
-		mean_y = sum(y * w for y, w in zip(smoothed_temps, weights))
-		
-		# Calculate weighted slope (m) and intercept (b) for y = mx + b
-		numerator = sum(w * (x - mean_x) * (y - mean_y) for x, y, w in zip(x_values, smoothed_temps, weights))
-		denominator = sum(w * (x - mean_x) ** 2 for x, w in zip(x_values, weights))
-		
-		# Avoid division by zero
-		if denominator == 0:
-			eventLogger.debug(f'ETA: Cannot calculate slope - no temperature change detected.')
-			return None
-			
-		slope = numerator / denominator
-		intercept = mean_y - slope * mean_x
-		
-		# If temperature isn't rising (or is falling), we can't predict ETA
-		if slope <= 0:
-			eventLogger.debug(f'ETA: Temperature not increasing, cannot estimate ETA.')
-			return None
-		
-		# Predict time to reach target temperature (assuming linear trend)
-		# Formula: (target - current) / rate_of_change
-		current_temp = smoothed_temps[-1]  # Use the smoothed temperature
-		predicted_time = (target_temperature - current_temp) / slope * interval_seconds
-		
-		# Log some debug information about the calculation
-		eventLogger.debug(f'ETA: Using smoothed temp: current={current_temp}, slope={slope:.4f}, predicted={predicted_time:.1f}s')
-		
-		# Ensure positive prediction
-		if predicted_time < 0:
-			eventLogger.debug(f'ETA: Estimated time is negative. [{predicted_time}]')
-			return None
-		if math.isinf(predicted_time) or math.isnan(predicted_time):
-			eventLogger.debug(f'ETA: Estimated time is infinite or NaN. [{predicted_time}]')
-			return None
-			
-		return int(predicted_time)
-	except Exception as e:
-		eventLogger.debug(f'ETA: Error calculating ETA: {str(e)}')
-		return None
-
 mqtt = None
 def _send_mqtt_notification(control, settings, 
 			pelletdb=None, in_data=None, grill_platform=None, pid_data=None, notify_event=None):
@@ -609,9 +511,10 @@ def _send_mqtt_notification(control, settings,
 	"""
 	global mqtt
 	
-	if not mqtt:
-		from notify.mqtt_handler import MqttNotificationHandler
-		mqtt = MqttNotificationHandler(settings)
+	with _handler_lock:
+		if not mqtt:
+			from notify.mqtt_handler import MqttNotificationHandler
+			mqtt = MqttNotificationHandler(settings)
 
 	# Send a notify_event immidiately
 	if notify_event != None:
@@ -676,7 +579,8 @@ def _send_wled_notification(notify_event, control, settings):
 	:param grill_platform: Grill Platform
 	"""
 	global wled_handler
-	if not wled_handler:
-		from notify.wled_handler import WLEDNotificationHandler
-		wled_handler = WLEDNotificationHandler(settings)
+	with _handler_lock:
+		if not wled_handler:
+			from notify.wled_handler import WLEDNotificationHandler
+			wled_handler = WLEDNotificationHandler(settings)
 	wled_handler.notify(notify_event, control, settings)
\ No newline at end of file
@@ -49,6 +49,7 @@ Required settings format:
 """
 import time
 import requests
+from notify.http_session import get_session
 from notify.wled_profiles import WLEDProfileManager, WLED_COLORS, WLED_EFFECTS
 
 class WLEDNotificationHandler:
@@ -149,7 +150,7 @@ class WLEDNotificationHandler:
         """
         url = f"http://{self.device_address}/json/info"
         try:
-            response = requests.get(url)
+            response = get_session('wled').get(url)
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
@@ -180,7 +181,7 @@ class WLEDNotificationHandler:
             "ps": preset
         }
         try:
-            response = requests.post(url, json=payload, timeout=5)
+            response = get_session('wled').post(url, json=payload, timeout=5)
             response.raise_for_status()
             self.logger.info(f"WLED preset {preset} activated successfully")
         except requests.RequestException as e:
@@ -247,7 +248,7 @@ class WLEDNotificationHandler:
             payload["seg"] = [seg_config]
         
         try:
-            response = requests.post(url, json=payload)
+            response = get_session('wled').post(url, json=payload)
             response.raise_for_status()
             self.logger.info(f"Direct WLED command sent successfully to {self.device_address}")
             self.logger.info(f"Payload: {payload}")
@@ -21,6 +21,7 @@ Profile Mapping:
 """
 
 import requests
+from notify.http_session import get_session
 import json
 import time
 
@@ -328,7 +329,7 @@ class WLEDProfileManager:
         """Get WLED device information."""
         url = f"http://{self.device_address}/json/info"
         try:
-            response = requests.get(url, timeout=5)
+            response = get_session('wled').get(url, timeout=5)
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
@@ -348,7 +349,7 @@ class WLEDProfileManager:
         payload["sb"] = True  # Include segments in preset
         
         try:
-            response = requests.post(url, json=payload, timeout=10)
+            response = get_session('wled').post(url, json=payload, timeout=10)
             response.raise_for_status()
             
             self.logger.info(f"Created WLED preset {preset_number}: {profile_data.get('name', 'Unnamed')}")
@@ -425,7 +426,7 @@ class WLEDProfileManager:
         payload = {"pdel": preset_number}
         
         try:
-            response = requests.post(url, json=payload, timeout=5)
+            response = get_session('wled').post(url, json=payload, timeout=5)
             response.raise_for_status()
             self.logger.info(f"Deleted WLED preset {preset_number}")
             return True
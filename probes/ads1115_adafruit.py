@@ -20,7 +20,8 @@ Description:
             	'ADC2_rd': '10000',
             	'ADC3_rd': '10000',
             	'i2c_bus_addr': '0x48',
-            	'voltage_ref': '3.28'
+            	'voltage_ref': '3.28',
+            	'sample_rate': '0'  # Samples per second across all ports, read in the background (0 = read in the control loop)
 			} 
 		}
 
@@ -89,4 +90,5 @@ class ReadProbes(ProbeInterface):
 		self.time_delay = 0.008
 		self.device_info['ports'] = ['ADC0', 'ADC1', 'ADC2', 'ADC3']
 		i2c_bus_addr = BUSMAP[self.device_info['config'].get('i2c_bus_addr', '0x48')]
-		self.device = ADSDevice(i2c_bus_addr=i2c_bus_addr)
\ No newline at end of file
+		self.device = ADSDevice(i2c_bus_addr=i2c_bus_addr)
+		self._start_sampler()
\ No newline at end of file
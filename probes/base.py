@@ -19,6 +19,7 @@ Description:
 import math
 import time
 import logging
+import threading
 from probes.temp_queue import TempQueue
 
 '''
@@ -29,6 +30,9 @@ from probes.temp_queue import TempQueue
 
 class ProbeInterface:
 
+	bus = None  # Devices on the same bus (i.e. 'spi') are read one after another in concurrent mode, None = independent device
+	sampler = None  # ADCSampler, if the ports are sampled in the background
+
 	def __init__(self, probe_info, device_info, units):
 		self.units = units 
 		self.device_info = device_info
@@ -94,7 +98,7 @@ class ProbeInterface:
 		''' Build ports objects. '''
 		self.port_queues = {}
 		for port in self.port_map:
-			self.port_queues[port] = TempQueue(qlength=10, units=self.units)
+			self.port_queues[port] = TempQueue(qlength=10, units=self.units, filter=self.device_info['config'].get('temp_filter', 'mean'))
 
 	def _temp_to_resistance(self, temp, probe_profile):
 		'''
@@ -198,8 +202,11 @@ class ProbeInterface:
 		port_values = {}
 
 		for port in self.port_map:
-			''' Read Ports from Device '''
-			port_values[port] = self.device.read_voltage(port)
+			''' Read Ports from Device (or the average of the background samples since the last read) '''
+			if self.sampler is not None:
+				port_values[port] = self.sampler.read(port)
+			else:
+				port_values[port] = self.device.read_voltage(port)
 
 			''' Convert Voltage to Temperature and Tr '''
 			port_values[port], self.output_data['tr'][self.port_map[port]] = self._voltage_to_temp(port_values[port], self.probe_profiles[port], port=port)
@@ -220,11 +227,18 @@ class ProbeInterface:
 			elif port in self.aux_ports:
 				self.output_data['aux'][self.port_map[port]] = output_value
 
-			if self.time_delay:
+			if self.time_delay and self.sampler is None:
 				time.sleep(self.time_delay)  # Time delay, if needed for single-shot mode on some ADC's
 		
 		return self.output_data
 
+	def _start_sampler(self):
+		''' Sample the ports in the background if a sample rate is configured for the device (ADC's) '''
+		if self.sampler is not None:
+			self.sampler.stop()
+		rate = float(self.device_info['config'].get('sample_rate', 0) or 0)
+		self.sampler = ADCSampler(self.device, list(self.port_map), rate, min_interval=self.time_delay) if rate > 0 and self.port_map else None
+
 	def update_units(self, units):
 		self.units = 'C' if units == 'C' else 'F'
 		self._init_device()
@@ -258,6 +272,79 @@ class ProbeInterface:
 		else:
 			return None
 
+class ADCSampler:
+	'''
+	Reads the ports of a device round-robin in a background thread at a fixed rate and keeps the recent 
+	voltages of each port in a ring buffer.  There is a single writer (the thread) per buffer, which publishes 
+	a sample by advancing the write count after storing it, so read() needs no lock and never waits on the 
+	hardware (except for the first sample).  
+	'''
+	def __init__(self, device, ports, rate, min_interval=0, buffer_size=32):
+		'''
+		:param device: Device with read_voltage(port)
+		:param ports: Ports to sample
+		:param rate: Samples per second (across all ports)
+		:param min_interval: Minimum seconds between samples (i.e. the conversion time of the ADC)
+		:param buffer_size: Samples kept per port
+		'''
+		self.device = device
+		self.ports = ports
+		self.interval = max(1 / rate, min_interval)
+		self.buffer_size = buffer_size
+		self.buffers = {port : [0] * buffer_size for port in ports}
+		self.write_count = {port : 0 for port in ports}
+		self.read_count = {port : 0 for port in ports}
+		self.ready = threading.Event()  # Set once every port has a sample
+		self.stopped = False
+		self.logger = logging.getLogger("control")
+		self.thread = threading.Thread(target=self._run, name='adc-sampler', daemon=True)
+		self.thread.start()
+
+	def _run(self):
+		next_sample = time.monotonic()
+		while not self.stopped:
+			for port in self.ports:
+				if self.stopped:
+					return
+				try:
+					voltage = self.device.read_voltage(port)
+				except:
+					self.logger.exception(f'Exception occurred while sampling probe port {port}.  Trace dump: ')
+					voltage = None
+				count = self.write_count[port]
+				self.buffers[port][count % self.buffer_size] = voltage
+				self.write_count[port] = count + 1
+
+				# Fixed rate (a late sample doesn't delay the following ones, missed samples are skipped)
+				next_sample += self.interval
+				delay = next_sample - time.monotonic()
+				if delay > 0:
+					time.sleep(delay)
+				else:
+					next_sample = time.monotonic()
+			self.ready.set()
+
+	def read(self, port):
+		'''
+		:return: The average voltage of the samples since the last read (or the last sample if there is no new one)
+		'''
+		if not self.ready.is_set():
+			self.ready.wait(max(1, self.interval * len(self.ports) * 2))
+		write_count = self.write_count[port]
+		if write_count == 0:
+			return None
+		new = min(write_count - self.read_count[port], self.buffer_size - 1)  # The oldest slot may be written next
+		self.read_count[port] = write_count
+		if new == 0:
+			return self.buffers[port][(write_count - 1) % self.buffer_size]
+		samples = [self.buffers[port][(write_count - index) % self.buffer_size] for index in range(1, new + 1)]
+		samples = [voltage for voltage in samples if voltage is not None]
+		return sum(samples) / len(samples) if samples else None
+
+	def stop(self):
+		self.stopped = True
+		self.thread.join(timeout=1)
+
 class FakeDevice:
 
 	def __init__(self, port_map, primary_port, units):
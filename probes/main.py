@@ -9,6 +9,12 @@ Description:
   This module is the high level module that reports temperatures from 
   the device(s) hardware.  
 
+  In concurrent mode, the hardware devices are read by worker threads (one 
+  per bus, so devices on different buses are read in parallel).  Each call 
+  to read_probes() triggers a new sample from every worker and returns the 
+  last sample of each, so the caller never waits on the hardware.  Virtual 
+  devices are then calculated from those samples, in the configured order.  
+
 '''
 
 '''
@@ -18,14 +24,72 @@ Description:
 '''
 import importlib
 import logging
+import threading
+import time
+
+FIRST_SAMPLE_TIMEOUT = 5  # Seconds to wait for the first sample of a worker
+STALE_SAMPLE_TIME = 10  # Seconds after which a worker's sample is reported as stale
+
+def _merge_output(output_data, device_data):
+	for group in device_data:
+		for probe in device_data[group]:
+			output_data[group][probe] = device_data[group][probe]
+
+class ProbeReader:
+	'''
+	Worker thread that reads a group of probe devices (on the same bus) each time it is triggered, and keeps 
+	the last sample with its timestamp.  
+	'''
+	def __init__(self, name, devices, logger):
+		self.name = name
+		self.devices = devices
+		self.logger = logger
+		self.sample = None
+		self.timestamp = 0
+		self.lock = threading.Lock()  # Held while reading the devices
+		self.trigger = threading.Event()
+		self.ready = threading.Event()  # Set once the first sample is available
+		self.stopped = False
+		self.thread = threading.Thread(target=self._run, name=f'probes-{name}', daemon=True)
+		self.thread.start()
+
+	def _run(self):
+		while True:
+			self.trigger.wait()
+			self.trigger.clear()
+			if self.stopped:
+				return
+			sample = {
+				'primary' : {},
+				'food' : {},
+				'aux' : {}, 
+				'tr' : {}
+			}
+			with self.lock:
+				for device in self.devices:
+					try:
+						_merge_output(sample, device.read_all_ports(sample))
+					except:
+						self.logger.exception(f'Error reading probe device [{device.device_info["device"]}]: ')
+			self.sample = sample
+			self.timestamp = time.time()
+			self.ready.set()
+
+	def stop(self):
+		self.stopped = True
+		self.trigger.set()
 
 class ProbesMain:
 
-	def __init__(self, probe_map, units, disable=False):
+	def __init__(self, probe_map, units, disable=False, concurrent=False, temp_filter='mean'):
 		self.errors = []
 		self.logger = logging.getLogger("control")
 		self.units = units
 		self.disable = disable 
+		self.concurrent = concurrent
+		self.temp_filter = temp_filter  # Default temperature filter of the devices (a device config 'temp_filter' overrides it)
+		self.readers = []
+		self.stale_readers = set()
 		self.probe_devices = probe_map['probe_devices']
 		self.probe_info = probe_map['probe_info']
 		self.device_info_list = []
@@ -34,6 +98,7 @@ class ProbesMain:
 	def _setup_probe_devices(self, probe_devices):
 		error_event = None
 		self.probe_device_list = []
+		self.virtual_device_list = []
 		for device in probe_devices:
 			try: 
 				if not self.disable:
@@ -55,12 +120,33 @@ class ProbesMain:
 			'''
 			Send the probe information and the device information to the device module 
 			'''
-			instance = newmodule.ReadProbes(self.probe_info, device, self.units)
+			device_info = dict(device)
+			device_info['config'] = dict(device.get('config', {}))
+			device_info['config'].setdefault('temp_filter', self.temp_filter)
+			instance = newmodule.ReadProbes(self.probe_info, device_info, self.units)
 
 			'''
 			Append the probe device to the devices list
 			'''
 			self.probe_device_list.append(instance)
+			if modulename.startswith('virtual'):
+				self.virtual_device_list.append(instance)
+
+		if self.concurrent:
+			self._setup_readers()
+
+	def _setup_readers(self):
+		''' Start a worker for each bus (devices without a bus get a worker of their own) '''
+		for reader in self.readers:
+			reader.stop()
+		groups = {}
+		for device in self.probe_device_list:
+			if device in self.virtual_device_list:
+				continue
+			bus = device.bus if device.bus is not None else device.device_info['device']
+			groups.setdefault(bus, []).append(device)
+		self.readers = [ProbeReader(bus, devices, self.logger) for bus, devices in groups.items()]
+		self.stale_readers = set()
 
 	def read_probes(self):
 		'''
@@ -72,11 +158,36 @@ class ProbesMain:
 			'aux' : {}, 
 			'tr' : {}
 		}
+		if self.concurrent:
+			return self._read_probes_concurrent(output_data)
+
 		for device in self.probe_device_list:
 			device_data = device.read_all_ports(output_data)
-			for group in device_data:
-				for probe in device_data[group]:
-					output_data[group][probe] = device_data[group][probe]
+			_merge_output(output_data, device_data)
+
+		return output_data
+
+	def _read_probes_concurrent(self, output_data):
+		''' Trigger a new sample from each worker and use the last samples (waiting only for the first one) '''
+		for reader in self.readers:
+			reader.trigger.set()
+		now = time.time()
+		for reader in self.readers:
+			if not reader.ready.is_set() and not reader.ready.wait(FIRST_SAMPLE_TIMEOUT):
+				self.logger.error(f'No sample from probe device(s) on [{reader.name}] after {FIRST_SAMPLE_TIMEOUT} seconds.')
+				for device in reader.devices:
+					_merge_output(output_data, device.output_data)
+				continue
+			_merge_output(output_data, reader.sample)
+			if now - reader.timestamp > STALE_SAMPLE_TIME:
+				if reader.name not in self.stale_readers:
+					self.stale_readers.add(reader.name)
+					self.logger.error(f'The sample of probe device(s) on [{reader.name}] is {int(now - reader.timestamp)} seconds old.')
+			else:
+				self.stale_readers.discard(reader.name)
+
+		for device in self.virtual_device_list:
+			_merge_output(output_data, device.read_all_ports(output_data))
 
 		return output_data
 
@@ -86,9 +197,22 @@ class ProbesMain:
 		error = self._setup_probe_devices(self.probe_devices)
 		return error
 
+	def _pause_readers(self):
+		''' Hold the workers' locks, so devices aren't changed while being read '''
+		for reader in self.readers:
+			reader.lock.acquire()
+
+	def _resume_readers(self):
+		for reader in self.readers:
+			reader.lock.release()
+
 	def update_probe_profiles(self, probe_info):
-		for device in self.probe_device_list:
-			device.set_profiles(probe_info)
+		self._pause_readers()
+		try:
+			for device in self.probe_device_list:
+				device.set_profiles(probe_info)
+		finally:
+			self._resume_readers()
 
 	def update_units(self, units):
 		"""
@@ -99,8 +223,12 @@ class ProbesMain:
 
 		:return: None
 		"""
-		for device in self.probe_device_list:
-			device.update_units(units)
+		self._pause_readers()
+		try:
+			for device in self.probe_device_list:
+				device.update_units(units)
+		finally:
+			self._resume_readers()
 	
 	def get_errors(self):
 		return self.errors
@@ -191,6 +191,8 @@ class RTDDevice():
 
 class ReadProbes(ProbeInterface):
 
+	bus = 'spi'
+
 	def __init__(self, probe_info, device_info, units):
 		super().__init__(probe_info, device_info, units)
 
@@ -1,61 +1,114 @@
 #!/usr/bin/env python3
 
 '''
-	Class to track temperature averages coming from the probes and 
-	handle errors gracefully (hopefully).  
+	Class to track temperature averages coming from the probes and
+	handle errors gracefully (hopefully).
+
+	The readings are kept in a fixed size ring buffer along with the running mean and sum of squared
+	differences from the mean (Welford's method, updated for the reading that is replaced), so adding a
+	reading and getting the average / standard deviation take constant time regardless of the queue length.
+
+	Filters:
+		'mean' - Average of the queue (default)
+		'median' - Median of the queue (rejects single spikes)
+		'ema' - Exponential moving average of the readings (weight of the newest reading is ema_alpha)
+
+	With any filter, the last output is kept while the standard deviation of the queue exceeds the maximum.
 '''
 
+import math
 import statistics
 
+FILTERS = ['mean', 'median', 'ema']
+RECOMPUTE_INTERVAL = 1000  # Readings between exact recalculations of the running statistics (float drift)
+
 class TempQueue():
-	def __init__(self, qlength=10, units='F'):
-		self.queue = []
+	def __init__(self, qlength=10, units='F', filter='mean', ema_alpha=0.2):
 		self.units = units
 
 		if qlength < 2:
 			self.qlength = 2 # Set minimum qlength to 2
-		else: 
+		else:
 			self.qlength = qlength
-		
+
 		if units == 'F':
 			self.stdev_max = 4.75  # Standard Deviation Maximum for degrees F
 		else:
 			self.stdev_max = 2.25  # Standard Deviation Maximum for degrees C
+
+		self.filter = filter if filter in FILTERS else 'mean'
+		self.ema_alpha = ema_alpha
+
+		self.queue = []  # Ring buffer, empty until the first reading
+		self.index = 0  # Position of the oldest reading (the next one to be replaced)
+		self.mean = 0.0
+		self.m2 = 0.0  # Sum of squared differences from the mean
+		self.ema = 0.0
+		self.updates = 0
 		self.last_average = 0
 
 	def enqueue(self, value):
-		while len(self.queue) < (self.qlength + 1):
-			self.queue.insert(0, value)
-		self.queue.pop()
+		if not self.queue:
+			# The first reading fills the queue
+			self.queue = [value] * self.qlength
+			self.mean = float(value)
+			self.m2 = 0.0
+			self.ema = float(value)
+			self.index = 0
+			return(self.average())
+
+		old = self.queue[self.index]
+		self.queue[self.index] = value
+		self.index = (self.index + 1) % self.qlength
+
+		# Replace the oldest reading in the running statistics
+		delta = value - old
+		old_mean = self.mean
+		self.mean += delta / self.qlength
+		self.m2 += delta * (value - self.mean + old - old_mean)
+		self.ema += self.ema_alpha * (value - self.ema)
+
+		self.updates += 1
+		if self.updates >= RECOMPUTE_INTERVAL:
+			self.updates = 0
+			self.mean = sum(self.queue) / self.qlength
+			self.m2 = sum((reading - self.mean) ** 2 for reading in self.queue)
 		return(self.average())
 
+	def stdev(self):
+		return math.sqrt(max(self.m2, 0.0) / (self.qlength - 1))
+
+	def _filtered(self):
+		if self.filter == 'median':
+			return statistics.median(self.queue)
+		elif self.filter == 'ema':
+			return self.ema
+		return self.mean
+
+	def _rounded(self, average):
+		if self.units == 'F':
+			return(int(average))  # Give integer for F units
+		else:
+			return(round(average, 1))  # Give one digit of decimal for C units
+
 	def average(self):
-		if len(self.queue) < self.qlength:
-			# Handle case if queue isn't full 
+		if not self.queue:
+			# Handle case if queue isn't full
 			self.last_average = 0
 			return(0)
 		elif self.last_average == 0:
 			# Handle case if last_average isn't initialized
-			average = (sum(self.queue) / self.qlength)
+			average = self._filtered()
 			self.last_average = average
-			if self.units == 'F':
-				return(int(average))  # Give integer for F units
-			else: 
-				return(round(average, 1))  # Give one digit of decimal for C units
+			return(self._rounded(average))
 		else:
 			# Handle normal case
-			# Get standard deviation from temperatures in the queue
-			stdev = statistics.stdev(self.queue)
-			if stdev < self.stdev_max:
+			if self.stdev() < self.stdev_max:
 				# If the standard deviation is less than the max deviation, calculate the average temperature as normal
-				average = (sum(self.queue) / self.qlength)
+				average = self._filtered()
 				self.last_average = average
 			else:
 				# If the standard deviation exceeds the max deviation, keep the last average value
 				average = self.last_average
 
-			if self.units == 'F':
-				return(int(average))  # Give integer for F units
-			else: 
-				return(round(average, 1))  # Give one digit of decimal for C units
-
+			return(self._rounded(average))
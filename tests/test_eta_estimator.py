@@ -0,0 +1,58 @@
+from common.eta_estimator import ETAEstimator, ProbeEstimator
+
+CYCLE = 0.05  # Seconds between readings (rate of the control loop)
+
+
+def feed(estimator, start, seconds, temp_at):
+    now = start
+    while now < start + seconds:
+        estimator.update(now, {'Probe1' : temp_at(now)})
+        now += CYCLE
+    return now
+
+
+def test_eta_at_control_loop_rate():
+    estimator = ETAEstimator()
+    # Rising 1 degree per minute from 100
+    feed(estimator, 0, 600, lambda now: 100 + now / 60)
+    estimate = estimator.estimates({'Probe1' : 203})['Probe1']
+    assert estimate['rate'] is not None
+    assert abs(estimate['rate'] - 1.0) < 0.05
+    assert estimate['confidence'] > 0.5
+    # 93 degrees to go at 1 degree per minute
+    assert abs(estimate['eta'] - 93 * 60) < 120
+
+
+def test_no_eta_before_min_history():
+    estimator = ETAEstimator()
+    feed(estimator, 0, 30, lambda now: 100 + now / 60)
+    assert estimator.eta('Probe1', 203) is None
+
+
+def test_glitch_is_ignored():
+    probe = ProbeEstimator()
+    now = 0
+    while now < 300:
+        probe.update(now, 100 + now / 60)
+        now += 1
+    temp = probe.temp
+    probe.update(now, 300)  # Single spike
+    assert abs(probe.temp - temp) < 1
+
+
+def test_step_change_is_followed():
+    estimator = ETAEstimator()
+    now = feed(estimator, 0, 300, lambda now: 70)
+    # Probe moved to a colder spot
+    feed(estimator, now, 60, lambda now: 40)
+    assert abs(estimator.probes['Probe1'].temp - 40) < 1
+
+
+def test_disconnect_resets():
+    probe = ProbeEstimator()
+    for now in range(120):
+        probe.update(now, 100 + now / 60)
+    assert probe.ready()
+    probe.update(120, None)
+    assert not probe.ready()
+    assert probe.eta(203) is None
@@ -220,7 +220,7 @@ python board-config.py -ov 2>&1 | tee -a ~/logs/pifire_install.log
 ### Setup Supervisor to Start Apps on Boot / Restart on Failures
 echo " + Configuring Supervisord..." | tee -a /usr/local/bin/pifire/logs/upgrade.log
 
-# Copy configuration files (control.conf, webapp.conf) to supervisor config directory
+# Copy configuration files (control.conf, webapp.conf, media.conf) to supervisor config directory
 if [ "$OS_BITS" = "32" ]; then
     echo " + System is running a 32-bit OS, using legacy supervisor conf files" | tee -a /usr/local/bin/pifire/logs/upgrade.log
     cd /usr/local/bin/pifire/auto-install/supervisor/legacy
@@ -232,6 +232,7 @@ fi
 USERNAME=$(id -un)
 echo "user=$USERNAME" | tee -a control.conf > /dev/null
 echo "user=$USERNAME" | tee -a webapp.conf > /dev/null
+echo "user=$USERNAME" | tee -a media.conf > /dev/null
 $SUDO cp *.conf /etc/supervisor/conf.d/
 
 echo " - Upgrade Script Finished." | tee -a /usr/local/bin/pifire/logs/upgrade.log